@@ -98,6 +98,42 @@ DATABASES = {
     }
 }
 
+# Recipe data (recipes, tags, ingredients) is sharded by user across these
+# aliases; users and tokens always live on "default".
+DB_SHARDS = list(
+    filter(
+        None,
+        os.environ.get("DB_SHARDS", "").split(","),
+    ),
+) or ["default"]
+
+for alias in DB_SHARDS:
+    if alias not in DATABASES:
+        DATABASES[alias] = {
+            **DATABASES["default"],
+            "HOST": os.environ.get(
+                f"DB_HOST_{alias.upper()}",
+                DATABASES["default"]["HOST"],
+            ),
+            "NAME": os.environ.get(
+                f"DB_NAME_{alias.upper()}",
+                f"{DATABASES['default']['NAME']}_{alias}",
+            ),
+        }
+
+# Run every alias on local SQLite files, e.g. to exercise sharding locally.
+if os.environ.get("DB_SQLITE_DIR"):
+    for alias in DATABASES:
+        DATABASES[alias] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(
+                os.environ["DB_SQLITE_DIR"],
+                f"{alias}.sqlite3",
+            ),
+        }
+
+DATABASE_ROUTERS = ["core.sharding.ShardRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -136,10 +172,36 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
 STATIC_URL = "/static/static/"
-MEDIA_URL = "/static/media/"
+# media is only served to the owning user, see recipe.views.RecipeMediaView
+MEDIA_URL = "/api/media/"
 
 MEDIA_ROOT = "/vol/web/media"
 STATIC_ROOT = "/vol/web/static"
+# collected files get hashed names and precompressed siblings for nginx
+STATICFILES_STORAGE = "core.storage.CompressedManifestStaticFilesStorage"
+
+# Hand file responses to nginx through internal locations with
+# X-Accel-Redirect instead of streaming them through Python.
+X_ACCEL_REDIRECT = bool(int(os.environ.get("X_ACCEL_REDIRECT", 0)))
+
+THUMBNAIL_ROOT = "/vol/web/thumbnails"
+THUMBNAIL_MAX_BYTES = int(
+    os.environ.get("THUMBNAIL_MAX_BYTES", 256 * 1024 * 1024),
+)
+THUMBNAIL_WIDTHS = [64, 128, 256, 512, 1024]
+
+# Resumable image uploads are assembled here before being attached.
+UPLOAD_TEMP_ROOT = "/vol/web/partial-uploads"
+UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024
+# A user may have this many uploads open at once. Uploads are expired this
+# many seconds after they were started, and collect_orphaned_images deletes
+# them along with their assembled bytes.
+UPLOAD_MAX_OPEN = 5
+UPLOAD_MAX_AGE = 24 * 3600
+
+# Where collect_orphaned_images remembers how far its last run got.
+MEDIA_GC_CHECKPOINT = "/vol/web/media-gc.checkpoint"
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -148,15 +210,78 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "core.User"
 
+# Shared between all workers when memcached is configured, so limits and
+# counters hold across processes; a per-process cache otherwise.
+if os.environ.get("MEMCACHED_LOCATION"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+            "LOCATION": os.environ["MEMCACHED_LOCATION"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Token buckets refilled at the given rate and holding that many tokens,
+# per user (or client address) and scope. Views pick a scope with
+# throttle_scope, anything else is "read" or "write" by method.
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_THROTTLE_CLASSES": ["core.throttling.TokenBucketThrottle"],
+    # nginx passes the client address as REMOTE_ADDR, never trust headers
+    "NUM_PROXIES": 0,
+    "DEFAULT_THROTTLE_RATES": {
+        "read": os.environ.get("THROTTLE_READ", "1200/min"),
+        "write": os.environ.get("THROTTLE_WRITE", "300/min"),
+        "upload": os.environ.get("THROTTLE_UPLOAD", "60/min"),
+        "login": os.environ.get("THROTTLE_LOGIN", "20/min"),
+    },
 }
+THROTTLE_CACHE = "default"
+
+# Identical reads in flight at once share one leader's result. Followers
+# wait this many seconds for it before doing the work themselves. Across
+# processes leaders are elected with a lock in the shared cache.
+COALESCE_CACHE = "default"
+COALESCE_WAIT = float(os.environ.get("COALESCE_WAIT", 5))
+COALESCE_ACROSS_PROCESSES = bool(
+    int(os.environ.get("COALESCE_ACROSS_PROCESSES", 0)),
+)
+
+TEST_RUNNER = "core.test_runner.TestRunner"
+
+# Change events are streamed from this path by the ASGI application. The
+# broker carrying them between processes is picked by database when None.
+EVENTS_PATH = "/api/recipe/events/"
+EVENTS_BROKER = None
+# EventSource clients open streams with a ticket, good for one stream and
+# this many seconds, kept in this cache shared with the events server
+EVENTS_TICKET_CACHE = "default"
+EVENTS_TICKET_TTL = 30
+
+# Carries evictions of per-process caches to every process, picked by
+# database when None.
+INVALIDATION_TRANSPORT = None
+
+# Seconds nginx may serve a user's recipe reads from its micro-cache, 0
+# leaves the cache off. Writes purge the writing user's entries.
+MICROCACHE_TTL = int(os.environ.get("MICROCACHE_TTL", 0))
 
 
 SPECTACULAR_SETTINGS = {
     "COMPONENT_SPLIT_REQUEST": True,
 }
 
+# Identifies the deployed code; the served schema is rebuilt when it changes.
+APP_VERSION = os.environ.get("APP_VERSION", "dev")
+SCHEMA_CACHE_DIR = os.environ.get("SCHEMA_CACHE_DIR", "/vol/schema")
+# The schema checked into the repository, kept current by build_schema.
+SCHEMA_FILE = BASE_DIR / "schema.yml"
+
 
 CORS_ALLOWED_ORIGINS = ["http://localhost:5173", "https://bitnine-clone.vercel.app"]
 
@@ -13,33 +13,33 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularSwaggerView,
-)
+from drf_spectacular.views import SpectacularSwaggerView
 
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
-from django.conf import settings
 from core import views as core_views
+from recipe import views as recipe_views
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("health-check/", core_views.health_check, name="health-check"),
-    path("api/schema/", SpectacularAPIView.as_view(), name="api-schema"),
+    path("api/schema/", core_views.SchemaView.as_view(), name="api-schema"),
     path(
         "api/docs/",
         SpectacularSwaggerView.as_view(url_name="api-schema"),
         name="api-docs",
     ),
+    path("api/batch/", core_views.BatchView.as_view(), name="batch"),
+    path(
+        "api/recipe/events/ticket/",
+        core_views.EventsTicketView.as_view(),
+        name="events-ticket",
+    ),
     path("api/user/", include("user.urls")),
     path("api/recipe/", include("recipe.urls")),
+    path(
+        "api/media/<path:path>",
+        recipe_views.RecipeMediaView.as_view(),
+        name="media",
+    ),
 ]
-
-
-if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL,
-        document_root=settings.MEDIA_ROOT,
-    )
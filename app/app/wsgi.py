@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+# uWSGI imports this module once in the master and forks the workers from
+# it, so anything loaded now is shared between them.
+if bool(int(os.environ.get("WSGI_PRELOAD", 1))):
+    from core.warmup import warm_up
+
+    warm_up()
@@ -1,11 +1,285 @@
 """
 Django admin customization
 """
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.admin.widgets import (
+    AutocompleteSelect,
+    AutocompleteSelectMultiple,
+)
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import QueryDict
+from django.utils.http import urlencode
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
 from core import models
+from core.sharding import is_sharded
+
+
+class EstimatedCountPaginator(Paginator):
+    """paginator trusting the planner's row estimate for whole tables
+
+    An exact COUNT(*) reads every row on Postgres. When a changelist is
+    neither searched nor filtered, pg_class.reltuples is close enough to
+    number the pages; smaller or filtered lists are still counted exactly.
+    The estimate comes from the database the list is read from.
+    """
+
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.threshold:
+                return int(row[0])
+        return super().count
+
+
+class UserFilter(admin.SimpleListFilter):
+    """filter by owner without listing every user as a choice
+
+    The owner column links here, so only the chosen user is looked up.
+    """
+
+    title = _("user")
+    parameter_name = "user_id"
+
+    def lookups(self, request, model_admin):
+        value = self.value()
+        if not value or not value.isdigit():
+            return []
+        email = (
+            get_user_model()
+            .objects.filter(pk=value)
+            .values_list("email", flat=True)
+            .first()
+        )
+        return [(value, email or value)]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(user_id=value)
+        return queryset
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """pick the shard whose rows are listed, the first one by default
+
+    The rows are read from the shard by UserDataAdmin.get_queryset.
+    """
+
+    title = _("shard")
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.DB_SHARDS]
+
+    def has_output(self):
+        return len(settings.DB_SHARDS) > 1
+
+    def value(self):
+        value = super().value()
+        return value if value in settings.DB_SHARDS else settings.DB_SHARDS[0]
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                "selected": self.value() == lookup,
+                "query_string": changelist.get_query_string(
+                    {self.parameter_name: lookup},
+                ),
+                "display": title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset
+
+
+class ShardAutocompleteMixin:
+    """ask the autocomplete view for one shard and owner's rows
+
+    The parameters are read back by UserDataAdmin on the related admin.
+    """
+
+    def __init__(self, *args, params=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.params = params or {}
+
+    def get_url(self):
+        url = super().get_url()
+        return f"{url}?{urlencode(self.params)}" if self.params else url
+
+
+class ShardAutocompleteSelect(ShardAutocompleteMixin, AutocompleteSelect):
+    pass
+
+
+class ShardAutocompleteSelectMultiple(
+    ShardAutocompleteMixin,
+    AutocompleteSelectMultiple,
+):
+    pass
+
+
+class UserDataAdmin(admin.ModelAdmin):
+    """base admin for large per-user tables"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_filter = [ShardFilter, UserFilter]
+    raw_id_fields = ["user"]
+    ordering = ["-id"]
+
+    def get_shard(self, request):
+        """return the shard picked for the list, or the first shard
+
+        Pages opened from the list carry its filters along in
+        _changelist_filters.
+        """
+        params = request.GET
+        if "_changelist_filters" in params:
+            params = QueryDict(params["_changelist_filters"])
+        alias = params.get(ShardFilter.parameter_name)
+        return alias if alias in settings.DB_SHARDS else settings.DB_SHARDS[0]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).using(self.get_shard(request))
+        if queryset.db != "default":
+            # users live in the default database, so they can't be joined
+            queryset = queryset.prefetch_related("user")
+        return queryset
+
+    def get_owner_id(self, request):
+        """return the id of the user owning the edited object, if known
+
+        A submitted form names the owner; otherwise it is looked up from
+        the object on the picked shard.
+        """
+        value = request.POST.get("user", "")
+        if value.isdigit():
+            return int(value)
+        match = request.resolver_match
+        object_id = match.kwargs.get("object_id", "") if match else ""
+        if not object_id.isdigit():
+            return None
+        return (
+            self.model._default_manager.using(self.get_shard(request))
+            .filter(pk=object_id)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+
+    def get_list_select_related(self, request):
+        return ["user"] if self.get_shard(request) == "default" else False
+
+    def shard_field_kwargs(self, db_field, request, widget_class, kwargs):
+        """read choices of a sharded relation from the owner's rows
+
+        The rows sit on the shard being edited, and only the owner's can
+        be attached.
+        """
+        shard = self.get_shard(request)
+        owner_id = self.get_owner_id(request)
+        kwargs["using"] = shard
+        if "queryset" not in kwargs:
+            queryset = self.get_field_queryset(shard, db_field, request)
+            if queryset is None:
+                queryset = db_field.related_model._default_manager.using(
+                    shard,
+                )
+            if owner_id is not None:
+                queryset = queryset.filter(user_id=owner_id)
+            kwargs["queryset"] = queryset
+        if "widget" not in kwargs and (
+            db_field.name in self.get_autocomplete_fields(request)
+        ):
+            params = {ShardFilter.parameter_name: shard}
+            if owner_id is not None:
+                params[UserFilter.parameter_name] = owner_id
+            kwargs["widget"] = widget_class(
+                db_field,
+                self.admin_site,
+                using=shard,
+                params=params,
+            )
+        return kwargs
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if is_sharded(db_field.related_model):
+            kwargs = self.shard_field_kwargs(
+                db_field,
+                request,
+                ShardAutocompleteSelect,
+                kwargs,
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if is_sharded(db_field.related_model):
+            kwargs = self.shard_field_kwargs(
+                db_field,
+                request,
+                ShardAutocompleteSelectMultiple,
+                kwargs,
+            )
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+    def get_search_results(self, request, queryset, search_term):
+        """look a number up by primary key, anything else by prefix
+
+        Autocomplete lookups are narrowed to the owner named by the form.
+        """
+        if request.resolver_match and (
+            request.resolver_match.url_name == "autocomplete"
+        ):
+            value = request.GET.get(UserFilter.parameter_name, "")
+            if value.isdigit():
+                queryset = queryset.filter(user_id=value)
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+    @admin.display(description=_("user"), ordering="user_id")
+    def owner(self, obj):
+        """link to this list filtered down to the object's user"""
+        return format_html(
+            '<a href="?{}={}&amp;{}={}">{}</a>',
+            ShardFilter.parameter_name,
+            obj._state.db,
+            UserFilter.parameter_name,
+            obj.user_id,
+            obj.user.email,
+        )
+
+
+class RecipeAdmin(UserDataAdmin):
+    """admin pages for recipes"""
+
+    list_display = ["id", "title", "owner", "time_minutes", "price"]
+    search_fields = ["^title"]
+    autocomplete_fields = ["tags", "ingredients"]
+
+
+class RecipeAttrAdmin(UserDataAdmin):
+    """admin pages for tags and ingredients"""
+
+    list_display = ["id", "name", "owner"]
+    search_fields = ["^name"]
 
 
 class UserAdmin(BaseUserAdmin):
@@ -13,6 +287,9 @@ class UserAdmin(BaseUserAdmin):
 
     ordering = ["id"]
     list_display = ["email", "name"]
+    search_fields = ["^email"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (
             None,
@@ -55,7 +332,24 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class AccountDeletionAdmin(admin.ModelAdmin):
+    """show the progress of queued account deletions"""
+
+    ordering = ["-created_at"]
+    list_display = [
+        "user_id",
+        "status",
+        "recipes_deleted",
+        "recipes_total",
+        "created_at",
+        "finished_at",
+    ]
+    list_filter = ["status"]
+    readonly_fields = ["user_id", "recipes_total", "recipes_deleted"]
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.Tag, RecipeAttrAdmin)
+admin.site.register(models.Ingredient, RecipeAttrAdmin)
+admin.site.register(models.AccountDeletion, AccountDeletionAdmin)
@@ -0,0 +1,51 @@
+"""
+Token authentication remembering tokens in each process
+"""
+
+from django.contrib.auth import get_user_model
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.invalidation import LocalCache
+
+
+# token key -> (user field values, token created), evicted when the token
+# or its user changes
+tokens = LocalCache(
+    Token._meta.label_lower,
+    watches=[get_user_model()._meta.label_lower],
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """authenticate tokens without a query once seen by this process
+
+    Requests get instances of their own built from the cached values, so
+    nothing one request caches on its user leaks into the next.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = tokens.get(key)
+        if cached is not None:
+            return self.build(key, *cached)
+
+        version = tokens.version
+        user, token = super().authenticate_credentials(key)
+        values = [
+            getattr(user, field.attname)
+            for field in user._meta.concrete_fields
+        ]
+        tokens.set(key, (values, token.created), user.pk, version)
+        return user, token
+
+    def build(self, key, values, created):
+        User = get_user_model()
+        user = User.from_db(
+            "default",
+            [field.attname for field in User._meta.concrete_fields],
+            values,
+        )
+        token = Token(key=key, user=user, created=created)
+        token._state.adding = False
+        token._state.db = "default"
+        return user, token
@@ -0,0 +1,265 @@
+"""
+Running several API operations in one request
+
+Each operation is dispatched in-process to the view its path resolves
+to, as the user the batch request authenticated as. Operations may be
+named, and later ones refer to the results of earlier ones with
+"{{name.field}}" in their path or body. A body value that is nothing but
+a reference takes the referenced value as is, otherwise it is formatted
+into the string.
+"""
+
+import io
+import json
+import logging
+import re
+from contextlib import ExitStack
+from urllib.parse import urlsplit
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.urls import Resolver404, resolve
+from rest_framework import serializers, status
+
+from core import microcache, sharding
+
+
+logger = logging.getLogger(__name__)
+
+MAX_OPERATIONS = 25
+# only the APIs of these URL namespaces can be batched
+NAMESPACES = {"recipe", "user"}
+REFERENCE = re.compile(r"\{\{(\w+)((?:\.\w+)*)\}\}")
+# left out of results: the length of a body that is re-encoded, and, with
+# any X-Accel-* header, instructions for the proxy, which only strips them
+# from the batch response itself
+OMITTED_HEADERS = {
+    "content-length",
+    microcache.TAG_HEADER.lower(),
+    microcache.PURGE_HEADER.lower(),
+}
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    """serializer for one operation of a batch"""
+
+    name = serializers.RegexField(r"^\w+$", max_length=50, required=False)
+    method = serializers.ChoiceField(
+        choices=["GET", "POST", "PUT", "PATCH", "DELETE"],
+    )
+    path = serializers.CharField(max_length=2000)
+    body = serializers.JSONField(required=False)
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    """serializer for a batch of operations"""
+
+    operations = BatchOperationSerializer(many=True, allow_empty=False)
+    atomic = serializers.BooleanField(default=False)
+
+    def validate_operations(self, operations):
+        if len(operations) > MAX_OPERATIONS:
+            raise serializers.ValidationError(
+                f"Ensure there are at most {MAX_OPERATIONS} operations"
+            )
+        names = [op["name"] for op in operations if "name" in op]
+        if len(names) != len(set(names)):
+            raise serializers.ValidationError("Names must be unique")
+        return operations
+
+
+class BatchResultSerializer(serializers.Serializer):
+    """serializer for the outcome of one operation"""
+
+    name = serializers.CharField(required=False)
+    status = serializers.IntegerField()
+    headers = serializers.DictField(child=serializers.CharField())
+    body = serializers.JSONField(allow_null=True)
+
+
+class BatchResponseSerializer(serializers.Serializer):
+    """serializer for the outcomes of a batch"""
+
+    committed = serializers.BooleanField()
+    results = BatchResultSerializer(many=True)
+
+
+class OperationFailed(Exception):
+    """an operation can't run, its result is given by status and detail"""
+
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _lookup(name, fields, results):
+    """return the value a reference points at in earlier results"""
+    if name not in results:
+        raise OperationFailed(
+            status.HTTP_400_BAD_REQUEST,
+            f"Unknown operation {name!r} referenced",
+        )
+    result = results[name]
+    if result["status"] >= 400:
+        raise OperationFailed(
+            status.HTTP_424_FAILED_DEPENDENCY,
+            f"Referenced operation {name!r} failed",
+        )
+    value = result["body"]
+    for field in fields:
+        try:
+            value = value[int(field) if isinstance(value, list) else field]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise OperationFailed(
+                status.HTTP_400_BAD_REQUEST,
+                f"Operation {name!r} has no {field!r} to reference",
+            )
+    return value
+
+
+def _substitute(value, results):
+    """return value with the references in it replaced"""
+    if isinstance(value, dict):
+        return {key: _substitute(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, results) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    def lookup(match):
+        fields = match.group(2).split(".")[1:]
+        return _lookup(match.group(1), fields, results)
+
+    match = REFERENCE.fullmatch(value)
+    if match:
+        return lookup(match)
+    return REFERENCE.sub(lambda match: str(lookup(match)), value)
+
+
+def _sub_request(request, method, path, body):
+    """return a request for one operation, authenticated as request"""
+    url = urlsplit(path)
+    data = b"" if body is None else json.dumps(body).encode()
+    environ = {
+        key: value
+        for key, value in request.META.items()
+        # conditions of the batch request don't apply to its operations
+        if not key.startswith("HTTP_IF_")
+    }
+    environ.update(
+        {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": url.path,
+            "QUERY_STRING": url.query,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(data)),
+            "wsgi.input": io.BytesIO(data),
+        }
+    )
+    sub = WSGIRequest(environ)
+    # DRF takes these as the result of authentication, so the batch
+    # request's credentials are only checked once
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def _body(response):
+    """return the content of response as JSON data or text"""
+    if response.streaming:
+        response.close()
+        return None
+    if not response.content:
+        return None
+    if "json" in response.get("Content-Type", ""):
+        return json.loads(response.content)
+    return response.content.decode(errors="replace")
+
+
+def run_operation(request, operation, results, in_transaction):
+    """dispatch one operation and return its result"""
+    path = _substitute(operation["path"], results)
+    body = _substitute(operation.get("body"), results)
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        match = None
+    if match is None or match.namespace not in NAMESPACES:
+        raise OperationFailed(status.HTTP_404_NOT_FOUND, "Not found.")
+
+    sub = _sub_request(request, operation["method"], path, body)
+    sub.batch_transaction = in_transaction
+    response = match.func(sub, *match.args, **match.kwargs)
+    if hasattr(response, "render"):
+        response.render()
+    return {
+        "status": response.status_code,
+        "headers": {
+            name: value
+            for name, value in response.items()
+            if name.lower() not in OMITTED_HEADERS
+            and not name.lower().startswith("x-accel-")
+        },
+        "body": _body(response),
+    }
+
+
+def _failure(status_code, detail):
+    return {"status": status_code, "headers": {}, "body": {"detail": detail}}
+
+
+def run(request, operations, atomic):
+    """run operations in order, returning (committed, results)
+
+    With atomic, the operations share one transaction on each database
+    they may touch, and the first failing operation rolls all of them
+    back and stops the batch.
+    """
+    results = []
+    named = {}
+
+    def run_all():
+        for operation in operations:
+            try:
+                result = run_operation(request, operation, named, atomic)
+            except OperationFailed as e:
+                result = _failure(e.status, e.detail)
+            except Exception:
+                logger.exception("Batch operation failed")
+                result = _failure(
+                    status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "Server error.",
+                )
+            if "name" in operation:
+                result["name"] = operation["name"]
+                named[operation["name"]] = result
+            results.append(result)
+            if atomic and result["status"] >= 400:
+                raise _Rollback()
+
+    if not atomic:
+        run_all()
+        return True, results
+
+    aliases = {"default", sharding.shard_for_user(request.user)}
+    try:
+        with ExitStack() as stack:
+            for alias in sorted(aliases):
+                stack.enter_context(transaction.atomic(using=alias))
+            run_all()
+    except _Rollback:
+        for operation in operations[len(results):]:
+            result = _failure(
+                status.HTTP_424_FAILED_DEPENDENCY,
+                "Not run, an earlier operation failed.",
+            )
+            if "name" in operation:
+                result["name"] = operation["name"]
+            results.append(result)
+        return False, results
+    return True, results
@@ -0,0 +1,162 @@
+"""
+Single-flight coalescing of identical expensive reads
+
+The first caller for a key becomes the leader and computes the result,
+identical calls made while it runs wait for that result instead of doing
+the same work again. Within a process followers wait on an event. With
+COALESCE_ACROSS_PROCESSES on, the leader also takes a lock in the shared
+cache and publishes its result there for followers in other workers.
+
+Followers wait at most COALESCE_WAIT seconds and then compute the result
+themselves, as they do when the leader fails or the shared cache can't be
+used, so coalescing never makes a call fail that would have succeeded on
+its own.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+# how often followers in other processes look for the leader's result
+POLL_INTERVAL = 0.02
+
+_missing = object()
+
+
+class _Flight:
+    """a computation in progress that callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def make_key(*parts):
+    """return a cache safe key identifying parts"""
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()
+    return f"coalesce:{digest}"
+
+
+def _generation_key(scope):
+    return f"coalesce:generation:{scope}"
+
+
+def generation(scope):
+    """return the write generation of scope, for keys of its reads"""
+    cache = caches[settings.COALESCE_CACHE]
+    try:
+        return cache.get(_generation_key(scope), 0)
+    except Exception:
+        logger.exception("Reading coalescing generation failed")
+        # a generation of its own, the read joins no other
+        return uuid.uuid4().hex
+
+
+def bump(scope):
+    """start a new generation of scope, so later reads don't join earlier"""
+    cache = caches[settings.COALESCE_CACHE]
+    key = _generation_key(scope)
+    try:
+        if not cache.add(key, 1, timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # evicted since the add, starting over is a new generation
+                cache.add(key, 1, timeout=None)
+    except Exception:
+        # only reads already in flight can still be joined
+        logger.exception("Bumping coalescing generation failed")
+
+
+def _unlock(cache, key, token):
+    try:
+        if cache.get(key) == token:
+            cache.delete(key)
+    except Exception:
+        # the lock expires on its own
+        logger.exception("Releasing coalescing lock failed")
+
+
+def _run_shared(key, compute):
+    """run compute once across processes sharing the cache"""
+    cache = caches[settings.COALESCE_CACHE]
+    wait = settings.COALESCE_WAIT
+    token = uuid.uuid4().hex
+    try:
+        # the lock expires on its own should its holder die
+        locked = cache.add(key, token, wait)
+    except Exception:
+        logger.exception("Taking coalescing lock failed")
+        return compute()
+
+    if locked:
+        try:
+            result = compute()
+            try:
+                # only followers that saw this token read it, while they wait
+                cache.set(f"{key}:{token}", result, wait)
+            except Exception:
+                # followers compute themselves once the lock is released
+                logger.exception("Publishing coalesced result failed")
+            return result
+        finally:
+            _unlock(cache, key, token)
+
+    try:
+        leader = cache.get(key)
+        deadline = time.monotonic() + wait
+        while leader is not None and time.monotonic() < deadline:
+            # the leader publishes before unlocking, so read in reverse order
+            current = cache.get(key)
+            result = cache.get(f"{key}:{leader}", _missing)
+            if result is not _missing:
+                return result
+            if current != leader:
+                break
+            time.sleep(POLL_INTERVAL)
+    except Exception:
+        logger.exception("Waiting for coalesced result failed")
+    return compute()
+
+
+def run(key, compute):
+    """return compute(), sharing one call among identical concurrent ones
+
+    The result is handed to every follower as is, so it must not be
+    changed by callers, and must pickle when shared across processes.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(settings.COALESCE_WAIT) and flight.ok:
+            return flight.result
+        return compute()
+
+    try:
+        if settings.COALESCE_ACROSS_PROCESSES:
+            flight.result = _run_shared(key, compute)
+        else:
+            flight.result = compute()
+        flight.ok = True
+        return flight.result
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
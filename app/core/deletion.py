@@ -0,0 +1,237 @@
+"""
+Batched deletion of recipes and whole accounts
+
+Deleting through the ORM collector loads every recipe, tag, ingredient and
+through row of the objects being deleted before removing any of them. The
+helpers here delete bounded batches of ids with raw set-based statements
+in dependency order instead, and send recipes_deleted once per batch so
+images and indexes are cleaned up in aggregate.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.invalidation import bus
+from core.models import (
+    AccountDeletion,
+    ImageUpload,
+    Ingredient,
+    IngredientPosting,
+    Recipe,
+    RecipeBucket,
+    RecipeSignature,
+    Tag,
+    UserShard,
+)
+
+
+BATCH_SIZE = 500
+# a running job untouched for this long is taken to have lost its worker
+STALE_AFTER = 600
+
+# Sent once per deleted batch of recipes, with sender Recipe and the
+# arguments user_id, recipe_ids, ingredient_ids (ingredients whose postings
+# should drop the recipes), images (one image name per recipe that had
+# one), upload_ids (unfinished image uploads of the recipes) and using.
+recipes_deleted = Signal()
+
+
+def _batches(ids, batch_size):
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        yield ids[start:start + batch_size]
+
+
+def _delete_recipe_batch(user_id, recipe_ids, using, reindex):
+    with transaction.atomic(using=using):
+        rows = list(
+            Recipe.objects.using(using)
+            .filter(user_id=user_id, id__in=recipe_ids)
+            .values_list("id", "image")
+        )
+        if not rows:
+            return 0
+        recipe_ids = [recipe_id for recipe_id, image in rows]
+        ingredient_links = Recipe.ingredients.through.objects.using(
+            using,
+        ).filter(recipe_id__in=recipe_ids)
+        ingredient_ids = set()
+        if reindex:
+            ingredient_ids = set(
+                ingredient_links.values_list("ingredient_id", flat=True)
+            )
+        uploads = ImageUpload.objects.using(using).filter(
+            recipe_id__in=recipe_ids,
+        )
+        upload_ids = list(uploads.values_list("id", flat=True))
+
+        # rows pointing at recipes go first, then the recipes themselves
+        for queryset in [
+            uploads,
+            RecipeSignature.objects.using(using).filter(
+                recipe_id__in=recipe_ids,
+            ),
+            RecipeBucket.objects.using(using).filter(
+                recipe_id__in=recipe_ids,
+            ),
+            Recipe.tags.through.objects.using(using).filter(
+                recipe_id__in=recipe_ids,
+            ),
+            ingredient_links,
+            Recipe.objects.using(using).filter(id__in=recipe_ids),
+        ]:
+            queryset._raw_delete(using)
+
+        recipes_deleted.send(
+            sender=Recipe,
+            user_id=user_id,
+            recipe_ids=recipe_ids,
+            ingredient_ids=ingredient_ids,
+            images=[image for recipe_id, image in rows if image],
+            upload_ids=upload_ids,
+            using=using,
+        )
+    return len(rows)
+
+
+def delete_recipes(
+    user_id,
+    recipe_ids,
+    using,
+    batch_size=BATCH_SIZE,
+    progress=None,
+):
+    """delete a user's recipes and everything hanging off them
+
+    Each batch is deleted in its own transaction. progress is called with
+    the running count of deleted recipes after each batch.
+    """
+    deleted = 0
+    for batch in _batches(recipe_ids, batch_size):
+        deleted += _delete_recipe_batch(user_id, batch, using, True)
+        if progress:
+            progress(deleted)
+    return deleted
+
+
+def _delete_in_batches(queryset, batch_size):
+    """raw delete the rows of queryset, batch_size at a time"""
+    using = queryset.db
+    manager = queryset.model.objects.using(using)
+    while True:
+        pks = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return
+        with transaction.atomic(using=using):
+            manager.filter(pk__in=pks)._raw_delete(using)
+
+
+def delete_user_data(user_id, alias, batch_size=BATCH_SIZE, progress=None):
+    """delete a user's recipe data from alias in bounded batches"""
+    recipes = (
+        Recipe.objects.using(alias)
+        .filter(user_id=user_id)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    deleted = 0
+    while True:
+        batch = list(recipes[:batch_size])
+        if not batch:
+            break
+        # the postings go wholesale below, so don't reindex them
+        deleted += _delete_recipe_batch(user_id, batch, alias, False)
+        if progress:
+            progress(deleted)
+
+    for model in [IngredientPosting, Ingredient, Tag]:
+        _delete_in_batches(
+            model.objects.using(alias).filter(user_id=user_id),
+            batch_size,
+        )
+    return deleted
+
+
+def request_account_deletion(user):
+    """lock user out and queue the deletion of their account"""
+    with transaction.atomic():
+        User = get_user_model()
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        # the update bypasses the signals evicting cached logins
+        bus.publish(User._meta.label_lower, user.pk, user.pk)
+        Token.objects.filter(user_id=user.pk).delete()
+        job = AccountDeletion.objects.filter(
+            user_id=user.pk,
+        ).exclude(status=AccountDeletion.FAILED).first()
+        if job is None:
+            job = AccountDeletion.objects.create(user_id=user.pk)
+    return job
+
+
+def claim_job():
+    """return the next job to run, marked as running, or None"""
+    stale = timezone.now() - timedelta(seconds=STALE_AFTER)
+    with transaction.atomic():
+        job = (
+            AccountDeletion.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=AccountDeletion.PENDING)
+                | Q(status=AccountDeletion.RUNNING, updated_at__lt=stale)
+            )
+            .order_by("created_at")
+            .first()
+        )
+        if job is not None:
+            job.status = AccountDeletion.RUNNING
+            job.save(update_fields=["status", "updated_at"])
+    return job
+
+
+def run_account_deletion(job, batch_size=BATCH_SIZE):
+    """delete the account of job, recording progress as it goes"""
+    jobs = AccountDeletion.objects.filter(pk=job.pk)
+    try:
+        alias = (
+            UserShard.objects.filter(user_id=job.user_id)
+            .values_list("alias", flat=True)
+            .first()
+        )
+        if alias is not None and alias not in settings.DB_SHARDS:
+            # deleting the user would orphan the data left on the shard
+            raise ValueError(f"Unknown shard {alias}")
+        if alias is not None:
+            total = Recipe.objects.using(alias).filter(
+                user_id=job.user_id,
+            ).count()
+            job.recipes_total = job.recipes_deleted + total
+            jobs.update(recipes_total=job.recipes_total)
+            done = job.recipes_deleted
+
+            def progress(deleted):
+                job.recipes_deleted = done + deleted
+                jobs.update(
+                    recipes_deleted=job.recipes_deleted,
+                    updated_at=timezone.now(),
+                )
+
+            delete_user_data(job.user_id, alias, batch_size, progress)
+
+        # only small default database rows are left for the collector
+        get_user_model().objects.filter(pk=job.user_id).delete()
+    except Exception as e:
+        job.status = AccountDeletion.FAILED
+        job.error = repr(e)
+        jobs.update(status=job.status, error=job.error)
+        raise
+
+    job.status = AccountDeletion.DONE
+    job.finished_at = timezone.now()
+    jobs.update(status=job.status, finished_at=job.finished_at)
+    return job
@@ -0,0 +1,250 @@
+"""
+Change events of a user's recipes, tags and ingredients
+
+Changes are published once their transaction commits, as small JSON
+messages naming the user, the kind of object, what happened and the ids
+involved. Clients hold a server-sent events stream (see core.sse) and
+refetch what the events name instead of polling.
+
+Messages travel through a broker. PostgreSQL carries them between
+processes with NOTIFY, and every process running streams keeps a single
+LISTEN connection whose messages its hub fans out to the streams of the
+users named. Without PostgreSQL the memory broker only reaches streams in
+the publishing process, which is enough for tests and development.
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads are limited to 8000 bytes, so long id lists are split
+MAX_IDS = 500
+# events a stream can fall behind by before it's told to start over
+QUEUE_SIZE = 100
+# seconds before a lost LISTEN connection is opened again
+RECONNECT_DELAY = 5
+
+
+def message(user_id, kind, action, ids):
+    """return the serialized event of ids of kind changing by action"""
+    return json.dumps(
+        {"user": user_id, "type": kind, "action": action, "ids": ids},
+        separators=(",", ":"),
+    )
+
+
+def publish(user_id, kind, action, ids, using="default"):
+    """send change events once the transaction on using commits"""
+    ids = sorted(ids)
+    if not ids:
+        return
+    messages = [
+        message(user_id, kind, action, ids[start:start + MAX_IDS])
+        for start in range(0, len(ids), MAX_IDS)
+    ]
+
+    def send():
+        broker = get_broker()
+        for payload in messages:
+            try:
+                broker.publish(payload)
+            except Exception:
+                # the change itself is committed, clients catch up on
+                # their next full fetch
+                logger.exception("Publishing change event failed")
+
+    transaction.on_commit(send, using=using)
+
+
+class MemoryBroker:
+    """deliver messages to listeners in this process only"""
+
+    def __init__(self):
+        self.listeners = set()
+
+    def publish(self, payload):
+        for listener in list(self.listeners):
+            listener(payload)
+
+    def listen(self, callback, on_lost):
+        """call callback on the running loop with each published message"""
+        loop = asyncio.get_running_loop()
+
+        def listener(payload):
+            loop.call_soon_threadsafe(callback, payload)
+
+        self.listeners.add(listener)
+        return lambda: self.listeners.discard(listener)
+
+
+class PostgresBroker:
+    """carry messages between processes with NOTIFY and LISTEN"""
+
+    channel = "recipe_events"
+
+    def publish(self, payload):
+        with connections["default"].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)",
+                [self.channel, payload],
+            )
+
+    def listen(self, callback, on_lost):
+        """call callback on the running loop with each notification
+
+        The connection is watched by the event loop, so waiting costs no
+        thread. on_lost is called if it breaks, as messages may be lost.
+        """
+        import psycopg2
+
+        loop = asyncio.get_running_loop()
+        params = connections["default"].get_connection_params()
+        conn = psycopg2.connect(**params)
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+
+        def close():
+            loop.remove_reader(conn.fileno())
+            conn.close()
+
+        def readable():
+            try:
+                conn.poll()
+            except psycopg2.Error:
+                logger.exception("Change event listener lost")
+                close()
+                on_lost()
+                return
+            while conn.notifies:
+                callback(conn.notifies.pop(0).payload)
+
+        loop.add_reader(conn.fileno(), readable)
+        return close
+
+
+_brokers = {}
+
+
+def get_broker():
+    """return the broker in use, by setting or by database"""
+    path = settings.EVENTS_BROKER
+    if path is None:
+        if connections["default"].vendor == "postgresql":
+            path = "core.events.PostgresBroker"
+        else:
+            path = "core.events.MemoryBroker"
+    if path not in _brokers:
+        _brokers[path] = import_string(path)()
+    return _brokers[path]
+
+
+class Stream:
+    """the events waiting to be sent to one client"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.reset()
+
+    def reset(self):
+        """drop waiting events and tell the client to fetch everything"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self):
+        """return the next message, or None when the client must refetch"""
+        return await self.queue.get()
+
+
+class Hub:
+    """fan messages out to the streams held by this process"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.streams = defaultdict(set)
+        self.stop_listening = None
+
+    def start(self):
+        """listen to the broker, from the event loop, if not already"""
+        if self.stop_listening is None:
+            self.stop_listening = self.broker.listen(
+                self.dispatch,
+                self.lost,
+            )
+
+    def stop(self):
+        if self.stop_listening is not None:
+            self.stop_listening()
+            self.stop_listening = None
+
+    def lost(self):
+        """reset every stream and listen again after a while"""
+        self.stop_listening = None
+        for streams in self.streams.values():
+            for stream in streams:
+                stream.reset()
+        asyncio.get_running_loop().call_later(RECONNECT_DELAY, self.restart)
+
+    def restart(self):
+        try:
+            self.start()
+        except Exception:
+            logger.exception("Change event listener failed to reconnect")
+            self.lost()
+
+    def subscribe(self, user_id):
+        """return a new stream of the events of user_id"""
+        self.start()
+        stream = Stream(user_id)
+        self.streams[user_id].add(stream)
+        return stream
+
+    def unsubscribe(self, stream):
+        streams = self.streams[stream.user_id]
+        streams.discard(stream)
+        if not streams:
+            del self.streams[stream.user_id]
+
+    def dispatch(self, payload):
+        """queue payload on the streams of the user it is for"""
+        try:
+            user_id = json.loads(payload)["user"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed change event %r", payload)
+            return
+        for stream in self.streams.get(user_id, ()):
+            stream.put(payload)
+
+
+_hub = None
+
+
+def get_hub():
+    """return the hub of this process"""
+    global _hub
+    if _hub is None:
+        _hub = Hub(get_broker())
+    return _hub
+
+
+def reset_hub():
+    """stop and forget the hub of this process"""
+    global _hub
+    if _hub is not None:
+        _hub.stop()
+        _hub = None
@@ -0,0 +1,70 @@
+"""
+Custom model fields
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+
+
+class CentsField(models.BigIntegerField):
+    """amount with two decimal places, stored as whole cents
+
+    Python code sees a Decimal like a DecimalField would give it, while the
+    column is a fixed width integer that compares and indexes cheaply.
+    """
+
+    description = "Amount stored as integer cents"
+    places = 2
+
+    def __init__(self, *args, max_digits=12, **kwargs):
+        self.max_digits = max_digits
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.max_digits != 12:
+            kwargs["max_digits"] = self.max_digits
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(value).scaleb(-self.places)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        quantum = Decimal(1).scaleb(-self.places)
+        try:
+            return Decimal(str(value)).quantize(quantum)
+        except InvalidOperation:
+            raise exceptions.ValidationError(
+                self.error_messages["invalid"],
+                code="invalid",
+                params={"value": value},
+            )
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None or hasattr(value, "resolve_expression"):
+            return value
+        cents = self.to_python(value).scaleb(self.places)
+        return int(cents.to_integral_value(rounding=ROUND_HALF_UP))
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        return "" if value is None else str(value)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(
+            self,
+            **{
+                "form_class": forms.DecimalField,
+                "max_digits": self.max_digits,
+                "decimal_places": self.places,
+                **kwargs,
+            },
+        )
@@ -0,0 +1,262 @@
+"""
+Invalidation bus for caches held in each process
+
+Every uWSGI worker, in every container, keeps its own LocalCache entries,
+so a change committed by one process is announced to all of them as a
+small message naming the model, owning user, primary key, and the
+sender's own sequence number. PostgreSQL carries messages with NOTIFY to
+a listener thread in each process; without it an in-process stand-in
+delivers them to the sending process only.
+
+Delivery is at least once and evicting is idempotent. Missed messages are
+caught by version checks: a gap in a sender's sequence, or losing the
+listener connection, clears every cache of the process, and an entry
+loaded while its cache was being evicted is never stored. Entries also
+expire after max_age, bounding staleness should the last message of a
+sender go missing.
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+# seconds before a lost listener connection is opened again
+RECONNECT_DELAY = 5
+
+
+class LocalCache:
+    """entries derived from rows of model, kept in this process
+
+    Entries are evicted by key on messages about model itself, and all
+    entries of a user on messages about the other models watched, or
+    about every row of model a user owns.
+    """
+
+    def __init__(self, model, watches=(), max_size=10000, max_age=300):
+        self.model = model
+        self.watches = {model, *watches}
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # bumped by every eviction, so loads racing one aren't stored
+        self.version = 0
+        bus.register(self)
+
+    def get(self, key):
+        """return the entry stored under key, or None"""
+        if not bus.ensure_listening():
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, user_id, stored = entry
+            if time.monotonic() - stored > self.max_age:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, user_id, version):
+        """store value if nothing was evicted since version was read"""
+        if not bus.ensure_listening():
+            return
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = (value, user_id, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict(self, model, user_id, pk):
+        """drop entries a change to the pk row of model may have staled"""
+        with self.lock:
+            self.version += 1
+            if model == self.model and pk is not None:
+                self.entries.pop(pk, None)
+                return
+            for key in [
+                key
+                for key, (value, owner, stored) in self.entries.items()
+                if owner == user_id
+            ]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+
+class MemoryTransport:
+    """deliver messages to the sending process only"""
+
+    def send(self, payload):
+        bus.receive(payload)
+
+    def listen(self, receive, connected, lost):
+        connected()
+
+
+class PostgresTransport:
+    """carry messages between processes with NOTIFY and LISTEN"""
+
+    channel = "cache_invalidation"
+
+    def send(self, payload):
+        with connections["default"].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)",
+                [self.channel, payload],
+            )
+
+    def listen(self, receive, connected, lost):
+        """receive notifications on a background thread"""
+        import psycopg2
+
+        params = connections["default"].get_connection_params()
+
+        def run():
+            while True:
+                try:
+                    conn = psycopg2.connect(**params)
+                    conn.set_session(autocommit=True)
+                    with conn.cursor() as cursor:
+                        cursor.execute(f"LISTEN {self.channel}")
+                    connected()
+                    while True:
+                        if select.select([conn], [], [], 60)[0]:
+                            conn.poll()
+                            while conn.notifies:
+                                receive(conn.notifies.pop(0).payload)
+                except psycopg2.Error:
+                    logger.exception("Cache invalidation listener lost")
+                    lost()
+                    time.sleep(RECONNECT_DELAY)
+
+        threading.Thread(
+            target=run,
+            name="cache-invalidation",
+            daemon=True,
+        ).start()
+
+
+class Bus:
+    """send invalidations of this process and apply everyone's"""
+
+    def __init__(self):
+        self.caches = []
+        self.lock = threading.Lock()
+        self.pid = None
+        self.ready = False
+
+    def register(self, cache):
+        self.caches.append(cache)
+
+    def get_transport(self):
+        path = settings.INVALIDATION_TRANSPORT
+        if path is None:
+            if connections["default"].vendor == "postgresql":
+                path = "core.invalidation.PostgresTransport"
+            else:
+                path = "core.invalidation.MemoryTransport"
+        return import_string(path)()
+
+    def ensure_listening(self):
+        """start listening in this process if not yet, return if listening
+
+        A forked worker doesn't inherit the listener thread, so it starts
+        one of its own on first use.
+        """
+        if self.pid == os.getpid():
+            return self.ready
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.ready = False
+                self.source = uuid.uuid4().hex[:12]
+                self.sequence = 0
+                self.seen = {}
+                self.clear()
+                self.transport = self.get_transport()
+                self.transport.listen(self.receive, self.connected, self.lost)
+        return self.ready
+
+    def connected(self):
+        self.clear()
+        self.ready = True
+
+    def lost(self):
+        # messages sent while disconnected are never delivered
+        self.ready = False
+        self.clear()
+
+    def clear(self):
+        for cache in self.caches:
+            cache.clear()
+
+    def publish(self, model, user_id, pk=None, using="default"):
+        """invalidate entries derived from a row, here and everywhere
+
+        pk None stands for every row of model owned by user_id. Local
+        entries go at once and again on commit, when the message is sent,
+        in case the old row was read back meanwhile.
+        """
+        caches = [cache for cache in self.caches if model in cache.watches]
+        if not caches:
+            return
+        for cache in caches:
+            cache.evict(model, user_id, pk)
+
+        def send():
+            for cache in caches:
+                cache.evict(model, user_id, pk)
+            self.ensure_listening()
+            with self.lock:
+                self.sequence += 1
+                payload = json.dumps(
+                    [model, user_id, pk, self.sequence, self.source],
+                    separators=(",", ":"),
+                )
+            try:
+                self.transport.send(payload)
+            except Exception:
+                # other processes still drop the entry at max_age
+                logger.exception("Sending cache invalidation failed")
+
+        transaction.on_commit(send, using=using)
+
+    def receive(self, payload):
+        """evict the entries a message is about"""
+        try:
+            model, user_id, pk, sequence, source = json.loads(payload)
+        except (ValueError, TypeError):
+            logger.warning("Ignoring malformed invalidation %r", payload)
+            return
+        with self.lock:
+            last = self.seen.get(source)
+            self.seen[source] = max(sequence, last or 0)
+        if last is not None and sequence > last + 1:
+            logger.warning("Missed invalidations from %s", source)
+            self.clear()
+            return
+        for cache in self.caches:
+            if model in cache.watches:
+                cache.evict(model, user_id, pk)
+
+
+bus = Bus()
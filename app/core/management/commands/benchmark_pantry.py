@@ -0,0 +1,130 @@
+"""
+Django command to benchmark pantry matching on a synthetic library
+"""
+
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+
+from recipe import pantry
+
+
+def popularity(ingredients):
+    """return Zipf-like probabilities of each ingredient being used"""
+    weights = 1 / np.arange(1, ingredients + 1)
+    return weights / weights.sum()
+
+
+def synthetic_postings(recipes, ingredients, per_recipe, seed):
+    """return packed (recipe_ids, totals) bytes per ingredient
+
+    Ingredient popularity follows a Zipf-like curve, so a few staples end
+    up in most recipes as they do in real libraries.
+    """
+    rng = np.random.default_rng(seed)
+    weights = popularity(ingredients)
+    sizes = rng.integers(per_recipe // 2, per_recipe * 3 // 2 + 1, recipes)
+
+    members = [[] for _ in range(ingredients)]
+    for recipe_id, size in enumerate(sizes, start=1):
+        chosen = rng.choice(ingredients, size=size, replace=False, p=weights)
+        for ingredient in chosen:
+            members[ingredient].append(recipe_id)
+
+    postings = []
+    for recipe_ids in members:
+        ids = np.array(recipe_ids, dtype=pantry.ID_DTYPE)
+        totals = sizes[ids - 1].astype(pantry.TOTAL_DTYPE)
+        postings.append((ids.tobytes(), totals.tobytes()))
+    return postings, sizes
+
+
+def naive_match(pantry_ids, postings, sizes, max_missing):
+    """score every recipe in Python, as a per-recipe loop would"""
+    have = set(pantry_ids)
+    ingredients_of = [[] for _ in range(len(sizes))]
+    for ingredient, (ids, totals) in enumerate(postings):
+        for recipe_id in np.frombuffer(ids, dtype=pantry.ID_DTYPE):
+            ingredients_of[recipe_id - 1].append(ingredient)
+    results = []
+    for index, used in enumerate(ingredients_of):
+        matched = len(have.intersection(used))
+        missing = len(used) - matched
+        if matched and missing <= max_missing:
+            results.append((missing, -matched / len(used), index + 1))
+    results.sort()
+    return results
+
+
+class Command(BaseCommand):
+    help = "Time pantry matching against a synthetic recipe library"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=100_000)
+        parser.add_argument("--ingredients", type=int, default=2_000)
+        parser.add_argument("--per-recipe", type=int, default=10)
+        parser.add_argument("--pantry", type=int, default=20)
+        parser.add_argument("--max-missing", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--naive",
+            action="store_true",
+            help="Also time a per-recipe Python loop for comparison",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        postings, sizes = synthetic_postings(
+            options["recipes"],
+            options["ingredients"],
+            options["per_recipe"],
+            options["seed"],
+        )
+        self.stdout.write(
+            f"Built {options['recipes']} recipes over "
+            f"{options['ingredients']} ingredients in "
+            f"{time.perf_counter() - start:.1f}s"
+        )
+
+        rng = np.random.default_rng(options["seed"] + 1)
+        timings = []
+        for _ in range(options["repeat"]):
+            pantry_ids = rng.choice(
+                options["ingredients"],
+                size=options["pantry"],
+                replace=False,
+                p=popularity(options["ingredients"]),
+            )
+            start = time.perf_counter()
+            recipe_ids, matched, missing = pantry.score(
+                [
+                    (
+                        np.frombuffer(postings[i][0], dtype=pantry.ID_DTYPE),
+                        np.frombuffer(
+                            postings[i][1],
+                            dtype=pantry.TOTAL_DTYPE,
+                        ),
+                    )
+                    for i in pantry_ids
+                ],
+                options["max_missing"],
+            )
+            timings.append(time.perf_counter() - start)
+
+        timings = np.array(timings) * 1000
+        self.stdout.write(
+            f"score: p50 {np.percentile(timings, 50):.2f}ms "
+            f"p95 {np.percentile(timings, 95):.2f}ms "
+            f"max {timings.max():.2f}ms "
+            f"({len(recipe_ids)} matches in the last run)"
+        )
+
+        if options["naive"]:
+            start = time.perf_counter()
+            naive_match(pantry_ids, postings, sizes, options["max_missing"])
+            self.stdout.write(
+                f"naive: {(time.perf_counter() - start) * 1000:.0f}ms"
+            )
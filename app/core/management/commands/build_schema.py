@@ -0,0 +1,68 @@
+"""
+Django command to precompute the OpenAPI schema
+"""
+
+import difflib
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import schema
+
+
+class Command(BaseCommand):
+    help = "Build the cached OpenAPI schema or compare it to the committed one"
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail if the committed schema differs from the code",
+        )
+        action.add_argument(
+            "--update",
+            action="store_true",
+            help="Rewrite the committed schema from the code",
+        )
+        parser.add_argument(
+            "--file",
+            default=str(settings.SCHEMA_FILE),
+            help="Committed schema used by --check and --update",
+        )
+        parser.add_argument(
+            "--app-version",
+            default=settings.APP_VERSION,
+            help="Code version the cached schema is stored under",
+        )
+
+    def handle(self, *args, **options):
+        if not (options["check"] or options["update"]):
+            for path in schema.build(options["app_version"]):
+                self.stdout.write(f"Wrote {path}")
+            return
+
+        generated = schema.render(schema.generate(), "yaml").decode()
+        if options["update"]:
+            with open(options["file"], "w") as f:
+                f.write(generated)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['file']}"))
+            return
+
+        try:
+            with open(options["file"]) as f:
+                committed = f.read()
+        except FileNotFoundError:
+            committed = ""
+        if committed != generated:
+            diff = difflib.unified_diff(
+                committed.splitlines(keepends=True),
+                generated.splitlines(keepends=True),
+                fromfile=options["file"],
+                tofile="generated",
+            )
+            self.stdout.write("".join(diff))
+            raise CommandError(
+                "Schema is out of date, run build_schema --update"
+            )
+        self.stdout.write(self.style.SUCCESS("Schema is up to date"))
@@ -0,0 +1,262 @@
+"""
+Django command to find recipe images no recipe references any more, and
+image uploads left unfinished
+"""
+
+import os
+import shutil
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import ImageBlob, ImageUpload, Recipe
+from recipe import uploads
+
+
+def walk_files(root, after=(), rel=()):
+    """yield (name, entry) for files under root in sorted order
+
+    Files up to and including the path parts in after are skipped, and so
+    are whole directories sorting before it, so a walk can be resumed.
+    """
+    try:
+        with os.scandir(os.path.join(root, *rel)) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        parts = rel + (entry.name,)
+        if entry.is_dir(follow_symlinks=False):
+            if parts >= after[:len(parts)]:
+                yield from walk_files(root, after, parts)
+        elif entry.is_file(follow_symlinks=False) and parts > after:
+            yield "/".join(parts), entry
+
+
+def _images(alias):
+    """return recipes on alias that have an image"""
+    return (
+        Recipe.objects.using(alias)
+        .exclude(image="")
+        .exclude(image__isnull=True)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete or quarantine media files no recipe references, and expire "
+        "unfinished image uploads"
+    )
+
+    def add_arguments(self, parser):
+        action = parser.add_mutually_exclusive_group()
+        action.add_argument(
+            "--delete",
+            action="store_true",
+            help="Delete orphaned files instead of only listing them",
+        )
+        action.add_argument(
+            "--quarantine",
+            metavar="DIR",
+            help="Move orphaned files to DIR instead of deleting them",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help="Leave files modified in the last N seconds alone",
+        )
+        parser.add_argument(
+            "--max-rate",
+            type=float,
+            default=0,
+            help="Examine at most N files per second",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=0,
+            help="Stop after N files and resume from there next run",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=settings.MEDIA_GC_CHECKPOINT,
+            help="File remembering where an interrupted walk stopped",
+        )
+        parser.add_argument(
+            "--report",
+            action="store_true",
+            help="Print the image storage used by each user",
+        )
+
+    def _referenced_names(self):
+        """return the names of all images attached to recipes"""
+        names = set()
+        for alias in settings.DB_SHARDS:
+            names.update(
+                _images(alias).values_list("image", flat=True).iterator()
+            )
+        return names
+
+    def _read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return tuple(f.read().strip().split("/"))
+        except FileNotFoundError:
+            return ()
+
+    def _write_checkpoint(self, path, name):
+        if name is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path, "w") as f:
+            f.write(name)
+
+    def _in_use(self, name):
+        """return whether a blob or any recipe still references name"""
+        if ImageBlob.objects.filter(name=name, ref_count__gt=0).exists():
+            return True
+        return any(
+            _images(alias).filter(image=name).exists()
+            for alias in settings.DB_SHARDS
+        )
+
+    def _dispose(self, name, options):
+        """remove name unless it was picked up again, returning if it was
+
+        A new upload of the same content is stored under the old file,
+        keeping its mtime, and only retained once its recipe commits. The
+        name is locked as the signals deleting and retaining it lock it,
+        and the references are checked again under the lock.
+        """
+        with transaction.atomic(using=ImageBlob.objects.db):
+            ImageBlob.objects.lock([name])
+            if self._in_use(name):
+                return False
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            if options["quarantine"]:
+                dest = os.path.join(options["quarantine"], name)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.move(path, dest)
+            else:
+                os.remove(path)
+            ImageBlob.objects.filter(name=name, ref_count=0).delete()
+        return True
+
+    def _expire_uploads(self, dispose):
+        """list or delete uploads past UPLOAD_MAX_AGE and their bytes
+
+        Part files no upload refers to, say of a session whose row was
+        deleted without them, go too once they are as old.
+        """
+        before = uploads.expired_before()
+        expired = reserved = 0
+        live_ids = set()
+        for alias in settings.DB_SHARDS:
+            sessions = ImageUpload.objects.using(alias)
+            rows = list(
+                sessions.filter(created_at__lt=before).values_list(
+                    "id",
+                    "size",
+                )
+            )
+            expired += len(rows)
+            reserved += sum(size for upload_id, size in rows)
+            if dispose and rows:
+                ids = [upload_id for upload_id, size in rows]
+                sessions.filter(id__in=ids).delete()
+                uploads.remove_parts(ids)
+            live_ids.update(
+                str(upload_id)
+                for upload_id in sessions.filter(
+                    created_at__gte=before,
+                ).values_list("id", flat=True)
+            )
+
+        freed = 0
+        if dispose:
+            freed = uploads.remove_stale_parts(live_ids, before)
+        self.stdout.write(
+            f"Found {expired} expired upload(s) of {reserved} bytes, "
+            f"removed {freed} bytes of stray parts"
+        )
+
+    def _report(self):
+        """print image bytes referenced by each user, largest first"""
+        sizes = {}
+        usage = defaultdict(int)
+        for alias in settings.DB_SHARDS:
+            rows = (
+                _images(alias)
+                .values_list("user_id", "image")
+                .distinct()
+                .iterator()
+            )
+            for user_id, name in rows:
+                if name not in sizes:
+                    try:
+                        sizes[name] = os.path.getsize(
+                            os.path.join(settings.MEDIA_ROOT, name),
+                        )
+                    except FileNotFoundError:
+                        sizes[name] = 0
+                usage[user_id] += sizes[name]
+
+        emails = dict(
+            get_user_model()
+            .objects.filter(pk__in=usage)
+            .values_list("pk", "email")
+        )
+        for user_id, total in sorted(usage.items(), key=lambda i: -i[1]):
+            self.stdout.write(f"{emails.get(user_id, user_id)}: {total} bytes")
+
+    def handle(self, *args, **options):
+        referenced = self._referenced_names()
+        after = self._read_checkpoint(options["checkpoint"])
+        cutoff = time.time() - options["min_age"]
+        interval = 1 / options["max_rate"] if options["max_rate"] else 0
+        dispose = options["delete"] or options["quarantine"]
+
+        examined = orphans = orphan_bytes = 0
+        stopped_at = None
+        for name, entry in walk_files(settings.MEDIA_ROOT, after):
+            if options["limit"] and examined >= options["limit"]:
+                break
+            examined += 1
+            stopped_at = name
+            if interval:
+                time.sleep(interval)
+
+            if name in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                continue
+            # picked up again by an upload since the names were read
+            if ImageBlob.objects.filter(name=name, ref_count__gt=0).exists():
+                continue
+            if dispose and not self._dispose(name, options):
+                continue
+
+            orphans += 1
+            orphan_bytes += stat.st_size
+            self.stdout.write(f"Orphan: {name} ({stat.st_size} bytes)")
+        else:
+            stopped_at = None
+
+        self._write_checkpoint(options["checkpoint"], stopped_at)
+        self._expire_uploads(dispose)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Examined {examined} file(s), found {orphans} orphan(s) "
+                f"using {orphan_bytes} bytes"
+            )
+        )
+        if options["report"]:
+            self._report()
@@ -0,0 +1,88 @@
+"""
+Django command to move users' recipe data between shards
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from core import sharding
+from core.models import UserShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Move a user's recipe data to another shard, or rebalance all. "
+        "Copies left behind by interrupted moves are deleted first, and "
+        "only that is done when no move is asked for."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Email or id of the user to move")
+        parser.add_argument("--to", help="Shard alias to move the user to")
+        parser.add_argument(
+            "--rebalance",
+            action="store_true",
+            help=(
+                "Move every user whose shard differs from its placement. "
+                "Placement is by user id modulo the number of shards, so "
+                "after adding a shard this moves most users."
+            ),
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def _get_user(self, ident):
+        lookup = {"pk": ident} if ident.isdigit() else {"email": ident}
+        try:
+            return get_user_model().objects.get(**lookup)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {ident} does not exist")
+
+    def _finish_moves(self, options):
+        """delete copies of users' data left by interrupted moves"""
+        pending = (
+            UserShard.objects.exclude(cleanup_alias="")
+            .exclude(cleanup_alias=F("alias"))
+            .values_list("user_id", "cleanup_alias")
+        )
+        for user_id, alias in pending:
+            self.stdout.write(f"Cleaning up user {user_id} on {alias}")
+            if options["dry_run"]:
+                continue
+            try:
+                sharding.finish_move(user_id)
+            except ValueError as exc:
+                raise CommandError(str(exc))
+
+    def _plan(self, options):
+        if options["rebalance"]:
+            for user_shard in UserShard.objects.select_related("user"):
+                target = sharding.placement_for_user_id(user_shard.user_id)
+                if user_shard.alias != target:
+                    yield user_shard.user, target
+            return
+
+        if not options["user"] and not options["to"]:
+            return
+        if not options["user"] or not options["to"]:
+            raise CommandError("Pass --user and --to, or --rebalance")
+        if options["to"] not in settings.DB_SHARDS:
+            raise CommandError(f"Unknown shard {options['to']}")
+        yield self._get_user(options["user"]), options["to"]
+
+    def handle(self, *args, **options):
+        self._finish_moves(options)
+        moved = 0
+        for user, target in self._plan(options):
+            source = sharding.shard_for_user(user)
+            self.stdout.write(f"Moving {user.email}: {source} -> {target}")
+            if options["dry_run"]:
+                continue
+            try:
+                sharding.move_user(user, target, options["batch_size"])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            moved += 1
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} user(s)"))
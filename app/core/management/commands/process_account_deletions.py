@@ -0,0 +1,57 @@
+"""
+Django command to run queued account deletions
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import deletion
+
+
+class Command(BaseCommand):
+    help = "Delete accounts queued for deletion, in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=deletion.BATCH_SIZE,
+            help="Delete N recipes per transaction",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Wait N seconds between polls for new jobs",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no job is left instead of polling",
+        )
+
+    def run(self, job, batch_size):
+        self.stdout.write(f"Deleting user {job.user_id} (job {job.id})")
+        start = time.monotonic()
+        try:
+            deletion.run_account_deletion(job, batch_size)
+        except Exception as e:
+            self.stderr.write(f"Job {job.id} failed: {e!r}")
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted user {job.user_id} and {job.recipes_deleted} "
+                f"recipe(s) in {time.monotonic() - start:.1f}s"
+            )
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = deletion.claim_job()
+            if job is not None:
+                self.run(job, options["batch_size"])
+            elif options["once"]:
+                return
+            else:
+                time.sleep(options["interval"])
@@ -0,0 +1,143 @@
+"""
+Django command to report what application startup costs
+"""
+
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+
+def parse_importtime(lines):
+    """return (name, self_us, cumulative_us, depth) rows from -X importtime
+
+    Python prints a module after everything it imported, one level of
+    indentation deeper per nesting, so the rows come back in that order.
+    """
+    rows = []
+    for line in lines:
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        stripped = name.lstrip(" ")
+        depth = (len(name) - len(stripped) - 1) // 2
+        rows.append((stripped.rstrip(), int(own), int(cumulative), depth))
+    return rows
+
+
+def build_tree(rows):
+    """nest importtime rows, returning the top level (name, us, children)"""
+    stack = [[]]
+    for name, own, cumulative, depth in rows:
+        while len(stack) <= depth + 1:
+            stack.append([])
+        children = stack[depth + 1]
+        stack[depth + 1] = []
+        del stack[depth + 2:]
+        stack[depth].append((name, cumulative, children))
+    return stack[0]
+
+
+def read_memory(pid):
+    """return the Rss, Pss and private kB of a process from /proc"""
+    usage = {"Rss": 0, "Pss": 0, "Private": 0}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                usage[key] = int(value.split()[0])
+            elif key.startswith("Private_"):
+                usage["Private"] += int(value.split()[0])
+    return usage
+
+
+def child_pids(pid):
+    """return the pids of the direct children of a process"""
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+
+class Command(BaseCommand):
+    help = "Print an import time tree and the memory used by uWSGI workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--module",
+            default="app.wsgi",
+            help="Module whose import is profiled",
+        )
+        parser.add_argument(
+            "--min-ms",
+            type=float,
+            default=5,
+            help="Hide imports taking less than N milliseconds",
+        )
+        parser.add_argument(
+            "--depth",
+            type=int,
+            default=4,
+            help="Show at most N levels of the import tree",
+        )
+        parser.add_argument(
+            "--pidfile",
+            default="/tmp/uwsgi.pid",
+            help="uWSGI master pid file used to find the workers",
+        )
+
+    def print_tree(self, nodes, min_us, depth, level=0):
+        for name, cumulative, children in sorted(nodes, key=lambda n: -n[1]):
+            if cumulative < min_us:
+                continue
+            self.stdout.write(
+                f"{'  ' * level}{name} {cumulative / 1000:.1f}ms"
+            )
+            if level + 1 < depth:
+                self.print_tree(children, min_us, depth, level + 1)
+
+    def profile_imports(self, options):
+        env = dict(os.environ, WSGI_PRELOAD="1")
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             f"import {options['module']}"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        rows = parse_importtime(proc.stderr.splitlines())
+        total = sum(own for _, own, _, _ in rows)
+        self.stdout.write(
+            f"Importing {options['module']} took {total / 1000:.1f}ms "
+            f"over {len(rows)} modules"
+        )
+        self.print_tree(
+            build_tree(rows),
+            options["min_ms"] * 1000,
+            options["depth"],
+        )
+
+    def profile_workers(self, options):
+        try:
+            with open(options["pidfile"]) as f:
+                master = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            self.stdout.write("uWSGI is not running, skipping worker memory")
+            return
+
+        self.stdout.write("Process      Rss kB   Pss kB  Private kB")
+        for label, pid in [("master", master)] + [
+            (f"worker {pid}", pid) for pid in child_pids(master)
+        ]:
+            usage = read_memory(pid)
+            self.stdout.write(
+                f"{label:<12}{usage['Rss']:>7}{usage['Pss']:>9}"
+                f"{usage['Private']:>12}"
+            )
+
+    def handle(self, *args, **options):
+        self.profile_imports(options)
+        self.profile_workers(options)
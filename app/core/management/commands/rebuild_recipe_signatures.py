@@ -0,0 +1,37 @@
+"""
+Django command to recompute the similarity index of all recipes
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+from recipe import similarity
+
+
+class Command(BaseCommand):
+    help = "Recompute MinHash signatures and LSH buckets of every recipe"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Recompute N recipes at a time",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for alias in settings.DB_SHARDS:
+            ids = list(
+                Recipe.objects.using(alias)
+                .order_by("id")
+                .values_list("id", flat=True)
+            )
+            for start in range(0, len(ids), batch_size):
+                similarity.update_recipes(
+                    ids[start:start + batch_size],
+                    alias,
+                )
+            self.stdout.write(f"{alias}: {len(ids)} recipe(s)")
+        self.stdout.write(self.style.SUCCESS("Similarity index rebuilt"))
@@ -0,0 +1,96 @@
+"""
+Django command to prepare a container before serving traffic
+"""
+
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Wait for the databases, collect static files and migrate, "
+        "skipping work that is already done"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--db-timeout",
+            type=float,
+            default=60,
+            help="Give up waiting for the databases after N seconds",
+        )
+        parser.add_argument(
+            "--skip-static",
+            action="store_true",
+            help="Do not collect static files",
+        )
+        parser.add_argument(
+            "--skip-migrate",
+            action="store_true",
+            help="Do not apply migrations",
+        )
+
+    @contextmanager
+    def phase(self, name):
+        """time a startup phase and print how long it took"""
+        start = time.monotonic()
+        yield
+        self.timings.append((name, time.monotonic() - start))
+        self.stdout.write(f"startup: {name} took {self.timings[-1][1]:.2f}s")
+
+    def collect_static(self):
+        current = startup.static_manifest_hash()
+        if current == startup.collected_static_hash():
+            self.stdout.write("Static files unchanged, skipping collectstatic")
+            return
+        call_command(
+            "collectstatic",
+            interactive=False,
+            verbosity=0,
+            stdout=self.stdout,
+        )
+        startup.record_static_hash(current)
+
+    def migrate(self, alias):
+        connection = connections[alias]
+        if not startup.has_unapplied_migrations(connection):
+            self.stdout.write(f"No unapplied migrations on {alias}")
+            return
+        with startup.migrate_lock(connection):
+            # another replica may have migrated while we waited
+            if startup.has_unapplied_migrations(connection):
+                call_command(
+                    "migrate",
+                    database=alias,
+                    interactive=False,
+                    stdout=self.stdout,
+                )
+
+    def handle(self, *args, **options):
+        self.timings = []
+        with self.phase("wait_for_db"):
+            call_command(
+                "wait_for_db",
+                timeout=options["db_timeout"],
+                stdout=self.stdout,
+            )
+        if not options["skip_static"]:
+            with self.phase("collectstatic"):
+                self.collect_static()
+        if not options["skip_migrate"]:
+            # the global tables live on default, which may not be a shard
+            for alias in dict.fromkeys(["default", *settings.DB_SHARDS]):
+                with self.phase(f"migrate {alias}"):
+                    self.migrate(alias)
+
+        total = sum(seconds for name, seconds in self.timings)
+        self.stdout.write(
+            self.style.SUCCESS(f"startup: ready in {total:.2f}s")
+        )
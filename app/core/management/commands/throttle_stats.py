@@ -0,0 +1,25 @@
+"""
+Django command to report requests turned away by throttling
+"""
+
+from django.core.management.base import BaseCommand
+
+from core import throttling
+
+
+class Command(BaseCommand):
+    help = "Print how many requests each throttle scope has rejected"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Zero the counters after printing them",
+        )
+
+    def handle(self, *args, **options):
+        for scope, count in throttling.rejection_counts().items():
+            self.stdout.write(f"{scope}: {count} rejected")
+        if options["reset"]:
+            throttling.reset_rejection_counts()
+            self.stdout.write("Counters reset")
@@ -2,21 +2,49 @@
 Django command to wait for db to be available
 """
 
+import random
 import time
 from psycopg2 import OperationalError as Psycopg2Error
+from django.conf import settings
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=60,
+            help="Give up after N seconds",
+        )
+        parser.add_argument(
+            "--max-delay",
+            type=float,
+            default=5,
+            help="Wait at most N seconds between attempts",
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("Waiting for db...")
+        # users, tokens and the shard map are always on default
+        aliases = list(dict.fromkeys(["default", *settings.DB_SHARDS]))
+        deadline = time.monotonic() + options["timeout"]
+        delay = 0.1
         db_up = False
         while db_up is False:
             try:
-                self.check(databases=["default"])
+                self.check(databases=aliases)
                 db_up = True
             except (Psycopg2Error, OperationalError):
-                self.stdout.write("DB not available, waiting for 1 second")
-                time.sleep(1)
+                if time.monotonic() >= deadline:
+                    raise CommandError(
+                        f"DB not available after {options['timeout']}s"
+                    )
+                # full jitter keeps restarting replicas from retrying
+                # in lockstep
+                wait = random.uniform(0, delay)
+                self.stdout.write(f"DB not available, waiting {wait:.2f}s")
+                time.sleep(wait)
+                delay = min(delay * 2, options["max_delay"])
         self.stdout.write(self.style.SUCCESS("DB available"))
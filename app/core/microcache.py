@@ -0,0 +1,39 @@
+"""
+Headers driving the nginx micro-cache of reads
+
+Cacheable responses are tagged with their user, and nginx keeps them
+for MICROCACHE_TTL seconds under a key made of a hash of the auth token
+and the user's current generation. A successful write names the user to
+purge and nginx moves the user on to a new generation, so none of their
+cached responses are served again.
+"""
+
+from django.conf import settings
+
+
+TAG_HEADER = "X-Cache-Tag"
+PURGE_HEADER = "X-Cache-Purge"
+
+
+def user_tag(user_id):
+    return f"user-{user_id}"
+
+
+def mark_cacheable(response, user_id):
+    """let nginx cache response for the user for a short while"""
+    if (
+        not settings.MICROCACHE_TTL
+        or response.status_code != 200
+        # files have caching of their own
+        or response.has_header("Cache-Control")
+        or response.has_header("X-Accel-Redirect")
+    ):
+        return
+    response["X-Accel-Expires"] = str(settings.MICROCACHE_TTL)
+    response[TAG_HEADER] = user_tag(user_id)
+
+
+def mark_purge(response, user_id):
+    """have nginx drop the cached responses of the user"""
+    if settings.MICROCACHE_TTL and response.status_code < 400:
+        response[PURGE_HEADER] = user_tag(user_id)
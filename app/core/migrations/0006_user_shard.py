@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_existing_users(apps, schema_editor):
+    """existing users keep their recipe data on the default database"""
+    if schema_editor.connection.alias != "default":
+        return
+    User = apps.get_model("core", "User")
+    UserShard = apps.get_model("core", "UserShard")
+    UserShard.objects.bulk_create(
+        UserShard(user_id=user_id, alias="default")
+        for user_id in User.objects.values_list("id", flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserShard',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard', serialize=False, to='core.user')),
+                ('alias', models.CharField(max_length=64)),
+                ('is_moving', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(assign_existing_users, migrations.RunPython.noop),
+    ]
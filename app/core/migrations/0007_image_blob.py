@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:37
+
+import core.models
+import core.storage
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def count_existing_images(apps, schema_editor):
+    """count references to images already attached on this database"""
+    Recipe = apps.get_model("core", "Recipe")
+    ImageBlob = apps.get_model("core", "ImageBlob")
+    counts = (
+        Recipe.objects.using(schema_editor.connection.alias)
+        .exclude(image="")
+        .exclude(image__isnull=True)
+        .values("image")
+        .annotate(refs=Count("id"))
+        .order_by()
+    )
+    for row in counts.iterator():
+        blob, created = ImageBlob.objects.using("default").get_or_create(
+            name=row["image"],
+            defaults={"ref_count": row["refs"]},
+        )
+        if not created:
+            ImageBlob.objects.using("default").filter(pk=blob.pk).update(
+                ref_count=F("ref_count") + row["refs"],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_user_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.models.recipe_image_file_path),
+        ),
+        migrations.RunPython(count_existing_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_image_upload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'image'], name='recipe_user_image'),
+        ),
+    ]
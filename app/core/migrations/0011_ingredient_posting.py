@@ -0,0 +1,78 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:52
+
+import struct
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# as recipe.pantry.SEGMENT_BITS
+SEGMENT_BITS = 18
+
+
+def build_postings(apps, schema_editor):
+    """index the recipes already using each ingredient on this database"""
+    alias = schema_editor.connection.alias
+    Recipe = apps.get_model("core", "Recipe")
+    Ingredient = apps.get_model("core", "Ingredient")
+    IngredientPosting = apps.get_model("core", "IngredientPosting")
+    through = Recipe.ingredients.through
+
+    totals = defaultdict(int)
+    segments = defaultdict(list)
+    rows = through.objects.using(alias).values_list(
+        "ingredient_id",
+        "recipe_id",
+    )
+    for ingredient_id, recipe_id in rows.iterator():
+        totals[recipe_id] += 1
+        segments[ingredient_id, recipe_id >> SEGMENT_BITS].append(recipe_id)
+
+    owners = dict(Ingredient.objects.using(alias).values_list("id", "user_id"))
+    postings = []
+    for (ingredient_id, segment), recipe_ids in segments.items():
+        recipe_ids.sort()
+        postings.append(
+            IngredientPosting(
+                ingredient_id=ingredient_id,
+                segment=segment,
+                user_id=owners[ingredient_id],
+                recipe_ids=struct.pack(f"<{len(recipe_ids)}q", *recipe_ids),
+                totals=struct.pack(
+                    f"<{len(recipe_ids)}i",
+                    *[totals[recipe_id] for recipe_id in recipe_ids],
+                ),
+            )
+        )
+    IngredientPosting.objects.using(alias).bulk_create(
+        postings,
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_recipe_similarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.PositiveIntegerField()),
+                ('recipe_ids', models.BinaryField(default=b'')),
+                ('totals', models.BinaryField(default=b'')),
+                ('ingredient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='core.ingredient')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientposting',
+            constraint=models.UniqueConstraint(fields=('ingredient', 'segment'), name='posting_ingredient_segment'),
+        ),
+        migrations.RunPython(build_postings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:20
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+import core.fields
+
+
+def to_cents(apps, schema_editor):
+    """copy prices into the integer cents column"""
+    Recipe = apps.get_model("core", "Recipe")
+    Recipe.objects.using(schema_editor.connection.alias).update(
+        price_cents=Round(F("price") * 100),
+    )
+
+
+def from_cents(apps, schema_editor):
+    """copy integer cents back into the decimal column"""
+    Recipe = apps.get_model("core", "Recipe")
+    Recipe.objects.using(schema_editor.connection.alias).update(
+        price=Cast("price_cents", models.FloatField()) / 100,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_account_deletion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="price_cents",
+            field=core.fields.CentsField(null=True),
+        ),
+        # nullable so the column can be added back before it's filled
+        migrations.AlterField(
+            model_name="recipe",
+            name="price",
+            field=models.DecimalField(
+                max_digits=255,
+                decimal_places=2,
+                null=True,
+            ),
+        ),
+        migrations.RunPython(to_cents, from_cents),
+        migrations.RemoveField(
+            model_name="recipe",
+            name="price",
+        ),
+        migrations.RenameField(
+            model_name="recipe",
+            old_name="price_cents",
+            new_name="price",
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="price",
+            field=core.fields.CentsField(),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["user", "time_minutes", "id"],
+                name="recipe_user_time",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["user", "price", "id"],
+                name="recipe_user_price",
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:45
+
+from django.db import migrations
+
+
+# istartswith lookups compile to UPPER(column::text) LIKE 'X%', which a
+# plain btree can't serve on Postgres. These back the admin's ^ searches,
+# and are built without blocking writes to the tables.
+PREFIX_INDEXES = [
+    ("user_email_prefix", "core_user", "email"),
+    ("recipe_title_prefix", "core_recipe", "title"),
+    ("tag_name_prefix", "core_tag", "name"),
+    ("ingredient_name_prefix", "core_ingredient", "name"),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table, column in PREFIX_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} "
+            f"(UPPER({column}::text) text_pattern_ops)"
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table, column in PREFIX_INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("core", "0013_recipe_price_cents"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_admin_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accountdeletion',
+            name='user_id',
+            field=models.PositiveBigIntegerField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+INDEXES = [
+    ("ingredient", models.Index(
+        fields=["user", "name"],
+        name="ingredient_user_name",
+    )),
+    ("tag", models.Index(fields=["user", "name"], name="tag_user_name")),
+]
+
+
+# The (user, name) indexes are built before the user indexes they replace
+# are dropped, and on Postgres without blocking writes to the tables.
+def add_indexes(apps, schema_editor):
+    for model_name, index in INDEXES:
+        model = apps.get_model("core", model_name)
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(
+                index.create_sql(model, schema_editor, concurrently=True)
+            )
+        else:
+            schema_editor.add_index(model, index)
+
+
+def remove_indexes(apps, schema_editor):
+    for model_name, index in INDEXES:
+        model = apps.get_model("core", model_name)
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(
+                f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"
+            )
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('core', '0015_account_deletion_user_id_bigint'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_indexes, remove_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name=model_name, index=index)
+                for model_name, index in INDEXES
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
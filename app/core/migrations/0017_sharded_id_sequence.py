@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:20
+
+from django.db import migrations
+
+SEQUENCE = "core_sharded_id"
+TABLES = ["core_recipe", "core_tag", "core_ingredient"]
+
+
+def create_sequence(apps, schema_editor):
+    """start the sequence shared by the shards past every existing id
+
+    Rows from before sharding all live in the default database.
+    """
+    connection = schema_editor.connection
+    if connection.alias != "default":
+        return
+    ids = [0]
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(f"SELECT MAX(id) FROM {table}")
+            ids.append(cursor.fetchone()[0] or 0)
+    start = max(ids) + 1
+    if connection.vendor == "postgresql":
+        schema_editor.execute(f"CREATE SEQUENCE {SEQUENCE} START {start}")
+    else:
+        schema_editor.execute(
+            f"CREATE TABLE {SEQUENCE} (last_id bigint NOT NULL)",
+        )
+        schema_editor.execute(
+            f"INSERT INTO {SEQUENCE} (last_id) VALUES (%s)",
+            [start - 1],
+        )
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.alias != "default":
+        return
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f"DROP SEQUENCE {SEQUENCE}")
+    else:
+        schema_editor.execute(f"DROP TABLE {SEQUENCE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_attr_user_name_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+INDEXES = [
+    models.Index(fields=["user", "title", "id"], name="recipe_user_title"),
+    models.Index(fields=["user", "id"], name="recipe_user_id"),
+]
+
+
+# The indexes are built before the user index they replace is dropped,
+# and on Postgres without blocking writes to recipes.
+def add_indexes(apps, schema_editor):
+    model = apps.get_model("core", "recipe")
+    for index in INDEXES:
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(
+                index.create_sql(model, schema_editor, concurrently=True)
+            )
+        else:
+            schema_editor.add_index(model, index)
+
+
+def remove_indexes(apps, schema_editor):
+    model = apps.get_model("core", "recipe")
+    for index in INDEXES:
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(
+                f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"
+            )
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("core", "0017_sharded_id_sequence"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_indexes, remove_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name="recipe", index=index)
+                for index in INDEXES
+            ],
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="user",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_recipe_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usershard',
+            name='cleanup_alias',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
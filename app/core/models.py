@@ -2,15 +2,20 @@
 
 import uuid
 import os
+import zlib
+from collections import Counter
 
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, transaction
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
 
+from core.fields import CentsField
+from core.storage import ContentAddressedStorage
+
 
 def recipe_image_file_path(instance, filename):
     """generate filepath for new recipe image"""
@@ -41,6 +46,138 @@ class UserManager(BaseUserManager):
         return user
 
 
+# advisory locks keeping a new reference to a blob and the deletion of its
+# file apart, keyed by this class and a hash of the name
+BLOB_LOCK_CLASS = zlib.crc32(b"recipe-app-blob") & 0x7FFFFFFF
+
+
+class ImageBlobManager(models.Manager):
+    def lock(self, names):
+        """lock names until the current transaction ends
+
+        Only PostgreSQL has advisory locks; other backends run unlocked.
+        """
+        connection = connections[self.db]
+        if connection.vendor != "postgresql":
+            return
+        keys = sorted(
+            {zlib.crc32(name.encode()) & 0x7FFFFFFF for name in names}
+        )
+        with connection.cursor() as cursor:
+            for key in keys:
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(%s, %s)",
+                    [BLOB_LOCK_CLASS, key],
+                )
+
+    def retain(self, name):
+        """count one more reference to the blob stored at name"""
+        with transaction.atomic(using=self.db):
+            # waits out a deletion of the file that saw no references
+            self.lock([name])
+            blob, created = self.select_for_update().get_or_create(
+                name=name,
+                defaults={"ref_count": 0},
+            )
+            blob.ref_count += 1
+            blob.save(update_fields=["ref_count"])
+
+    def release(self, name):
+        """drop a reference to name, returning True if it was the last"""
+        with transaction.atomic(using=self.db):
+            blob = self.select_for_update().filter(name=name).first()
+            if blob is None:
+                return False
+            blob.ref_count -= 1
+            if blob.ref_count > 0:
+                blob.save(update_fields=["ref_count"])
+                return False
+            blob.delete()
+        return True
+
+    def release_many(self, names):
+        """drop one reference per entry of names, returning unused names"""
+        counts = Counter(names)
+        if not counts:
+            return []
+        with transaction.atomic(using=self.db):
+            ref_counts = dict(
+                self.select_for_update()
+                .filter(name__in=counts)
+                .values_list("name", "ref_count")
+            )
+            unused = [
+                name for name, ref_count in ref_counts.items()
+                if ref_count <= counts[name]
+            ]
+            kept = [name for name in ref_counts if name not in unused]
+            self.filter(name__in=unused).delete()
+            if kept:
+                self.filter(name__in=kept).update(
+                    ref_count=models.Case(
+                        *[
+                            models.When(
+                                name=name,
+                                then=models.F("ref_count") - counts[name],
+                            )
+                            for name in kept
+                        ],
+                        output_field=models.PositiveIntegerField(),
+                    ),
+                )
+        return unused
+
+
+class ShardedQuerySet(models.QuerySet):
+    """queryset of recipe data going to the shard of the user it names
+
+    Rows created for, or filtered by, a user or user_id are read from and
+    written to that user's shard, unless a database was picked with using.
+    """
+
+    def _for_user(self, kwargs, assign=False):
+        if self._db is not None:
+            return self
+        # imported here, core.sharding needs these models
+        from core import sharding
+
+        user = kwargs.get("user")
+        user_id = kwargs.get("user_id", getattr(user, "pk", user))
+        if user_id is None:
+            return self
+        if assign and isinstance(user, models.Model):
+            return self.using(sharding.shard_for_user(user))
+        if assign:
+            return self.using(sharding.shard_for_user_id(user_id))
+        # reading doesn't place a user who has no data yet
+        return self.using(sharding.find_shard_for_user_id(user_id))
+
+    def filter(self, *args, **kwargs):
+        queryset = self._for_user(kwargs)
+        return super(ShardedQuerySet, queryset).filter(*args, **kwargs)
+
+    def create(self, **kwargs):
+        queryset = self._for_user(kwargs, assign=True)
+        return super(ShardedQuerySet, queryset).create(**kwargs)
+
+    def get_or_create(self, defaults=None, **kwargs):
+        queryset = self._for_user({**(defaults or {}), **kwargs}, True)
+        return super(ShardedQuerySet, queryset).get_or_create(
+            defaults,
+            **kwargs,
+        )
+
+    def update_or_create(self, defaults=None, **kwargs):
+        queryset = self._for_user({**(defaults or {}), **kwargs}, True)
+        return super(ShardedQuerySet, queryset).update_or_create(
+            defaults,
+            **kwargs,
+        )
+
+
+ShardedManager = models.Manager.from_queryset(ShardedQuerySet)
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     """User in the system"""
 
@@ -54,21 +191,67 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "email"
 
 
+class UserShard(models.Model):
+    """database alias holding a user's recipe data"""
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="shard",
+    )
+    alias = models.CharField(max_length=64)
+    is_moving = models.BooleanField(default=False)
+    # another shard that may still hold a copy of the data, left by a move
+    # until it is deleted there
+    cleanup_alias = models.CharField(max_length=64, blank=True, default="")
+
+    def __str__(self):
+        return self.alias
+
+
 class Recipe(models.Model):
     """Recipe object"""
 
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
+        # covered by the (user, id) index
+        db_index=False,
     )
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     time_minutes = models.IntegerField()
-    price = models.DecimalField(max_digits=255, decimal_places=2)
+    price = CentsField()
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField("Tag")
     ingredients = models.ManyToManyField("Ingredient")
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=ContentAddressedStorage(),
+    )
+
+    objects = ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "image"], name="recipe_user_image"),
+            models.Index(
+                fields=["user", "time_minutes", "id"],
+                name="recipe_user_time",
+            ),
+            models.Index(
+                fields=["user", "price", "id"],
+                name="recipe_user_price",
+            ),
+            models.Index(
+                fields=["user", "title", "id"],
+                name="recipe_user_title",
+            ),
+            models.Index(fields=["user", "id"], name="recipe_user_id"),
+        ]
 
     def __str__(self):
         return self.title
@@ -81,8 +264,18 @@ class Tag(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
+        # covered by the (user, name) index
+        db_index=False,
     )
 
+    objects = ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "name"], name="tag_user_name"),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -94,7 +287,177 @@ class Ingredient(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
+        # covered by the (user, name) index
+        db_index=False,
+    )
+
+    objects = ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "name"], name="ingredient_user_name"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ImageUpload(models.Model):
+    """resumable upload of a recipe image, received in byte ranges"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
     )
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255, blank=True)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ShardedManager()
+
+    def __str__(self):
+        return str(self.id)
+
+
+class ImageBlob(models.Model):
+    """reference count of a stored image shared between recipes"""
+
+    name = models.CharField(max_length=255, primary_key=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    objects = ImageBlobManager()
 
     def __str__(self):
         return self.name
+
+
+class RecipeSignature(models.Model):
+    """MinHash signature over a recipe's ingredient and tag ids"""
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="signature",
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    # packed little-endian uint32 minimums, one per hash function
+    minhashes = models.BinaryField()
+
+    objects = ShardedManager()
+
+    def __str__(self):
+        return str(self.recipe_id)
+
+
+class RecipeBucket(models.Model):
+    """LSH bucket a recipe's signature falls into for one band"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="buckets",
+    )
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    objects = ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "band", "bucket"],
+                name="recipebucket_lookup",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.band}:{self.bucket}"
+
+
+class IngredientPosting(models.Model):
+    """recipes using an ingredient, kept as sorted packed arrays
+
+    An ingredient's posting is split into segments by recipe id, so an
+    edit locks and rewrites only the segments holding the recipes it
+    touches.
+    """
+
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="postings",
+        # covered by the (ingredient, segment) constraint
+        db_index=False,
+    )
+    # recipe id >> recipe.pantry.SEGMENT_BITS of every recipe held
+    segment = models.PositiveIntegerField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    # little-endian int64 recipe ids in ascending order, and the number of
+    # ingredients of each of those recipes as int32 at the same position
+    recipe_ids = models.BinaryField(default=b"")
+    totals = models.BinaryField(default=b"")
+
+    objects = ShardedManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ingredient", "segment"],
+                name="posting_ingredient_segment",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient_id}/{self.segment}"
+
+
+class AccountDeletion(models.Model):
+    """background job deleting an account and all of its data"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    # no foreign key, the job outlives the user it deletes
+    user_id = models.PositiveBigIntegerField(db_index=True)
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+    )
+    recipes_total = models.PositiveIntegerField(default=0)
+    recipes_deleted = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.status}"
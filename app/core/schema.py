@@ -0,0 +1,124 @@
+"""
+Precomputed OpenAPI schema
+"""
+
+import gzip
+import hashlib
+import os
+from collections import namedtuple
+
+from django.conf import settings
+from drf_spectacular.generators import SchemaGenerator
+from drf_spectacular.renderers import (
+    OpenApiJsonRenderer,
+    OpenApiYamlRenderer,
+)
+
+from core import coalescing
+
+
+RENDERERS = {
+    "yaml": OpenApiYamlRenderer,
+    "json": OpenApiJsonRenderer,
+}
+
+CachedSchema = namedtuple("CachedSchema", ["body", "gzipped", "etag"])
+
+_cache = {}
+
+
+def generate():
+    """introspect the API and return the schema as a dict"""
+    return SchemaGenerator().get_schema(request=None, public=True)
+
+
+def render(schema, fmt):
+    """return schema rendered as fmt bytes"""
+    return RENDERERS[fmt]().render(schema, renderer_context={})
+
+
+def cache_path(fmt, version=None):
+    """return the file holding the schema of a code version"""
+    return os.path.join(
+        settings.SCHEMA_CACHE_DIR,
+        f"schema-{version or settings.APP_VERSION}.{fmt}",
+    )
+
+
+def _cached(body):
+    """return body with its gzipped form and ETag"""
+    return CachedSchema(
+        body,
+        gzip.compress(body, compresslevel=9, mtime=0),
+        f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+    )
+
+
+def _write(path, body):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def _render_all():
+    """generate the schema once and render it in every format"""
+    schema = generate()
+    return {fmt: _cached(render(schema, fmt)) for fmt in RENDERERS}
+
+
+def _render_and_store():
+    entries = _render_all()
+    try:
+        store(entries)
+    except OSError:
+        # a read-only cache only costs the next process a rebuild
+        pass
+    return entries
+
+
+def store(entries, version=None):
+    """write rendered schemas and their gzipped forms to the cache"""
+    os.makedirs(settings.SCHEMA_CACHE_DIR, exist_ok=True)
+    for fmt, entry in entries.items():
+        path = cache_path(fmt, version)
+        _write(f"{path}.gz", entry.gzipped)
+        _write(path, entry.body)
+
+
+def build(version=None):
+    """render the schema in every format into the cache directory"""
+    entries = _render_all()
+    store(entries, version)
+    return [cache_path(fmt, version) for fmt in entries]
+
+
+def get(fmt):
+    """return the cached schema for the running code version
+
+    The schema is read from the cache directory, or generated and stored
+    there when it holds nothing for this version yet. With DEBUG on it is
+    generated on every call so code changes show up straight away.
+    """
+    if settings.DEBUG:
+        return _cached(render(generate(), fmt))
+
+    key = (settings.APP_VERSION, fmt)
+    if key not in _cache:
+        try:
+            with open(cache_path(fmt), "rb") as f:
+                _cache[key] = _cached(f.read())
+        except FileNotFoundError:
+            # workers starting on a new version all want it at once
+            entries = coalescing.run(
+                coalescing.make_key("schema", settings.APP_VERSION),
+                _render_and_store,
+            )
+            for name, entry in entries.items():
+                _cache[(settings.APP_VERSION, name)] = entry
+    return _cache[key]
+
+
+def clear():
+    """forget schemas held in memory"""
+    _cache.clear()
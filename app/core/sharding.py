@@ -0,0 +1,332 @@
+"""
+Shard map and database router for per-user recipe data
+"""
+
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import F
+
+from core.invalidation import bus
+from core.models import (
+    UserShard,
+    Recipe,
+    Tag,
+    Ingredient,
+    ImageUpload,
+    RecipeSignature,
+    RecipeBucket,
+    IngredientPosting,
+)
+
+SHARDED_MODELS = {
+    "recipe",
+    "tag",
+    "ingredient",
+    "recipe_tags",
+    "recipe_ingredients",
+    "imageupload",
+    "recipesignature",
+    "recipebucket",
+    "ingredientposting",
+}
+
+# Recipes, tags and ingredients are numbered from one sequence in the
+# default database rather than by their shard, so they keep their ids when
+# their user moves shards.
+ID_SEQUENCE = "core_sharded_id"
+
+
+# advisory locks on default keep writers and a move of the same user apart,
+# keyed by this class and the user id
+MOVE_LOCK_CLASS = zlib.crc32(b"recipe-app-move") & 0x7FFFFFFF
+
+
+class UserMoving(Exception):
+    """the user's data is being moved to another shard"""
+
+
+def _advisory_lock(function, user_id):
+    """run an advisory lock function on default, returning its result"""
+    with connections["default"].cursor() as cursor:
+        cursor.execute(
+            f"SELECT {function}(%s, %s)",
+            [MOVE_LOCK_CLASS, user_id],
+        )
+        return cursor.fetchone()[0]
+
+
+@contextmanager
+def writing(user_id):
+    """hold off moves of user_id's data while the block writes to it
+
+    Raises UserMoving instead of waiting if a move is under way. Only
+    PostgreSQL has advisory locks; elsewhere writers rely on is_moving.
+    """
+    if connections["default"].vendor != "postgresql":
+        yield
+        return
+
+    if not _advisory_lock("pg_try_advisory_lock_shared", user_id):
+        raise UserMoving()
+    try:
+        yield
+    finally:
+        _advisory_lock("pg_advisory_unlock_shared", user_id)
+
+
+@contextmanager
+def _moving(user_id):
+    """wait for writers of user_id's data to finish and keep new ones out"""
+    if connections["default"].vendor != "postgresql":
+        yield
+        return
+
+    _advisory_lock("pg_advisory_lock", user_id)
+    try:
+        yield
+    finally:
+        _advisory_lock("pg_advisory_unlock", user_id)
+
+
+def next_id():
+    """return a new id for a recipe, tag or ingredient on any shard"""
+    connection = connections["default"]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [ID_SEQUENCE])
+            return cursor.fetchone()[0]
+    # elsewhere the sequence is a one row table
+    with transaction.atomic(using="default"), connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {ID_SEQUENCE} SET last_id = last_id + 1")
+        cursor.execute(f"SELECT last_id FROM {ID_SEQUENCE}")
+        return cursor.fetchone()[0]
+
+
+def is_sharded(model):
+    """return True if rows of model live on the owning user's shard"""
+    return (
+        model._meta.app_label == "core"
+        and model._meta.model_name in SHARDED_MODELS
+    )
+
+
+def placement_for_user_id(user_id):
+    """return the shard new data for a user is placed on
+
+    Users keep the shard recorded in their UserShard, so adding a shard
+    only changes where new users go. Placement is by id modulo the number
+    of shards, though, so a rebalance after adding one moves about
+    (N-1)/N of all users, not just the share the new shard should take.
+    """
+    shards = settings.DB_SHARDS
+    return shards[user_id % len(shards)]
+
+
+def get_user_shard(user):
+    """return the shard map entry for user, assigning one on first use"""
+    try:
+        return user.shard
+    except UserShard.DoesNotExist:
+        user_shard, created = UserShard.objects.get_or_create(
+            user_id=user.pk,
+            defaults={"alias": placement_for_user_id(user.pk)},
+        )
+        user.shard = user_shard
+        return user_shard
+
+
+def shard_for_user(user):
+    """return the db alias holding user's recipe data"""
+    return get_user_shard(user).alias
+
+
+def shard_for_user_id(user_id):
+    """return the db alias holding recipe data for user_id"""
+    alias = (
+        UserShard.objects.filter(user_id=user_id)
+        .values_list("alias", flat=True)
+        .first()
+    )
+    if alias is None:
+        user_shard, created = UserShard.objects.get_or_create(
+            user_id=user_id,
+            defaults={"alias": placement_for_user_id(user_id)},
+        )
+        alias = user_shard.alias
+    return alias
+
+
+def find_shard_for_user_id(user_id):
+    """return the db alias holding user_id's data without assigning one"""
+    alias = (
+        UserShard.objects.filter(user_id=user_id)
+        .values_list("alias", flat=True)
+        .first()
+    )
+    return alias or placement_for_user_id(user_id)
+
+
+def _user_querysets(user_id, alias):
+    """return querysets for a user's rows in insert order"""
+    return [
+        Tag.objects.using(alias).filter(user_id=user_id),
+        Ingredient.objects.using(alias).filter(user_id=user_id),
+        Recipe.objects.using(alias).filter(user_id=user_id),
+        ImageUpload.objects.using(alias).filter(user_id=user_id),
+        RecipeSignature.objects.using(alias).filter(user_id=user_id),
+        RecipeBucket.objects.using(alias).filter(user_id=user_id),
+        IngredientPosting.objects.using(alias).filter(user_id=user_id),
+        Recipe.tags.through.objects.using(alias).filter(
+            recipe__user_id=user_id,
+        ),
+        Recipe.ingredients.through.objects.using(alias).filter(
+            recipe__user_id=user_id,
+        ),
+    ]
+
+
+def _copy_rows(queryset, target, batch_size):
+    """insert rows of queryset into target
+
+    Rows keep their ids, except through, bucket and posting rows, which
+    nothing refers to and are numbered by the target.
+    """
+    model = queryset.model
+    renumber = model in (
+        Recipe.tags.through,
+        Recipe.ingredients.through,
+        RecipeBucket,
+        IngredientPosting,
+    )
+    manager = model._base_manager.using(target)
+    batch = []
+    for row in queryset.iterator(chunk_size=batch_size):
+        if renumber:
+            row.pk = None
+        batch.append(row)
+        if len(batch) >= batch_size:
+            manager.bulk_create(batch)
+            batch = []
+    if batch:
+        manager.bulk_create(batch)
+
+
+def _drop_copy(user_id, alias):
+    """delete the copy of user_id's rows on alias, then forget about it"""
+    # the rows live on in another shard, so skip delete signals and cascades
+    with transaction.atomic(using=alias):
+        for queryset in reversed(_user_querysets(user_id, alias)):
+            queryset._raw_delete(alias)
+    UserShard.objects.filter(user_id=user_id, cleanup_alias=alias).update(
+        cleanup_alias="",
+        is_moving=False,
+    )
+
+
+def finish_move(user_id):
+    """delete the copy an interrupted move left of user_id's data
+
+    A move that died before switching the map leaves a partial copy on
+    its target, and one that died after leaves the full copy on its
+    source. Returns the shard cleaned up, or None if there was none.
+    """
+    with _moving(user_id):
+        alias = (
+            UserShard.objects.filter(user_id=user_id)
+            .exclude(cleanup_alias="")
+            .exclude(cleanup_alias=F("alias"))
+            .values_list("cleanup_alias", flat=True)
+            .first()
+        )
+        if alias is None:
+            return None
+        if alias not in settings.DB_SHARDS:
+            raise ValueError(f"Unknown shard {alias}")
+        _drop_copy(user_id, alias)
+    return alias
+
+
+def move_user(user, target, batch_size=500):
+    """copy a user's recipe data to target and repoint the shard map
+
+    Writes for the user are refused while the copy runs, and those begun
+    before are waited for; reads keep being served from the source shard
+    until the map is switched over. Recipes, tags and ingredients keep
+    their ids, which come from next_id, so a copy left behind by an
+    earlier move is deleted first.
+    """
+    if target not in settings.DB_SHARDS:
+        raise ValueError(f"Unknown shard {target}")
+
+    finish_move(user.pk)
+    source = shard_for_user_id(user.pk)
+    if source == target:
+        raise ValueError(f"User is already on shard {target}")
+
+    # recorded first, so a crash leaves the partial copy to be cleaned up
+    UserShard.objects.filter(user_id=user.pk).update(
+        is_moving=True,
+        cleanup_alias=target,
+    )
+    with _moving(user.pk):
+        try:
+            with transaction.atomic(using=target):
+                for queryset in _user_querysets(user.pk, source):
+                    _copy_rows(queryset, target, batch_size)
+            UserShard.objects.filter(user_id=user.pk).update(
+                alias=target,
+                is_moving=False,
+                cleanup_alias=source,
+            )
+        except Exception:
+            UserShard.objects.filter(user_id=user.pk).update(
+                is_moving=False,
+                cleanup_alias="",
+            )
+            raise
+
+        _drop_copy(user.pk, source)
+
+    for model in [Recipe, Tag, Ingredient]:
+        bus.publish(model._meta.label_lower, user.pk, None, target)
+
+    user.shard = UserShard.objects.get(user_id=user.pk)
+    return source
+
+
+class ShardRouter:
+    """route recipe data to the owning user's shard, all else to default"""
+
+    def _db_for_model(self, model, instance=None):
+        if not is_sharded(model):
+            if instance is not None and is_sharded(type(instance)):
+                return "default"
+            return None
+        if instance is None:
+            return None
+        if is_sharded(type(instance)) and instance._state.db:
+            return instance._state.db
+        if isinstance(instance, get_user_model()):
+            return shard_for_user(instance)
+        user_id = getattr(instance, "user_id", None)
+        if user_id is not None:
+            return shard_for_user_id(user_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_model(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_model(model, hints.get("instance"))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        sharded = is_sharded(type(obj1)), is_sharded(type(obj2))
+        if all(sharded):
+            return obj1._state.db == obj2._state.db
+        if any(sharded):
+            return True
+        return None
@@ -0,0 +1,177 @@
+"""
+Signal receivers for core models
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core import deletion, sharding
+from core.invalidation import bus
+from core.models import ImageBlob, Ingredient, Recipe, Tag, UserShard
+
+
+def _image_name(recipe):
+    """return the recipe's image name, or None if the field was deferred"""
+    if "image" not in recipe.__dict__:
+        return None
+    value = recipe.__dict__["image"]
+    return getattr(value, "name", value) or ""
+
+
+def release_image(name, storage, using):
+    """drop a reference to name once the change on shard using commits
+
+    Should the change roll back, the recipe still holds the reference.
+    The file is deleted once its count is gone for good.
+    """
+
+    def release():
+        if not ImageBlob.objects.release(name):
+            return
+
+        def delete_file():
+            # a reference retained in between keeps the file
+            with transaction.atomic(using=ImageBlob.objects.db):
+                ImageBlob.objects.lock([name])
+                if not ImageBlob.objects.filter(name=name).exists():
+                    storage.delete(name)
+
+        transaction.on_commit(delete_file, using=ImageBlob.objects.db)
+
+    transaction.on_commit(release, using=using)
+
+
+def release_images(names, storage, using):
+    """drop one reference per entry of names once using commits"""
+
+    def release():
+        unused = ImageBlob.objects.release_many(names)
+        if not unused:
+            return
+
+        def delete_files():
+            with transaction.atomic(using=ImageBlob.objects.db):
+                ImageBlob.objects.lock(unused)
+                still_used = set(
+                    ImageBlob.objects.filter(name__in=unused).values_list(
+                        "name",
+                        flat=True,
+                    )
+                )
+                for name in unused:
+                    if name not in still_used:
+                        storage.delete(name)
+
+        transaction.on_commit(delete_files, using=ImageBlob.objects.db)
+
+    if names:
+        transaction.on_commit(release, using=using)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def delete_sharded_user_data(sender, instance, using, **kwargs):
+    """delete the user's recipe data in batches ahead of the collector"""
+    alias = (
+        UserShard.objects.using(using)
+        .filter(user_id=instance.pk)
+        .values_list("alias", flat=True)
+        .first()
+    )
+    if alias:
+        deletion.delete_user_data(instance.pk, alias)
+
+
+@receiver(post_init, sender=Recipe)
+def remember_recipe_image(sender, instance, **kwargs):
+    """keep the stored image name to spot replacements on save"""
+    instance._saved_image = _image_name(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe_image(
+    sender,
+    instance,
+    created,
+    update_fields,
+    using,
+    **kwargs,
+):
+    """move the image reference count when a recipe's image changes
+
+    Both ends move once the save commits on the recipe's shard, so a
+    rolled back save leaves the counts as they were.
+    """
+    if update_fields is not None and "image" not in update_fields:
+        return
+    old = "" if created else instance._saved_image
+    new = _image_name(instance)
+    if old is None or old == new:
+        return
+
+    if new:
+        transaction.on_commit(
+            lambda: ImageBlob.objects.retain(new),
+            using=using,
+        )
+    if old:
+        release_image(old, instance.image.storage, using)
+    instance._saved_image = new
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, using, **kwargs):
+    """drop the reference held by a deleted recipe"""
+    name = _image_name(instance)
+    if name:
+        release_image(name, instance.image.storage, using)
+
+
+@receiver(deletion.recipes_deleted)
+def release_deleted_recipe_images(sender, images, using, **kwargs):
+    """drop the references held by a batch of deleted recipes"""
+    if images:
+        release_images(images, Recipe.image.field.storage, using)
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Ingredient)
+def assign_sharded_id(sender, instance, raw, **kwargs):
+    """number a new row from the sequence shared by all shards"""
+    if instance.pk is None and not raw:
+        instance.pk = sharding.next_id()
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_user_row(sender, instance, using, **kwargs):
+    """evict process caches of a changed row owned by a user"""
+    bus.publish(sender._meta.label_lower, instance.user_id, instance.pk, using)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user(sender, instance, using, **kwargs):
+    """evict process caches of everything derived from a changed user"""
+    bus.publish(sender._meta.label_lower, instance.pk, instance.pk, using)
+
+
+@receiver(deletion.recipes_deleted)
+def invalidate_deleted_recipes(sender, user_id, using, **kwargs):
+    """evict process caches of a user's recipes after a batch delete"""
+    bus.publish(Recipe._meta.label_lower, user_id, None, using)
@@ -0,0 +1,227 @@
+"""
+Server-sent events stream of a user's changes, served over ASGI
+
+A stream is a plain ASGI application rather than a Django view, so an
+idle client costs the worker a queue and a pending task, not a thread.
+Each event names the type of object changed, and its data holds the
+action and ids. A "reset" event means events may have been missed and
+the client should fetch everything again.
+
+Browsers' EventSource can't set headers, and a token in the URL would end
+up in access logs, so these clients first exchange their token for a
+ticket that opens one stream within a few seconds.
+
+The token a stream was opened with is checked again every heartbeat, and
+the stream ends once the token is gone or its user deactivated.
+"""
+
+import asyncio
+import json
+import secrets
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+
+from core import events
+
+
+# seconds between comments keeping idle connections open through proxies,
+# and between checks of the stream's token
+HEARTBEAT = 15
+# milliseconds clients wait before reconnecting a dropped stream
+RETRY = 5000
+
+
+class StreamTicketSerializer(serializers.Serializer):
+    """serializer for a ticket opening one events stream"""
+
+    ticket = serializers.CharField()
+    expires_in = serializers.IntegerField()
+
+
+def _ticket_key(ticket):
+    return f"events-ticket:{ticket}"
+
+
+def issue_ticket(user_id, token_key):
+    """return a new ticket opening one stream of user_id's events
+
+    The stream stays open only as long as the token issuing it is valid.
+    """
+    ticket = secrets.token_urlsafe(32)
+    caches[settings.EVENTS_TICKET_CACHE].set(
+        _ticket_key(ticket),
+        (user_id, token_key),
+        settings.EVENTS_TICKET_TTL,
+    )
+    return ticket
+
+
+@sync_to_async
+def _redeem_ticket(ticket):
+    """return (user id, token key) of ticket and use it up, or None"""
+    cache = caches[settings.EVENTS_TICKET_CACHE]
+    key = _ticket_key(ticket)
+    issued = cache.get(key)
+    # of streams racing for a ticket only the one deleting it gets in
+    if issued is None or not cache.delete(key):
+        return None
+    return tuple(issued)
+
+
+def _token_key(scope):
+    """return the token from the Authorization header"""
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            kind, _, key = value.decode("latin-1").partition(" ")
+            if kind.lower() == "token":
+                return key.strip()
+    return None
+
+
+def _ticket(scope):
+    """return the ?ticket= of scope"""
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return params.get("ticket", [None])[0]
+
+
+@sync_to_async
+def _authenticate(key):
+    """return the id of the active user owning token key, or None"""
+    close_old_connections()
+    try:
+        return (
+            Token.objects.filter(key=key, user__is_active=True)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+    finally:
+        close_old_connections()
+
+
+def format_event(payload):
+    """return payload as a server-sent event, or a reset when None"""
+    if payload is None:
+        return b"event: reset\ndata: {}\n\n"
+    event = json.loads(payload)
+    data = json.dumps(
+        {"action": event["action"], "ids": event["ids"]},
+        separators=(",", ":"),
+    )
+    return f"event: {event['type']}\ndata: {data}\n\n".encode()
+
+
+async def _respond(send, status, detail):
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _disconnected(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_events(scope, receive, send):
+    """send the events of the authed user until the client goes away"""
+    if scope["method"] != "GET":
+        await _respond(
+            send,
+            405,
+            f'Method "{scope["method"]}" not allowed.',
+        )
+        return
+    key = _token_key(scope)
+    ticket = _ticket(scope)
+    user_id = None
+    if key:
+        user_id = await _authenticate(key)
+    elif ticket:
+        user_id, key = await _redeem_ticket(ticket) or (None, None)
+    if user_id is None:
+        await _respond(send, 401, "Invalid or missing token or ticket.")
+        return
+    hub = events.get_hub()
+    try:
+        stream = hub.subscribe(user_id)
+    except Exception:
+        await _respond(send, 503, "Change events are unavailable.")
+        return
+
+    loop = asyncio.get_running_loop()
+    checked = loop.time()
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    next_event = asyncio.ensure_future(stream.get())
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    # nginx must pass events on as they come
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": f"retry: {RETRY}\n\n".encode(),
+                "more_body": True,
+            }
+        )
+        while True:
+            done, _ = await asyncio.wait(
+                {disconnected, next_event},
+                timeout=HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                break
+            if loop.time() - checked >= HEARTBEAT:
+                # logged out, rotated or deactivated since the stream began
+                if await _authenticate(key) != user_id:
+                    await send({"type": "http.response.body", "body": b""})
+                    break
+                checked = loop.time()
+            if next_event in done:
+                body = format_event(next_event.result())
+                next_event = asyncio.ensure_future(stream.get())
+            else:
+                body = b": ping\n\n"
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": body,
+                    "more_body": True,
+                }
+            )
+    finally:
+        hub.unsubscribe(stream)
+        disconnected.cancel()
+        next_event.cancel()
+
+
+def route_events(application):
+    """return application with the events path served by stream_events"""
+
+    async def router(scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == settings.EVENTS_PATH:
+            await stream_events(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+
+    return router
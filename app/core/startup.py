@@ -0,0 +1,85 @@
+"""
+Helpers for the container startup command
+"""
+
+import hashlib
+import os
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.db.migrations.executor import MigrationExecutor
+
+
+STATIC_HASH_FILE = ".collectstatic-hash"
+
+# any fixed number shared by every replica works as the lock key
+MIGRATE_LOCK_KEY = zlib.crc32(b"recipe-app-migrate")
+
+
+def static_manifest_hash():
+    """return a hash over the names and contents of all static files
+
+    The storage collecting them is part of it, since a new one lays the
+    collected files out differently.
+    """
+    ignore_patterns = ["CVS", ".*", "*~"]
+    files = []
+    for finder in finders.get_finders():
+        for path, storage in finder.list(ignore_patterns):
+            prefix = getattr(storage, "prefix", None) or ""
+            files.append((os.path.join(prefix, path), storage.path(path)))
+
+    digest = hashlib.sha256(settings.STATICFILES_STORAGE.encode() + b"\0")
+    for name, full_path in sorted(files):
+        digest.update(name.encode() + b"\0")
+        with open(full_path, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def collected_static_hash():
+    """return the hash recorded by the last collectstatic, if any"""
+    try:
+        with open(os.path.join(settings.STATIC_ROOT, STATIC_HASH_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def record_static_hash(value):
+    """remember the hash of the static files just collected"""
+    with open(os.path.join(settings.STATIC_ROOT, STATIC_HASH_FILE), "w") as f:
+        f.write(value)
+
+
+def has_unapplied_migrations(connection):
+    """return whether migrate would apply anything on connection"""
+    executor = MigrationExecutor(connection)
+    targets = executor.loader.graph.leaf_nodes()
+    return bool(executor.migration_plan(targets))
+
+
+@contextmanager
+def migrate_lock(connection):
+    """hold a session advisory lock so one replica migrates at a time
+
+    Only PostgreSQL has advisory locks; other backends run unlocked.
+    """
+    if connection.vendor != "postgresql":
+        yield
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", [MIGRATE_LOCK_KEY])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_unlock(%s)",
+                [MIGRATE_LOCK_KEY],
+            )
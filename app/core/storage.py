@@ -0,0 +1,154 @@
+"""
+Storage backends
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import brotli
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """store each distinct file once, named by the SHA-256 of its content
+
+    A file saved as ``uploads/recipe/a.jpg`` ends up at
+    ``uploads/recipe/ab/cd/abcd...ef.jpg``, so names never change meaning and
+    can be cached forever.
+    """
+
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        """the content decides the final name, so never rename on clashes"""
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        full_dir = self.path(directory)
+        os.makedirs(full_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=full_dir, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            name = os.path.join(
+                directory,
+                hexdigest[:2],
+                hexdigest[2:4],
+                f"{hexdigest}{ext}",
+            )
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return name.replace("\\", "/")
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """hashed static files with gzip and brotli compressed siblings
+
+    Next to each hashed text file, ``x.1a2b3c4d5e6f.css.gz`` and ``.br``
+    are written for nginx to send as is. A hashed name always has the
+    same content, so only names without siblings yet are compressed, in
+    parallel, and an unchanged file costs nothing on the next run.
+    """
+
+    compressible = (
+        ".css", ".eot", ".html", ".ico", ".js", ".json", ".map", ".otf",
+        ".svg", ".ttf", ".txt", ".xml",
+    )
+    encodings = [
+        (".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+        (".br", brotli.compress),
+    ]
+    # a sibling saving less than this fraction isn't worth decoding
+    min_saving = 0.05
+    max_workers = None
+    skipped_name = "staticfiles-uncompressed.json"
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        names = [
+            name
+            for name in sorted(set(self.hashed_files.values()))
+            if name.lower().endswith(self.compressible)
+        ]
+        known = self.load_skipped()
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            # list() surfaces the first error raised by a worker
+            found = list(
+                executor.map(lambda name: self.compress(name, known), names)
+            )
+        # siblings of files no longer collected are forgotten
+        siblings = {
+            name + suffix for name in names for suffix, _ in self.encodings
+        }
+        skipped = (known & siblings).union(*found)
+        if skipped != known:
+            self.save_skipped(skipped)
+
+    def load_skipped(self):
+        """return the siblings earlier runs found not worth writing"""
+        try:
+            with open(self.path(self.skipped_name)) as f:
+                return set(json.load(f))
+        except FileNotFoundError:
+            return set()
+
+    def save_skipped(self, skipped):
+        """replace the list of skipped siblings at once"""
+        path = self.path(self.skipped_name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(sorted(skipped), f, indent=0)
+        os.replace(path + ".tmp", path)
+
+    def compress(self, name, skipped=frozenset()):
+        """write the compressed siblings of name not written yet
+
+        Returns the names of the siblings saving too little to write.
+        """
+        path = self.path(name)
+        missing = [
+            (suffix, compress)
+            for suffix, compress in self.encodings
+            if name + suffix not in skipped
+            and not os.path.exists(path + suffix)
+        ]
+        if not missing:
+            return set()
+        with open(path, "rb") as f:
+            data = f.read()
+        small = set()
+        for suffix, compress in missing:
+            compressed = compress(data)
+            if len(compressed) > len(data) * (1 - self.min_saving):
+                small.add(name + suffix)
+                continue
+            with open(path + suffix + ".tmp", "wb") as f:
+                f.write(compressed)
+            os.replace(path + suffix + ".tmp", path + suffix)
+        return small
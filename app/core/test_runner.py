@@ -0,0 +1,36 @@
+"""
+Test runner for the project
+"""
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """run tests with request throttling and the static manifest off
+
+    Buckets live in the cache, which outlives the transaction each test
+    runs in, so limits would build up over the whole suite. Tests of the
+    throttling itself turn rates back on with override_settings.
+
+    Pages linking static files would need a collectstatic run first to
+    find their hashed names in the manifest.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_settings = override_settings(
+            REST_FRAMEWORK={
+                **settings.REST_FRAMEWORK,
+                "DEFAULT_THROTTLE_RATES": {},
+            },
+            STATICFILES_STORAGE=(
+                "django.contrib.staticfiles.storage.StaticFilesStorage"
+            ),
+        )
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,219 @@
+"""
+Tests for the batch API
+"""
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import microcache
+from core.models import Recipe, Tag
+from core.sharding import shard_for_user
+
+
+BATCH_URL = reverse("batch")
+RECIPES_URL = reverse("recipe:recipe-list")
+TAGS_URL = reverse("recipe:tag-list")
+
+
+def recipe_payload(**params):
+    payload = {"title": "Batch pie", "time_minutes": 30, "price": "4.50"}
+    payload.update(params)
+    return payload
+
+
+class PublicBatchApiTests(TestCase):
+    """Test unauthenticated batch requests"""
+
+    def test_auth_required(self):
+        """test auth is required to run a batch"""
+        res = APIClient().post(
+            BATCH_URL,
+            {"operations": [{"method": "GET", "path": TAGS_URL}]},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchApiTests(TestCase):
+    """Test authenticated batch requests"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+
+    def run_batch(self, operations, atomic=False):
+        res = self.client.post(
+            BATCH_URL,
+            {"operations": operations, "atomic": atomic},
+            format="json",
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_operations_run_in_order(self):
+        """test each operation sees the effects of the earlier ones"""
+        data = self.run_batch([
+            {
+                "method": "POST",
+                "path": RECIPES_URL,
+                "body": recipe_payload(tags=[{"name": "Vegan"}]),
+            },
+            {"method": "GET", "path": TAGS_URL},
+        ])
+
+        self.assertTrue(data["committed"])
+        first, second = data["results"]
+        self.assertEqual(first["status"], status.HTTP_201_CREATED)
+        self.assertEqual(second["status"], status.HTTP_200_OK)
+        self.assertEqual([tag["name"] for tag in second["body"]], ["Vegan"])
+
+    def test_references_earlier_results(self):
+        """test paths and bodies can use values of named results"""
+        data = self.run_batch([
+            {
+                "name": "pie",
+                "method": "POST",
+                "path": RECIPES_URL,
+                "body": recipe_payload(),
+            },
+            {
+                "method": "PATCH",
+                "path": RECIPES_URL + "{{pie.id}}/",
+                "body": {"description": "Made in {{pie.time_minutes}}"},
+            },
+        ])
+
+        recipe = Recipe.objects.using(self.shard).get(user=self.user)
+        self.assertEqual(data["results"][0]["body"]["id"], recipe.id)
+        self.assertEqual(data["results"][1]["status"], status.HTTP_200_OK)
+        self.assertEqual(recipe.description, "Made in 30")
+
+    def test_whole_reference_keeps_type(self):
+        """test a value that is only a reference isn't made a string"""
+        data = self.run_batch([
+            {
+                "name": "pie",
+                "method": "POST",
+                "path": RECIPES_URL,
+                "body": recipe_payload(tags=[{"name": "Quick"}]),
+            },
+            {
+                "method": "POST",
+                "path": RECIPES_URL,
+                "body": recipe_payload(tags="{{pie.tags}}"),
+            },
+        ])
+
+        self.assertEqual(data["results"][1]["status"], status.HTTP_201_CREATED)
+        tags = Tag.objects.using(self.shard).filter(user=self.user)
+        self.assertEqual(tags.count(), 1)
+        recipes = Recipe.objects.using(self.shard).filter(tags__name="Quick")
+        self.assertEqual(recipes.count(), 2)
+
+    def test_failure_doesnt_stop_batch(self):
+        """test later operations still run unless the batch is atomic"""
+        data = self.run_batch([
+            {"method": "POST", "path": RECIPES_URL, "body": {}},
+            {"method": "POST", "path": RECIPES_URL, "body": recipe_payload()},
+        ])
+
+        self.assertTrue(data["committed"])
+        statuses = [result["status"] for result in data["results"]]
+        self.assertEqual(
+            statuses,
+            [status.HTTP_400_BAD_REQUEST, status.HTTP_201_CREATED],
+        )
+        recipes = Recipe.objects.using(self.shard).filter(user=self.user)
+        self.assertTrue(recipes.exists())
+
+    def test_atomic_failure_rolls_back(self):
+        """test a failing atomic batch leaves nothing behind"""
+        data = self.run_batch(
+            [
+                {
+                    "method": "POST",
+                    "path": RECIPES_URL,
+                    "body": recipe_payload(tags=[{"name": "Vegan"}]),
+                },
+                {"method": "POST", "path": RECIPES_URL, "body": {}},
+                {"method": "GET", "path": TAGS_URL},
+            ],
+            atomic=True,
+        )
+
+        self.assertFalse(data["committed"])
+        statuses = [result["status"] for result in data["results"]]
+        self.assertEqual(
+            statuses,
+            [
+                status.HTTP_201_CREATED,
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_424_FAILED_DEPENDENCY,
+            ],
+        )
+        self.assertFalse(Recipe.objects.using(self.shard).exists())
+        self.assertFalse(Tag.objects.using(self.shard).exists())
+
+    def test_reference_to_failed_operation(self):
+        """test operations using a failed result don't run"""
+        data = self.run_batch([
+            {"name": "bad", "method": "POST", "path": RECIPES_URL, "body": {}},
+            {"method": "GET", "path": RECIPES_URL + "{{bad.id}}/"},
+            {"method": "GET", "path": RECIPES_URL + "{{missing.id}}/"},
+        ])
+
+        statuses = [result["status"] for result in data["results"]]
+        self.assertEqual(
+            statuses,
+            [
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_424_FAILED_DEPENDENCY,
+                status.HTTP_400_BAD_REQUEST,
+            ],
+        )
+
+    def test_only_api_routes(self):
+        """test paths outside the recipe and user APIs aren't run"""
+        data = self.run_batch([
+            {"method": "GET", "path": reverse("health-check")},
+            {"method": "POST", "path": BATCH_URL, "body": {}},
+            {"method": "GET", "path": "/no/such/path/"},
+        ])
+
+        statuses = [result["status"] for result in data["results"]]
+        self.assertEqual(statuses, [status.HTTP_404_NOT_FOUND] * 3)
+
+    def test_operations_limited(self):
+        """test batches over the operation limit are rejected"""
+        res = self.client.post(
+            BATCH_URL,
+            {"operations": [{"method": "GET", "path": TAGS_URL}] * 26},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(MICROCACHE_TTL=5)
+    def test_proxy_headers_left_out(self):
+        """test headers meant for nginx aren't passed on in results"""
+        data = self.run_batch([
+            {"method": "POST", "path": RECIPES_URL, "body": recipe_payload()},
+            {"method": "GET", "path": RECIPES_URL},
+        ])
+
+        for result in data["results"]:
+            self.assertNotIn(microcache.TAG_HEADER, result["headers"])
+            self.assertNotIn(microcache.PURGE_HEADER, result["headers"])
+            self.assertNotIn("X-Accel-Expires", result["headers"])
+        self.assertIn("Content-Type", data["results"][1]["headers"])
@@ -0,0 +1,260 @@
+"""
+Tests for coalescing identical reads
+"""
+
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import coalescing
+
+
+RECIPES_URL = reverse("recipe:recipe-list")
+
+
+class Computation:
+    """a computation that blocks until released, counting its calls"""
+
+    def __init__(self, result="result", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def in_thread(target, results):
+    """start target in a thread that appends its result to results"""
+    thread = threading.Thread(target=lambda: results.append(target()))
+    thread.start()
+    return thread
+
+
+class CoalescingTests(SimpleTestCase):
+    """Test identical calls in flight share one computation"""
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_followers_share_leader_result(self):
+        """test calls made while the leader runs get its result"""
+        compute = Computation()
+        results = []
+        leader = in_thread(lambda: coalescing.run("k", compute), results)
+        compute.started.wait(5)
+        followers = [
+            in_thread(lambda: coalescing.run("k", compute), results)
+            for _ in range(3)
+        ]
+        # let the followers start waiting on the flight
+        time.sleep(0.05)
+
+        compute.release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(compute.calls, 1)
+        self.assertEqual(results, ["result"] * 4)
+
+    def test_later_calls_compute_again(self):
+        """test a finished flight isn't reused"""
+        compute = Computation()
+        compute.release.set()
+
+        coalescing.run("k", compute)
+        coalescing.run("k", compute)
+
+        self.assertEqual(compute.calls, 2)
+
+    @override_settings(COALESCE_WAIT=0.05)
+    def test_follower_computes_after_wait(self):
+        """test a follower stops waiting on a slow leader"""
+        slow = Computation("slow")
+        results = []
+        leader = in_thread(lambda: coalescing.run("k", slow), results)
+        slow.started.wait(5)
+
+        result = coalescing.run("k", lambda: "own")
+
+        slow.release.set()
+        leader.join(5)
+        self.assertEqual(result, "own")
+
+    def test_follower_computes_after_leader_fails(self):
+        """test a leader's error isn't handed to followers"""
+        failing = Computation(error=RuntimeError("boom"))
+        results = []
+        leader = in_thread(lambda: self.swallow(failing), results)
+        failing.started.wait(5)
+        follower = in_thread(
+            lambda: coalescing.run("k", lambda: "own"),
+            results,
+        )
+        time.sleep(0.05)
+
+        failing.release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(sorted(results), ["failed", "own"])
+
+    def swallow(self, compute):
+        try:
+            return coalescing.run("k", compute)
+        except RuntimeError:
+            return "failed"
+
+    @override_settings(COALESCE_ACROSS_PROCESSES=True)
+    def test_result_published_by_other_process(self):
+        """test a follower takes the result a leader elsewhere published"""
+        cache = caches["default"]
+        cache.set("k", "other")
+        cache.set("k:other", "theirs")
+
+        self.assertEqual(coalescing.run("k", lambda: "own"), "theirs")
+
+    @override_settings(COALESCE_ACROSS_PROCESSES=True)
+    def test_leader_elsewhere_gone(self):
+        """test a follower computes when the other leader gives up"""
+        cache = caches["default"]
+        cache.set("k", "other")
+        threading.Timer(0.05, cache.delete, ["k"]).start()
+
+        self.assertEqual(coalescing.run("k", lambda: "own"), "own")
+
+    @override_settings(COALESCE_ACROSS_PROCESSES=True)
+    def test_leader_unlocks_shared_lock(self):
+        """test the shared lock is released once the result is published"""
+        self.assertEqual(coalescing.run("k", lambda: "own"), "own")
+
+        self.assertIsNone(caches["default"].get("k"))
+
+
+class BrokenCache:
+    """a cache whose every call fails, as when memcached is down"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionRefusedError()
+
+        return fail
+
+
+@override_settings(COALESCE_ACROSS_PROCESSES=True)
+class CacheFailureTests(SimpleTestCase):
+    """Test calls succeed on their own when the shared cache fails"""
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_cache_down(self):
+        """test reads compute and writes go through without the cache"""
+        with patch("core.coalescing.caches", {"default": BrokenCache()}):
+            with self.assertLogs("core.coalescing", "ERROR"):
+                self.assertNotEqual(
+                    coalescing.generation("user:1"),
+                    coalescing.generation("user:1"),
+                )
+                coalescing.bump("user:1")
+                self.assertEqual(coalescing.run("k", lambda: "own"), "own")
+
+    def test_result_not_published(self):
+        """test the leader returns its result when publishing fails"""
+        with patch.object(
+            caches["default"],
+            "set",
+            side_effect=ValueError("object too large for cache"),
+        ):
+            with self.assertLogs("core.coalescing", "ERROR"):
+                result = coalescing.run("k", lambda: "own")
+
+        self.assertEqual(result, "own")
+        self.assertIsNone(caches["default"].get("k"))
+
+    def test_follower_cache_fails(self):
+        """test a follower computes when reading the result fails"""
+        cache = caches["default"]
+        cache.set("k", "other")
+
+        with patch.object(cache, "get", side_effect=TimeoutError()):
+            with self.assertLogs("core.coalescing", "ERROR"):
+                result = coalescing.run("k", lambda: "own")
+
+        self.assertEqual(result, "own")
+
+
+class CoalescedApiTests(TestCase):
+    """Test recipe reads coalesce until the user writes"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        caches["default"].clear()
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_write_starts_new_generation(self):
+        """test reads after a write don't join reads from before it"""
+        scope = f"user:{self.user.pk}"
+        before = coalescing.generation(scope)
+
+        res = self.client.post(
+            RECIPES_URL,
+            {"title": "Soup", "time_minutes": 5, "price": "1.00"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(coalescing.generation(scope), before + 1)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(len(res.data), 1)
+
+    def test_failed_write_keeps_generation(self):
+        """test a rejected write leaves reads coalescing"""
+        scope = f"user:{self.user.pk}"
+
+        self.client.post(RECIPES_URL, {"title": ""})
+
+        self.assertEqual(coalescing.generation(scope), 0)
+
+    def test_key_depends_on_user_and_params(self):
+        """test only the same user and params share a result"""
+        other = APIClient()
+        other.force_authenticate(
+            get_user_model().objects.create_user(
+                "other@example.com",
+                "testpass123",
+            )
+        )
+
+        with patch("core.coalescing.run", wraps=coalescing.run) as run:
+            for client, params in [
+                (self.client, {"ordering": "price"}),
+                (self.client, {"ordering": "price"}),
+                (self.client, {"ordering": "time"}),
+                (other, {"ordering": "price"}),
+            ]:
+                res = client.get(RECIPES_URL, params)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        keys = [call.args[0] for call in run.call_args_list]
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(len(set(keys)), 3)
@@ -2,15 +2,21 @@
 Test custom django management commands
 """
 
+import os
+import shutil
+import tempfile
+from io import StringIO
 from unittest.mock import patch
 
 from psycopg2 import OperationalError as Psycopg2Error
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 
 
+@override_settings(DB_SHARDS=["default"])
 @patch("core.management.commands.wait_for_db.Command.check")
 class CommandTests(SimpleTestCase):
     """Test commands"""
@@ -23,6 +29,15 @@ class CommandTests(SimpleTestCase):
 
         patched_check.assert_called_once_with(databases=["default"])
 
+    @override_settings(DB_SHARDS=["one", "two"])
+    def test_wait_for_db_default_and_shards(self, patched_check):
+        """test default is waited for even when it holds no shard"""
+        call_command("wait_for_db")
+
+        patched_check.assert_called_once_with(
+            databases=["default", "one", "two"],
+        )
+
     @patch("time.sleep")
     def test_wait_for_db_delay(self, patched_sleep, patched_check):
         """Test waiting for db when getting OperationalError"""
@@ -34,3 +49,90 @@ class CommandTests(SimpleTestCase):
         call_command("wait_for_db")
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=["default"])
+
+    @patch("time.sleep")
+    def test_wait_for_db_backoff(self, patched_sleep, patched_check):
+        """Test the wait between attempts grows and stays bounded"""
+        patched_check.side_effect = [OperationalError] * 8 + [True]
+
+        with patch("random.uniform", side_effect=lambda a, b: b):
+            call_command("wait_for_db", "--max-delay", "1")
+
+        waits = [c.args[0] for c in patched_sleep.call_args_list]
+        self.assertEqual(waits[:4], [0.1, 0.2, 0.4, 0.8])
+        self.assertEqual(max(waits), 1)
+
+    @patch("time.sleep")
+    def test_wait_for_db_timeout(self, patched_sleep, patched_check):
+        """Test giving up once the timeout has passed"""
+        patched_check.side_effect = OperationalError
+
+        with self.assertRaises(CommandError):
+            call_command("wait_for_db", "--timeout", "0")
+
+
+class StartupCommandTests(TestCase):
+    """Test the startup command"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            STATIC_ROOT=self.static_root,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.static_root)
+
+    def call(self, *args):
+        out = StringIO()
+        with patch(
+            "core.management.commands.wait_for_db.Command.check",
+        ):
+            call_command("startup", *args, stdout=out)
+        return out.getvalue()
+
+    def test_collectstatic_skipped_when_unchanged(self):
+        """test static files are only collected when they changed"""
+        out = self.call("--skip-migrate")
+
+        self.assertNotIn("skipping collectstatic", out)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.static_root, "admin")),
+        )
+
+        out = self.call("--skip-migrate")
+
+        self.assertIn("skipping collectstatic", out)
+
+    def test_migrate_skipped_when_applied(self):
+        """test migrate isn't run when nothing is unapplied"""
+        with patch("core.startup.migrate_lock") as patched_lock:
+            out = self.call("--skip-static")
+
+        self.assertIn("No unapplied migrations on default", out)
+        patched_lock.assert_not_called()
+
+    def test_phase_timings(self):
+        """test each startup phase reports its duration"""
+        out = self.call()
+
+        for phase in ["wait_for_db", "collectstatic", "migrate default"]:
+            self.assertIn(f"startup: {phase} took", out)
+        self.assertIn("startup: ready in", out)
+
+    @override_settings(DB_SHARDS=["one", "two"])
+    def test_default_migrated_without_shard(self):
+        """test default is migrated even when it holds no shard"""
+        with patch(
+            "core.management.commands.startup.Command.migrate",
+        ) as patched_migrate:
+            self.call("--skip-static")
+
+        self.assertEqual(
+            [c.args[0] for c in patched_migrate.call_args_list],
+            ["default", "one", "two"],
+        )
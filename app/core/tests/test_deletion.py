@@ -0,0 +1,296 @@
+"""
+Tests for batched recipe and account deletion
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core import deletion
+from core.models import (
+    AccountDeletion,
+    ImageBlob,
+    ImageUpload,
+    Ingredient,
+    IngredientPosting,
+    Recipe,
+    RecipeBucket,
+    RecipeSignature,
+    Tag,
+    UserShard,
+)
+from core.sharding import shard_for_user
+from core.tests.test_storage import StorageTestMixin
+from recipe import pantry
+
+
+def create_user(email="user@example.com"):
+    return get_user_model().objects.create_user(email, "testpass123")
+
+
+def create_recipe(user, tags=(), ingredients=(), image=None):
+    recipe = Recipe.objects.create(
+        user=user,
+        title="Sample recipe",
+        time_minutes=5,
+        price=Decimal("1.00"),
+    )
+    recipe.tags.add(*tags)
+    recipe.ingredients.add(*ingredients)
+    if image is not None:
+        recipe.image.save("image.jpg", ContentFile(image))
+    return recipe
+
+
+class DeleteRecipesTests(StorageTestMixin, TestCase):
+    """Test deleting recipes in batches without the collector"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.shard = shard_for_user(self.user)
+        self.tag = Tag.objects.create(user=self.user, name="Vegan")
+        self.ingredient = Ingredient.objects.create(
+            user=self.user,
+            name="Salt",
+        )
+
+    def test_dependent_rows_deleted(self):
+        """test rows hanging off deleted recipes go with them"""
+        recipe = create_recipe(self.user, [self.tag], [self.ingredient])
+        kept = create_recipe(self.user, [self.tag], [self.ingredient])
+        ImageUpload.objects.create(user=self.user, recipe=recipe, size=10)
+
+        deleted = deletion.delete_recipes(
+            self.user.pk,
+            [recipe.id],
+            self.shard,
+        )
+
+        self.assertEqual(deleted, 1)
+        self.assertFalse(
+            Recipe.objects.filter(user=self.user, id=recipe.id).exists()
+        )
+        for model in [ImageUpload, RecipeSignature, RecipeBucket]:
+            self.assertFalse(
+                model.objects.filter(
+                    user=self.user,
+                    recipe_id=recipe.id,
+                ).exists()
+            )
+        self.assertEqual(list(self.tag.recipe_set.all()), [kept])
+        posting_ids, totals = pantry.unpack(self.ingredient.postings.get())
+        self.assertEqual(posting_ids.tolist(), [kept.id])
+
+    def test_other_users_recipes_kept(self):
+        """test only recipes of the given user are deleted"""
+        other = create_recipe(create_user("other@example.com"))
+
+        deleted = deletion.delete_recipes(
+            self.user.pk,
+            [other.id],
+            other._state.db,
+        )
+
+        self.assertEqual(deleted, 0)
+        self.assertTrue(
+            Recipe.objects.filter(user=other.user, id=other.id).exists()
+        )
+
+    def test_images_released_in_aggregate(self):
+        """test one batch drops every reference its recipes held"""
+        with self.committing():
+            shared = [
+                create_recipe(self.user, image=b"shared") for _ in range(3)
+            ]
+            single = create_recipe(self.user, image=b"single")
+        shared_name, single_name = shared[0].image.name, single.image.name
+
+        with self.committing():
+            deletion.delete_recipes(
+                self.user.pk,
+                [shared[0].id, shared[1].id, single.id],
+                self.shard,
+            )
+
+        self.assertEqual(ImageBlob.objects.get(name=shared_name).ref_count, 1)
+        self.assertTrue(self.storage.exists(shared_name))
+        self.assertFalse(ImageBlob.objects.filter(name=single_name).exists())
+        self.assertFalse(self.storage.exists(single_name))
+
+    def delete_queries(self, count):
+        """return the statements run deleting count recipes in one batch"""
+        ids = [
+            create_recipe(
+                self.user,
+                [self.tag],
+                [self.ingredient],
+                image=str(i).encode(),
+            ).id
+            for i in range(count)
+        ]
+        with CaptureQueriesContext(connections[self.shard]) as ctx:
+            deletion.delete_recipes(self.user.pk, ids, self.shard)
+        return len(ctx.captured_queries)
+
+    def test_queries_independent_of_batch_size(self):
+        """test a batch runs the same statements however big it is"""
+        self.assertEqual(self.delete_queries(2), self.delete_queries(10))
+
+    def test_progress_reported_per_batch(self):
+        """test progress is called with the running count of each batch"""
+        ids = [create_recipe(self.user).id for _ in range(5)]
+        seen = []
+
+        deletion.delete_recipes(
+            self.user.pk,
+            ids,
+            self.shard,
+            batch_size=2,
+            progress=seen.append,
+        )
+
+        self.assertEqual(seen, [2, 4, 5])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+
+class AccountDeletionTests(StorageTestMixin, TestCase):
+    """Test the background account deletion job"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.shard = shard_for_user(self.user)
+        tags = [Tag.objects.create(user=self.user, name="Vegan")]
+        ingredients = [Ingredient.objects.create(user=self.user, name="Salt")]
+        for i in range(5):
+            create_recipe(self.user, tags, ingredients, image=b"photo")
+
+    def assertNoUserData(self, user_id):
+        # the shard map entry goes with the user
+        for model in [
+            Recipe,
+            Tag,
+            Ingredient,
+            IngredientPosting,
+            RecipeSignature,
+            RecipeBucket,
+        ]:
+            rows = model.objects.using(self.shard).filter(user_id=user_id)
+            self.assertFalse(rows.exists())
+        for model in [Recipe.tags.through, Recipe.ingredients.through]:
+            self.assertFalse(model.objects.using(self.shard).exists())
+
+    def test_request_locks_account(self):
+        """test requesting deletion deactivates the user right away"""
+        job = deletion.request_account_deletion(self.user)
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(job.status, AccountDeletion.PENDING)
+        self.assertEqual(deletion.request_account_deletion(self.user), job)
+
+    def test_run_deletes_account(self):
+        """test running a job deletes the user and all their data"""
+        user_id = self.user.pk
+        deletion.request_account_deletion(self.user)
+        job = deletion.claim_job()
+
+        with self.committing():
+            deletion.run_account_deletion(job, batch_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AccountDeletion.DONE)
+        self.assertEqual(job.recipes_total, 5)
+        self.assertEqual(job.recipes_deleted, 5)
+        self.assertIsNotNone(job.finished_at)
+        self.assertFalse(get_user_model().objects.filter(pk=user_id).exists())
+        self.assertNoUserData(user_id)
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_failed_job_recorded(self):
+        """test an error marks the job failed and keeps the user"""
+        deletion.request_account_deletion(self.user)
+        job = deletion.claim_job()
+
+        with patch(
+            "core.deletion.delete_user_data",
+            side_effect=RuntimeError("boom"),
+        ):
+            with self.assertRaises(RuntimeError):
+                deletion.run_account_deletion(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AccountDeletion.FAILED)
+        self.assertIn("boom", job.error)
+        self.assertTrue(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+
+    def test_unknown_shard_fails_job(self):
+        """test a user mapped to a retired shard keeps their account"""
+        UserShard.objects.filter(user=self.user).update(alias="retired")
+        deletion.request_account_deletion(self.user)
+        job = deletion.claim_job()
+
+        with self.assertRaises(ValueError):
+            deletion.run_account_deletion(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AccountDeletion.FAILED)
+        self.assertIn("retired", job.error)
+        self.assertTrue(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertEqual(
+            Recipe.objects.using(self.shard).filter(user=self.user).count(),
+            5,
+        )
+
+    def test_stale_running_job_reclaimed(self):
+        """test a job left running by a dead worker is picked up again"""
+        job = deletion.request_account_deletion(self.user)
+        self.assertEqual(deletion.claim_job(), job)
+        self.assertIsNone(deletion.claim_job())
+
+        AccountDeletion.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - timedelta(
+                seconds=deletion.STALE_AFTER + 1,
+            ),
+        )
+
+        self.assertEqual(deletion.claim_job(), job)
+
+    def test_command_runs_queued_jobs(self):
+        """test the command works through the queue and exits with --once"""
+        user_id = self.user.pk
+        job = deletion.request_account_deletion(self.user)
+        out = StringIO()
+
+        call_command("process_account_deletions", "--once", stdout=out)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AccountDeletion.DONE)
+        self.assertIn("5 recipe(s)", out.getvalue())
+        self.assertNoUserData(user_id)
+
+    def test_user_delete_removes_data(self):
+        """test deleting a user directly removes their data in batches"""
+        user_id = self.user.pk
+
+        self.user.delete()
+
+        self.assertNoUserData(user_id)
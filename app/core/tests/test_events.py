@@ -0,0 +1,394 @@
+"""
+Tests for change events and their server-sent events stream
+"""
+
+import asyncio
+import json
+from unittest import skipUnless
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import caches
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import events, sse
+from core.models import Recipe, Tag
+from core.sharding import shard_for_user
+
+
+RECIPES_URL = reverse("recipe:recipe-list")
+TICKET_URL = reverse("events-ticket")
+TAG_BULK_DELETE_URL = reverse("recipe:tag-bulk-delete")
+
+
+def create_user(email="user@example.com"):
+    return get_user_model().objects.create_user(email, "testpass123")
+
+
+class Connection:
+    """the client side of an ASGI http connection"""
+
+    def __init__(self, query_string=b"", headers=(), method="GET"):
+        self.scope = {
+            "type": "http",
+            "method": method,
+            "path": "/api/recipe/events/",
+            "query_string": query_string,
+            "headers": list(headers),
+        }
+        self.incoming = asyncio.Queue()
+        self.sent = []
+        self.changed = asyncio.Event()
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        self.sent.append(message)
+        self.changed.set()
+
+    def start(self):
+        """run the stream in the background"""
+        self.task = asyncio.ensure_future(
+            sse.stream_events(self.scope, self.receive, self.send)
+        )
+
+    @property
+    def body(self):
+        return b"".join(
+            message.get("body", b"")
+            for message in self.sent
+            if message["type"] == "http.response.body"
+        )
+
+    async def wait_for_body(self, text):
+        """wait until text was sent in the body"""
+        while text not in self.body:
+            self.changed.clear()
+            await asyncio.wait_for(self.changed.wait(), 5)
+
+    async def disconnect(self):
+        await self.incoming.put({"type": "http.disconnect"})
+        await asyncio.wait_for(self.task, 5)
+
+
+@override_settings(EVENTS_BROKER="core.events.MemoryBroker")
+class PublishTests(TestCase):
+    """Test model changes publish events once committed"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = create_user()
+        self.shard = shard_for_user(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.published = []
+        self.broker = events.get_broker()
+        self.broker.listeners.add(self.received)
+
+    def tearDown(self):
+        self.broker.listeners.discard(self.received)
+
+    def received(self, payload):
+        self.published.append(json.loads(payload))
+
+    def assertPublished(self, kind, action, ids):
+        self.assertIn(
+            {"user": self.user.pk, "type": kind, "action": action, "ids": ids},
+            self.published,
+        )
+
+    def test_recipe_created(self):
+        """test creating a recipe publishes its id"""
+        with self.captureOnCommitCallbacks(using=self.shard, execute=True):
+            res = self.client.post(
+                RECIPES_URL,
+                {"title": "Soup", "time_minutes": 5, "price": "1.00"},
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertPublished("recipe", "created", [res.data["id"]])
+
+    def test_recipe_deleted(self):
+        """test deleting a recipe in a batch publishes its id"""
+        recipe = Recipe.objects.using(self.shard).create(
+            user=self.user,
+            title="Soup",
+            time_minutes=5,
+            price="1.00",
+        )
+
+        with self.captureOnCommitCallbacks(using=self.shard, execute=True):
+            res = self.client.delete(
+                reverse("recipe:recipe-detail", args=[recipe.id]),
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertPublished("recipe", "deleted", [recipe.id])
+
+    def test_bulk_attr_delete(self):
+        """test a bulk delete publishes the attrs and recipes it changed"""
+        tag = Tag.objects.using(self.shard).create(
+            user=self.user,
+            name="Vegan",
+        )
+        recipe = Recipe.objects.using(self.shard).create(
+            user=self.user,
+            title="Soup",
+            time_minutes=5,
+            price="1.00",
+        )
+        recipe.tags.add(tag)
+
+        with self.captureOnCommitCallbacks(using=self.shard, execute=True):
+            self.client.post(TAG_BULK_DELETE_URL, {"ids": [tag.id]})
+
+        self.assertPublished("tag", "deleted", [tag.id])
+        self.assertPublished("recipe", "updated", [recipe.id])
+
+    def test_nothing_published_on_rollback(self):
+        """test changes rolled back are never published"""
+        with self.captureOnCommitCallbacks(using=self.shard, execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic(using=self.shard):
+                    Tag.objects.using(self.shard).create(
+                        user=self.user,
+                        name="Vegan",
+                    )
+                    raise RuntimeError()
+
+        self.assertEqual(self.published, [])
+
+    def test_long_id_lists_split(self):
+        """test id lists are split to fit in a notification"""
+        with self.captureOnCommitCallbacks(execute=True):
+            events.publish(self.user.pk, "recipe", "deleted", range(1200))
+
+        self.assertEqual(
+            [len(event["ids"]) for event in self.published],
+            [500, 500, 200],
+        )
+
+
+class HubTests(SimpleTestCase):
+    """Test the hub fans messages out to the streams of their user"""
+
+    async def test_dispatch_to_user_streams(self):
+        """test only streams of the user named get a message"""
+        hub = events.Hub(events.MemoryBroker())
+        mine = [hub.subscribe(1), hub.subscribe(1)]
+        other = hub.subscribe(2)
+
+        hub.dispatch(events.message(1, "tag", "updated", [3]))
+
+        for stream in mine:
+            self.assertEqual(json.loads(await stream.get())["ids"], [3])
+        self.assertTrue(other.queue.empty())
+        hub.stop()
+
+    async def test_overflow_resets_stream(self):
+        """test a stream falling too far behind is told to start over"""
+        hub = events.Hub(events.MemoryBroker())
+        stream = hub.subscribe(1)
+
+        for i in range(events.QUEUE_SIZE + 1):
+            hub.dispatch(events.message(1, "tag", "updated", [i]))
+
+        self.assertIsNone(await stream.get())
+        self.assertTrue(stream.queue.empty())
+        hub.stop()
+
+    async def test_lost_listener_resets_streams(self):
+        """test streams are reset when the broker connection breaks"""
+        hub = events.Hub(events.MemoryBroker())
+        stream = hub.subscribe(1)
+
+        hub.lost()
+
+        self.assertIsNone(await stream.get())
+        hub.stop()
+
+
+@override_settings(EVENTS_BROKER="core.events.MemoryBroker")
+class StreamTests(TestCase):
+    """Test streaming events over ASGI"""
+
+    def setUp(self):
+        events.reset_hub()
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+
+    def tearDown(self):
+        events.reset_hub()
+
+    async def test_token_required(self):
+        """test streams need a token header or a valid ticket"""
+        query_strings = [
+            b"",
+            b"ticket=wrong",
+            f"token={self.token.key}".encode(),
+        ]
+        for query_string in query_strings:
+            conn = Connection(query_string)
+            conn.start()
+            await asyncio.wait_for(conn.task, 5)
+
+            self.assertEqual(conn.sent[0]["status"], 401)
+
+    async def test_events_streamed(self):
+        """test events of the user are sent as they are published"""
+        conn = Connection(
+            headers=[(b"authorization", f"Token {self.token.key}".encode())],
+        )
+        conn.start()
+        await conn.wait_for_body(b"retry:")
+
+        broker = events.get_broker()
+        broker.publish(events.message(self.user.pk, "recipe", "created", [7]))
+        await conn.wait_for_body(b"event: recipe")
+        await conn.disconnect()
+
+        self.assertEqual(conn.sent[0]["status"], 200)
+        self.assertIn(
+            (b"content-type", b"text/event-stream"),
+            conn.sent[0]["headers"],
+        )
+        self.assertIn(
+            b'event: recipe\ndata: {"action":"created","ids":[7]}\n\n',
+            conn.body,
+        )
+        self.assertEqual(events.get_hub().streams, {})
+
+    async def test_ticket_opens_one_stream(self):
+        """test EventSource clients can open a stream once with a ticket"""
+        ticket = await sync_to_async(sse.issue_ticket)(
+            self.user.pk,
+            self.token.key,
+        )
+        conn = Connection(f"ticket={ticket}".encode())
+        conn.start()
+        await conn.wait_for_body(b"retry:")
+        await conn.disconnect()
+        again = Connection(f"ticket={ticket}".encode())
+        again.start()
+        await asyncio.wait_for(again.task, 5)
+
+        self.assertEqual(conn.sent[0]["status"], 200)
+        self.assertEqual(again.sent[0]["status"], 401)
+
+    async def test_inactive_user_refused(self):
+        """test tokens of deactivated users don't open a stream"""
+        await sync_to_async(
+            get_user_model().objects.filter(pk=self.user.pk).update,
+        )(is_active=False)
+        conn = Connection(
+            headers=[(b"authorization", f"Token {self.token.key}".encode())],
+        )
+        conn.start()
+        await asyncio.wait_for(conn.task, 5)
+
+        self.assertEqual(conn.sent[0]["status"], 401)
+
+    @patch("core.sse.HEARTBEAT", 0.05)
+    async def test_stream_ends_when_token_deleted(self):
+        """test a stream opened with a token closes once it's deleted"""
+        conn = Connection(
+            headers=[(b"authorization", f"Token {self.token.key}".encode())],
+        )
+        conn.start()
+        await conn.wait_for_body(b": ping")
+
+        await sync_to_async(self.token.delete)()
+        await asyncio.wait_for(conn.task, 5)
+
+        self.assertFalse(conn.sent[-1].get("more_body"))
+        self.assertEqual(events.get_hub().streams, {})
+
+    @patch("core.sse.HEARTBEAT", 0.05)
+    async def test_ticket_stream_ends_when_user_deactivated(self):
+        """test a stream opened with a ticket closes for inactive users"""
+        ticket = await sync_to_async(sse.issue_ticket)(
+            self.user.pk,
+            self.token.key,
+        )
+        conn = Connection(f"ticket={ticket}".encode())
+        conn.start()
+        await conn.wait_for_body(b": ping")
+
+        await sync_to_async(
+            get_user_model().objects.filter(pk=self.user.pk).update,
+        )(is_active=False)
+        await asyncio.wait_for(conn.task, 5)
+
+        self.assertFalse(conn.sent[-1].get("more_body"))
+
+
+class EventsTicketApiTests(TestCase):
+    """Test exchanging the token for a stream ticket"""
+
+    def test_auth_required(self):
+        """test tickets are only handed to authenticated users"""
+        res = APIClient().post(TICKET_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(EVENTS_TICKET_TTL=10)
+    def test_ticket_issued(self):
+        """test the ticket names the user for a limited time"""
+        user = create_user()
+        client = APIClient()
+        client.force_authenticate(user, Token.objects.create(user=user))
+
+        first = client.post(TICKET_URL)
+        second = client.post(TICKET_URL)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data["expires_in"], 10)
+        self.assertTrue(first.data["ticket"])
+        self.assertNotEqual(first.data["ticket"], second.data["ticket"])
+
+    def test_ticket_redeemed_by_other_process(self):
+        """test a ticket is found through another cache client, once"""
+        user = create_user()
+        token = Token.objects.create(user=user)
+        client = APIClient()
+        client.force_authenticate(user, token)
+        ticket = client.post(TICKET_URL).data["ticket"]
+
+        # the events server talks to the shared cache through a client of
+        # its own
+        other = caches.create_connection("default")
+        with patch("core.sse.caches", {"default": other}):
+            redeemed = async_to_sync(sse._redeem_ticket)(ticket)
+            again = async_to_sync(sse._redeem_ticket)(ticket)
+
+        self.assertEqual(redeemed, (user.pk, token.key))
+        self.assertIsNone(again)
+
+
+@skipUnless(connection.vendor == "postgresql", "needs PostgreSQL")
+class PostgresBrokerTests(TransactionTestCase):
+    """Test messages travel through NOTIFY and LISTEN"""
+
+    async def test_notification_delivered(self):
+        """test a published message reaches a listener"""
+        broker = events.PostgresBroker()
+        received = asyncio.Queue()
+        stop = broker.listen(received.put_nowait, lambda: None)
+
+        await sync_to_async(broker.publish)("hello")
+
+        self.assertEqual(await asyncio.wait_for(received.get(), 5), "hello")
+        stop()
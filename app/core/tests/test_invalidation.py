@@ -0,0 +1,174 @@
+"""
+Tests for the invalidation bus of per-process caches
+"""
+
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import deletion
+from core.authentication import CachedTokenAuthentication, tokens
+from core.invalidation import LocalCache, bus
+
+
+ME_URL = reverse("user:me")
+
+
+def message(model, user_id, pk, sequence, source):
+    return json.dumps([model, user_id, pk, sequence, source])
+
+
+class LocalCacheTests(TestCase):
+    """Test entries are evicted by the messages about them"""
+
+    def setUp(self):
+        self.cache = LocalCache("core.tag", watches=["core.user"])
+        self.addCleanup(bus.caches.remove, self.cache)
+
+    def fill(self):
+        self.cache.set(1, "tag 1", 10, self.cache.version)
+        self.cache.set(2, "tag 2", 10, self.cache.version)
+        self.cache.set(3, "tag 3", 20, self.cache.version)
+
+    def test_evicted_by_key(self):
+        """test a change to a row evicts just its entry, right away"""
+        self.fill()
+
+        bus.publish("core.tag", 10, 1)
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "tag 2")
+
+    def test_evicted_by_user(self):
+        """test a change to a watched model evicts the user's entries"""
+        self.fill()
+
+        bus.publish("core.user", 10, 10)
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(3), "tag 3")
+
+    def test_load_racing_eviction_not_stored(self):
+        """test a value read before an eviction isn't cached after it"""
+        version = self.cache.version
+        bus.publish("core.tag", 10, 1)
+
+        self.cache.set(1, "stale", 10, version)
+
+        self.assertIsNone(self.cache.get(1))
+
+    def test_messages_from_other_processes(self):
+        """test received messages evict, duplicates included"""
+        self.fill()
+
+        bus.receive(message("core.tag", 10, 1, 1, self.id()))
+        self.cache.set(1, "tag 1", 10, self.cache.version)
+        bus.receive(message("core.tag", 10, 1, 1, self.id()))
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "tag 2")
+
+    def test_missed_message_clears(self):
+        """test a gap in a sender's sequence clears the whole cache"""
+        self.fill()
+        bus.receive(message("core.tag", 10, 1, 1, self.id()))
+
+        with self.assertLogs("core.invalidation", "WARNING"):
+            bus.receive(message("core.tag", 10, 2, 3, self.id()))
+
+        self.assertIsNone(self.cache.get(3))
+
+    def test_lost_listener_disables(self):
+        """test nothing is cached while messages can't be received"""
+        self.fill()
+        bus.ensure_listening()
+
+        bus.lost()
+        self.cache.set(1, "tag 1", 10, self.cache.version)
+
+        self.assertIsNone(self.cache.get(1))
+        bus.connected()
+        self.assertIsNone(self.cache.get(3))
+
+    def test_entries_expire(self):
+        """test entries aren't served past max_age"""
+        self.cache.max_age = 0
+        self.fill()
+
+        self.assertIsNone(self.cache.get(1))
+
+    def test_size_bounded(self):
+        """test the least recently used entries are dropped first"""
+        self.cache.max_size = 2
+        self.fill()
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(3), "tag 3")
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test token logins are cached until the token or user changes"""
+
+    def setUp(self):
+        tokens.clear()
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_no_query_once_cached(self):
+        """test a repeated token is authenticated without the database"""
+        self.client.get(ME_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["email"], self.user.email)
+
+    def test_fresh_instances_per_request(self):
+        """test requests don't share the cached user instance"""
+        auth = CachedTokenAuthentication()
+        first, token = auth.authenticate_credentials(self.token.key)
+        second, token = auth.authenticate_credentials(self.token.key)
+
+        self.assertIsNot(first, second)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(token.user, second)
+
+    def test_deleted_token_evicted(self):
+        """test a deleted token stops working straight away"""
+        self.client.get(ME_URL)
+
+        self.token.delete()
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_evicted(self):
+        """test a deactivated user's cached login stops working"""
+        self.client.get(ME_URL)
+
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_account_deletion_evicts(self):
+        """test requesting account deletion logs the user out everywhere"""
+        self.client.get(ME_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deletion.request_account_deletion(self.user)
+
+        self.assertIsNone(tokens.get(self.token.key))
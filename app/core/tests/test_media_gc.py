@@ -0,0 +1,220 @@
+"""
+Tests for collecting orphaned media files
+"""
+
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.management.commands import collect_orphaned_images
+from core.models import ImageBlob, ImageUpload, Recipe, UserShard
+from core.sharding import shard_for_user
+from recipe import uploads
+
+
+class CollectOrphanedImagesTests(TestCase):
+    """Test the collect_orphaned_images command"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.upload_root = tempfile.mkdtemp()
+        self.checkpoint = f"{self.media_root}.checkpoint"
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            MEDIA_GC_CHECKPOINT=self.checkpoint,
+            UPLOAD_TEMP_ROOT=self.upload_root,
+        )
+        self.settings_override.enable()
+
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.shard = shard_for_user(self.user)
+        self.recipe = Recipe.objects.using(self.shard).create(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        self.recipe.image.save("image.jpg", ContentFile(b"referenced"))
+        self.orphans = [
+            self.create_file("uploads/recipe/a.jpg"),
+            self.create_file("uploads/recipe/b.jpg"),
+        ]
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        shutil.rmtree(self.upload_root)
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def create_file(self, name, age=7200):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"orphan")
+        mtime = os.path.getmtime(path) - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def call(self, *args):
+        out = StringIO()
+        call_command("collect_orphaned_images", *args, stdout=out)
+        return out.getvalue()
+
+    def test_list_only_by_default(self):
+        """test orphans are only listed without --delete"""
+        out = self.call()
+
+        self.assertIn("found 2 orphan(s)", out)
+        for path in self.orphans:
+            self.assertTrue(os.path.exists(path))
+
+    def test_delete_orphans(self):
+        """test orphans are deleted and referenced images kept"""
+        recent = self.create_file("uploads/recipe/recent.jpg", age=0)
+
+        self.call("--delete")
+
+        for path in self.orphans:
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+
+    def test_file_picked_up_during_walk_kept(self):
+        """test a file a recipe took after the names were read is kept"""
+        name = "uploads/recipe/a.jpg"
+        Recipe.objects.using(self.shard).filter(pk=self.recipe.pk).update(
+            image=name,
+        )
+        ImageBlob.objects.create(name="uploads/recipe/b.jpg", ref_count=0)
+
+        with patch.object(
+            collect_orphaned_images.Command,
+            "_referenced_names",
+            return_value=set(),
+        ), patch.object(
+            ImageBlob.objects,
+            "lock",
+            wraps=ImageBlob.objects.lock,
+        ) as lock:
+            out = self.call("--delete")
+
+        self.assertTrue(os.path.exists(self.orphans[0]))
+        self.assertFalse(os.path.exists(self.orphans[1]))
+        self.assertIn("found 1 orphan(s)", out)
+        lock.assert_any_call([name])
+        self.assertFalse(
+            ImageBlob.objects.filter(name="uploads/recipe/b.jpg").exists(),
+        )
+
+    def test_quarantine_orphans(self):
+        """test orphans can be moved aside instead of deleted"""
+        quarantine = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, quarantine)
+
+        self.call("--quarantine", quarantine)
+
+        self.assertFalse(os.path.exists(self.orphans[0]))
+        self.assertTrue(
+            os.path.exists(os.path.join(quarantine, "uploads/recipe/a.jpg")),
+        )
+
+    def test_resume_from_checkpoint(self):
+        """test a limited run resumes where it stopped"""
+        self.call("--delete", "--limit", "1")
+
+        self.assertFalse(os.path.exists(self.orphans[0]))
+        self.assertTrue(os.path.exists(self.orphans[1]))
+        self.assertTrue(os.path.exists(self.checkpoint))
+
+        out = self.call("--delete")
+
+        self.assertFalse(os.path.exists(self.orphans[1]))
+        self.assertIn("Examined 2 file(s)", out)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def create_upload(self, age):
+        upload = ImageUpload.objects.using(self.shard).create(
+            user=self.user,
+            recipe=self.recipe,
+            size=10,
+        )
+        ImageUpload.objects.using(upload._state.db).filter(
+            pk=upload.pk,
+        ).update(created_at=timezone.now() - timedelta(seconds=age))
+        uploads.create_part_file(upload)
+        return upload
+
+    def test_expire_uploads(self):
+        """test expired uploads and their parts go with --delete"""
+        expired = self.create_upload(age=2 * 24 * 3600)
+        current = self.create_upload(age=0)
+
+        out = self.call()
+        self.assertIn("Found 1 expired upload(s) of 10 bytes", out)
+        self.assertTrue(os.path.exists(uploads.part_path(expired)))
+
+        self.call("--delete")
+
+        sessions = ImageUpload.objects.using(expired._state.db)
+        self.assertEqual(list(sessions.all()), [current])
+        self.assertFalse(os.path.exists(uploads.part_path(expired)))
+        self.assertTrue(os.path.exists(uploads.part_path(current)))
+
+    def test_stray_parts_removed(self):
+        """test old part files no upload refers to are removed"""
+        stray = os.path.join(self.upload_root, "12345.part")
+        with open(stray, "wb") as f:
+            f.write(b"stray")
+        mtime = os.path.getmtime(stray) - 2 * 24 * 3600
+        os.utime(stray, (mtime, mtime))
+
+        out = self.call("--delete")
+
+        self.assertIn("removed 5 bytes of stray parts", out)
+        self.assertFalse(os.path.exists(stray))
+
+    def test_report_per_user_usage(self):
+        """test the report sums image bytes per user across shards"""
+        other = get_user_model().objects.create_user(
+            "other@example.com",
+            "testpass123",
+        )
+        # on another shard than the first user where there is one
+        alias = next(
+            (a for a in settings.DB_SHARDS if a != self.shard),
+            self.shard,
+        )
+        UserShard.objects.update_or_create(
+            user=other,
+            defaults={"alias": alias},
+        )
+        recipe = Recipe.objects.using(alias).create(
+            user=other,
+            title="Other recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        recipe.image.save("image.jpg", ContentFile(b"referenced twice"))
+
+        out = self.call("--report")
+
+        self.assertIn("user@example.com: 10 bytes", out)
+        self.assertIn("other@example.com: 16 bytes", out)
+        self.assertLess(out.index("other@"), out.index("user@"))
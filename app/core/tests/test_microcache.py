@@ -0,0 +1,292 @@
+"""
+Tests for the nginx micro-cache of reads
+"""
+
+import http.client
+import json
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import microcache
+from core.models import Recipe
+from core.sharding import shard_for_user
+
+
+RECIPES_URL = reverse("recipe:recipe-list")
+TAGS_URL = reverse("recipe:tag-list")
+PROXY_DIR = Path(settings.BASE_DIR).parent / "proxy"
+NGINX = shutil.which("nginx")
+JS_MODULE = next(
+    (
+        path
+        for path in [
+            "/usr/lib/nginx/modules/ngx_http_js_module.so",
+            "/usr/lib64/nginx/modules/ngx_http_js_module.so",
+            "/usr/share/nginx/modules/ngx_http_js_module.so",
+            "/etc/nginx/modules/ngx_http_js_module.so",
+        ]
+        if os.path.exists(path)
+    ),
+    None,
+)
+
+
+@override_settings(MICROCACHE_TTL=5)
+class MicrocacheHeadersTests(TestCase):
+    """Test the app tells nginx what to cache and what to purge"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.using(shard_for_user(self.user)).create(
+            user=self.user,
+            title="Pie",
+            time_minutes=30,
+            price=Decimal("4.50"),
+        )
+        self.tag = microcache.user_tag(self.user.pk)
+
+    def test_reads_tagged_with_user(self):
+        """test recipe reads are cacheable for their user"""
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res["X-Accel-Expires"], "5")
+        self.assertEqual(res[microcache.TAG_HEADER], self.tag)
+        self.assertNotIn(microcache.PURGE_HEADER, res)
+
+    def test_off_without_ttl(self):
+        """test nothing is cached unless the cache is turned on"""
+        with self.settings(MICROCACHE_TTL=0):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertNotIn("X-Accel-Expires", res)
+        self.assertNotIn(microcache.TAG_HEADER, res)
+
+    def test_errors_not_cached(self):
+        """test failed reads aren't cacheable"""
+        res = self.client.get(reverse("recipe:recipe-detail", args=[0]))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn("X-Accel-Expires", res)
+
+    def test_writes_purge_user(self):
+        """test recipe, tag and batch writes purge the user's entries"""
+        responses = [
+            self.client.patch(
+                reverse("recipe:recipe-detail", args=[self.recipe.id]),
+                {"title": "Tart"},
+            ),
+            self.client.delete(TAGS_URL + "0/"),
+            self.client.post(
+                reverse("batch"),
+                {
+                    "operations": [
+                        {
+                            "method": "POST",
+                            "path": RECIPES_URL,
+                            "body": {
+                                "title": "Cake",
+                                "time_minutes": 40,
+                                "price": "6.00",
+                            },
+                        },
+                    ],
+                },
+                format="json",
+            ),
+        ]
+
+        self.assertEqual(responses[0][microcache.PURGE_HEADER], self.tag)
+        self.assertNotIn(microcache.PURGE_HEADER, responses[1])
+        self.assertEqual(responses[2][microcache.PURGE_HEADER], self.tag)
+        self.assertNotIn("X-Accel-Expires", responses[0])
+
+
+class UpstreamHandler(socketserver.StreamRequestHandler):
+    """answer uwsgi requests like the app does its recipe reads"""
+
+    def handle(self):
+        modifier1, size, modifier2 = struct.unpack("<BHB", self.rfile.read(4))
+        data = self.rfile.read(size)
+        env = {}
+        while data:
+            values = []
+            for _ in range(2):
+                (length,) = struct.unpack("<H", data[:2])
+                values.append(data[2:2 + length].decode())
+                data = data[2 + length:]
+            env[values[0]] = values[1]
+        self.rfile.read(int(env.get("CONTENT_LENGTH") or 0))
+
+        user_id = self.server.tokens.get(env.get("HTTP_AUTHORIZATION"))
+        self.server.hits.append((env["REQUEST_METHOD"], user_id))
+        if env["REQUEST_METHOD"] == "GET":
+            headers = {
+                "X-Accel-Expires": "60",
+                microcache.TAG_HEADER: microcache.user_tag(user_id),
+            }
+        else:
+            headers = {microcache.PURGE_HEADER: microcache.user_tag(user_id)}
+        body = json.dumps({"user": user_id}).encode()
+        headers.update(
+            {
+                "Content-Type": "application/json",
+                "Content-Length": str(len(body)),
+            }
+        )
+        self.wfile.write(b"HTTP/1.1 200 OK\r\n")
+        for name, value in headers.items():
+            self.wfile.write(f"{name}: {value}\r\n".encode())
+        self.wfile.write(b"\r\n" + body)
+
+
+class Upstream(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, tokens):
+        super().__init__(("127.0.0.1", 0), UpstreamHandler)
+        self.tokens = tokens
+        self.hits = []
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@unittest.skipUnless(
+    NGINX and JS_MODULE and PROXY_DIR.is_dir(),
+    "needs nginx with the njs module and the proxy config",
+)
+class NginxMicrocacheTests(SimpleTestCase):
+    """Test the proxy config caches and purges against a local nginx"""
+
+    def setUp(self):
+        self.upstream = Upstream(
+            {"Token a1": 1, "Token a2": 1, "Token b": 2},
+        )
+        threading.Thread(target=self.upstream.serve_forever).start()
+        self.addCleanup(self.upstream.server_close)
+        self.addCleanup(self.upstream.shutdown)
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        os.chmod(tmp, 0o755)
+        for name in ["uwsgi_params", "microcache.js"]:
+            shutil.copy(PROXY_DIR / name, tmp)
+        self.port = free_port()
+        conf = (PROXY_DIR / "default.conf.tpl").read_text()
+        for name, value in {
+            "LISTEN_PORT": self.port,
+            "APP_HOST": "127.0.0.1",
+            "APP_PORT": self.upstream.server_address[1],
+            "EVENTS_HOST": "127.0.0.1",
+            "EVENTS_PORT": free_port(),
+        }.items():
+            conf = conf.replace("${%s}" % name, str(value))
+        conf = conf.replace("/tmp/microcache", f"{tmp}/microcache")
+        conf = conf.replace("/etc/nginx", tmp)
+        Path(tmp, "default.conf").write_text(conf)
+        Path(tmp, "nginx.conf").write_text(
+            f"load_module {JS_MODULE};\n"
+            + ("user root;\n" if os.geteuid() == 0 else "")
+            + f"pid {tmp}/nginx.pid;\n"
+            "daemon off;\n"
+            "events {}\n"
+            "http {\n"
+            "    access_log off;\n"
+            f"    client_body_temp_path {tmp}/body;\n"
+            f"    uwsgi_temp_path {tmp}/uwsgi;\n"
+            f"    proxy_temp_path {tmp}/proxy;\n"
+            f"    fastcgi_temp_path {tmp}/fastcgi;\n"
+            f"    scgi_temp_path {tmp}/scgi;\n"
+            f"    include {tmp}/default.conf;\n"
+            "}\n"
+        )
+
+        nginx = subprocess.Popen(
+            [
+                NGINX,
+                "-p", tmp,
+                "-e", f"{tmp}/error.log",
+                "-c", f"{tmp}/nginx.conf",
+            ],
+            stderr=subprocess.DEVNULL,
+        )
+        self.addCleanup(nginx.wait)
+        self.addCleanup(nginx.terminate)
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port)).close()
+                break
+            except OSError:
+                if nginx.poll() is not None or time.monotonic() > deadline:
+                    self.fail(Path(tmp, "error.log").read_text())
+                time.sleep(0.05)
+
+    def request(self, method, path, token):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port)
+        conn.request(method, path, headers={"Authorization": token})
+        res = conn.getresponse()
+        res.read()
+        conn.close()
+        return res
+
+    def reads(self):
+        return [hit for hit in self.upstream.hits if hit[0] == "GET"]
+
+    def test_repeated_read_cached(self):
+        """test a repeated read is answered by nginx"""
+        self.request("GET", RECIPES_URL, "Token a1")
+        res = self.request("GET", RECIPES_URL, "Token a1")
+
+        self.assertEqual(res.getheader("X-Cache-Status"), "HIT")
+        self.assertIsNone(res.getheader(microcache.TAG_HEADER))
+        self.assertEqual(len(self.reads()), 1)
+
+    def test_tokens_not_shared(self):
+        """test responses are only served again to the same token"""
+        self.request("GET", RECIPES_URL, "Token a1")
+        self.request("GET", RECIPES_URL, "Token b")
+
+        self.assertEqual(self.reads(), [("GET", 1), ("GET", 2)])
+
+    def test_write_purges_user(self):
+        """test a write purges the user's entries under all tokens"""
+        for token in ["Token a1", "Token a2", "Token b"]:
+            self.request("GET", RECIPES_URL, token)
+
+        res = self.request("POST", TAGS_URL + "merge/", "Token a2")
+        self.assertIsNone(res.getheader(microcache.PURGE_HEADER))
+        for token in ["Token a1", "Token a2", "Token b"]:
+            self.request("GET", RECIPES_URL, token)
+
+        self.assertEqual(
+            self.reads()[3:],
+            [("GET", 1), ("GET", 1)],
+        )
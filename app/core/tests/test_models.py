@@ -17,6 +17,8 @@ def create_user(email="user@example.com", password="testpass123"):
 
 
 class ModelTests(TestCase):
+    databases = "__all__"
+
     def test_create_user_with_email_successful(self):
         email = "test@example.com"
         password = "test@123"
@@ -73,6 +75,27 @@ class ModelTests(TestCase):
         )
         self.assertEqual(str(recipe), recipe.title)
 
+    def test_recipe_price_stored_as_cents(self):
+        """test prices read back as decimals and compare as cents"""
+        user = create_user()
+        recipe = models.Recipe.objects.create(
+            user=user,
+            title="Sample recipe name",
+            time_minutes=5,
+            price=Decimal("19.99"),
+        )
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.price, Decimal("19.99"))
+        self.assertEqual(
+            models.Recipe.objects.filter(user=user, price__lt="20").count(),
+            1,
+        )
+        self.assertEqual(
+            models.Recipe._meta.get_field("price").get_prep_value("19.99"),
+            1999,
+        )
+
     def test_create_tag(self):
         """test creating a tag is successful"""
 
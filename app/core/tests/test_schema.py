@@ -0,0 +1,126 @@
+"""
+Tests for the precomputed OpenAPI schema
+"""
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from core import schema
+
+SCHEMA_URL = reverse("api-schema")
+
+
+class SchemaViewTests(SimpleTestCase):
+    """Test serving the cached schema"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            SCHEMA_CACHE_DIR=self.cache_dir,
+            APP_VERSION="test",
+        )
+        self.settings_override.enable()
+        schema.clear()
+
+    def tearDown(self):
+        schema.clear()
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_schema_cached_per_version(self):
+        """test the schema is written once for the code version"""
+        res = self.client.get(SCHEMA_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "application/vnd.oai.openapi")
+        path = schema.cache_path("yaml")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), res.content)
+
+        with open(path, "wb") as f:
+            f.write(b"openapi: cached\n")
+        schema.clear()
+        res = self.client.get(SCHEMA_URL)
+
+        self.assertEqual(res.content, b"openapi: cached\n")
+
+    def test_schema_json(self):
+        """test JSON is served when asked for"""
+        res = self.client.get(SCHEMA_URL, {"format": "json"})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("/api/recipe/recipes/", json.loads(res.content)["paths"])
+
+    def test_schema_not_modified(self):
+        """test a matching ETag is answered with a 304"""
+        etag = self.client.get(SCHEMA_URL)["ETag"]
+
+        res = self.client.get(SCHEMA_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res.content, b"")
+
+    def test_schema_gzipped(self):
+        """test the schema is sent compressed to clients accepting gzip"""
+        plain = self.client.get(SCHEMA_URL)
+
+        res = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(res["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(res.content), plain.content)
+        self.assertNotEqual(res["ETag"], plain["ETag"])
+
+
+class BuildSchemaCommandTests(SimpleTestCase):
+    """Test the build_schema command"""
+
+    def call(self, *args):
+        out = StringIO()
+        call_command("build_schema", *args, stdout=out)
+        return out.getvalue()
+
+    def test_committed_schema_up_to_date(self):
+        """test the committed schema matches the code"""
+        out = self.call("--check")
+
+        self.assertIn("Schema is up to date", out)
+
+    def test_check_fails_on_drift(self):
+        """test --check fails when the committed schema differs"""
+        fd, path = tempfile.mkstemp(suffix=".yml")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        with self.assertRaises(CommandError):
+            self.call("--check", "--file", path)
+
+        self.call("--update", "--file", path)
+        self.call("--check", "--file", path)
+
+    def test_build_writes_cache(self):
+        """test building writes each format and its gzipped form"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        with override_settings(SCHEMA_CACHE_DIR=cache_dir):
+            self.call("--app-version", "abc123")
+
+        self.assertEqual(
+            sorted(os.listdir(cache_dir)),
+            [
+                "schema-abc123.json",
+                "schema-abc123.json.gz",
+                "schema-abc123.yaml",
+                "schema-abc123.yaml.gz",
+            ],
+        )
@@ -0,0 +1,378 @@
+"""
+Tests for sharding recipe data by user
+"""
+
+from decimal import Decimal
+from unittest import skipIf, skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import deletion, sharding
+from core.models import (
+    ImageUpload,
+    Ingredient,
+    IngredientPosting,
+    Recipe,
+    RecipeSignature,
+    Tag,
+    UserShard,
+)
+from recipe import pantry
+
+RECIPES_URL = reverse("recipe:recipe-list")
+
+
+def create_user(email="user@example.com", password="testpass123"):
+    """create and return a new user"""
+    return get_user_model().objects.create_user(email, password)
+
+
+class PlacementTests(SimpleTestCase):
+    """Test placing users on shards"""
+
+    @override_settings(DB_SHARDS=["one", "two", "three"])
+    def test_placement_by_user_id(self):
+        """test users are spread over shards by id"""
+        self.assertEqual(sharding.placement_for_user_id(3), "one")
+        self.assertEqual(sharding.placement_for_user_id(4), "two")
+        self.assertEqual(sharding.placement_for_user_id(8), "three")
+
+
+class ShardRoutingTests(TestCase):
+    """Test routing recipe data to the user's shard"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def test_user_assigned_shard(self):
+        """test a new user gets a shard assigned on first use"""
+        alias = sharding.shard_for_user(self.user)
+
+        self.assertEqual(alias, sharding.placement_for_user_id(self.user.pk))
+        self.assertTrue(
+            UserShard.objects.filter(user=self.user, alias=alias).exists()
+        )
+
+    def test_create_recipe_on_user_shard(self):
+        """test recipes and tags created by the api land on the shard"""
+        payload = {
+            "title": "Thai prawn curry",
+            "time_minutes": 30,
+            "price": Decimal("2.50"),
+            "tags": [{"name": "Thai"}],
+        }
+        res = self.client.post(RECIPES_URL, payload, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        alias = sharding.shard_for_user(self.user)
+        recipe = Recipe.objects.using(alias).get(id=res.data["id"])
+        self.assertEqual(recipe.tags.get().name, "Thai")
+
+    @skipIf(len(settings.DB_SHARDS) < 2, "needs at least two shards")
+    def test_manager_routes_by_user(self):
+        """test rows created or filtered by user go to the user's shard"""
+        users = [
+            create_user(email=f"user{i}@example.com")
+            for i in range(len(settings.DB_SHARDS))
+        ]
+        for user in users:
+            alias = sharding.shard_for_user(user)
+            recipe = Recipe.objects.create(
+                user=user,
+                title="Soup",
+                time_minutes=10,
+                price=Decimal("1.00"),
+            )
+            tag, created = Tag.objects.get_or_create(
+                user_id=user.pk,
+                name="Quick",
+            )
+
+            self.assertEqual(recipe._state.db, alias)
+            self.assertEqual(tag._state.db, alias)
+            self.assertEqual(
+                list(Recipe.objects.filter(user=user)),
+                [recipe],
+            )
+            self.assertEqual(
+                Tag.objects.get(user_id=user.pk, name="Quick"),
+                tag,
+            )
+        self.assertEqual(
+            {sharding.shard_for_user(user) for user in users},
+            set(settings.DB_SHARDS),
+        )
+
+    def test_writes_refused_while_moving(self):
+        """test writes get a 503 while the user's data is moved"""
+        user_shard = sharding.get_user_shard(self.user)
+        user_shard.is_moving = True
+        user_shard.save()
+
+        res = self.client.post(
+            RECIPES_URL,
+            {"title": "Pongal", "time_minutes": 5, "price": "1.00"},
+        )
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_write_refused_if_move_began_after_login(self):
+        """test the map entry is read again before writing"""
+        sharding.get_user_shard(self.user)
+        UserShard.objects.filter(user=self.user).update(is_moving=True)
+
+        res = self.client.post(
+            RECIPES_URL,
+            {"title": "Pongal", "time_minutes": 5, "price": "1.00"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_move_to_unknown_shard_error(self):
+        """test moving a user to an unknown shard fails"""
+        with self.assertRaises(CommandError):
+            call_command(
+                "move_user_shard",
+                user=self.user.email,
+                to="missing",
+            )
+
+    @skipIf(len(settings.DB_SHARDS) < 2, "needs at least two shards")
+    def test_move_user_between_shards(self):
+        """test moving a user copies the data and repoints the map"""
+        source = sharding.shard_for_user(self.user)
+        target = next(a for a in settings.DB_SHARDS if a != source)
+        recipe = Recipe.objects.using(source).create(
+            user=self.user,
+            title="Pongal",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        tag = Tag.objects.using(source).create(user=self.user, name="Indian")
+        recipe.tags.add(tag)
+
+        call_command("move_user_shard", user=str(self.user.pk), to=target)
+
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, target)
+        self.assertFalse(Recipe.objects.using(source).exists())
+        moved = Recipe.objects.using(target).get(user=self.user)
+        self.assertEqual(moved.title, recipe.title)
+        self.assertEqual([t.name for t in moved.tags.all()], [tag.name])
+
+        self.client.force_authenticate(
+            get_user_model().objects.get(pk=self.user.pk),
+        )
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual([r["id"] for r in res.data], [moved.id])
+
+    @skipIf(len(settings.DB_SHARDS) < 2, "needs at least two shards")
+    def test_move_user_onto_shard_with_data(self):
+        """test moved rows keep their ids next to the target's own rows"""
+        source = sharding.shard_for_user(self.user)
+        target = next(a for a in settings.DB_SHARDS if a != source)
+        recipe = Recipe.objects.using(source).create(
+            user=self.user,
+            title="Pongal",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        tag = Tag.objects.using(source).create(user=self.user, name="Indian")
+        ingredient = Ingredient.objects.using(source).create(
+            user=self.user,
+            name="Rice",
+        )
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+        upload = ImageUpload.objects.using(source).create(
+            user=self.user,
+            recipe=recipe,
+            size=10,
+        )
+        other = create_user("other@example.com")
+        UserShard.objects.update_or_create(
+            user=other,
+            defaults={"alias": target},
+        )
+        kept = Recipe.objects.using(target).create(
+            user=other,
+            title="Dosa",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        kept.tags.add(Tag.objects.using(target).create(
+            user=other,
+            name="South Indian",
+        ))
+
+        sharding.move_user(self.user, target)
+
+        moved = Recipe.objects.using(target).get(user=self.user)
+        self.assertEqual(moved.id, recipe.id)
+        self.assertEqual(list(moved.tags.all()), [tag])
+        self.assertEqual(list(moved.ingredients.all()), [ingredient])
+        self.assertEqual(
+            ImageUpload.objects.using(target).get(id=upload.id).recipe_id,
+            recipe.id,
+        )
+        self.assertTrue(
+            RecipeSignature.objects.using(target).filter(recipe=moved).exists()
+        )
+        self.assertTrue(moved.buckets.exists())
+        posting_ids, totals = pantry.unpack(
+            IngredientPosting.objects.using(target).get(ingredient=ingredient),
+        )
+        self.assertEqual(list(posting_ids), [recipe.id])
+        self.assertEqual(list(totals), [1])
+        self.assertFalse(Recipe.objects.using(source).exists())
+
+        kept.refresh_from_db()
+        self.assertEqual(kept.title, "Dosa")
+        self.assertEqual(
+            [t.name for t in kept.tags.all()],
+            ["South Indian"],
+        )
+
+    def create_pongal(self, alias):
+        return Recipe.objects.using(alias).create(
+            user=self.user,
+            title="Pongal",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+
+    @skipIf(len(settings.DB_SHARDS) < 2, "needs at least two shards")
+    def test_source_copy_cleaned_up_after_crash(self):
+        """test a copy left on the source is deleted before moving back"""
+        source = sharding.shard_for_user(self.user)
+        target = next(a for a in settings.DB_SHARDS if a != source)
+        recipe = self.create_pongal(source)
+
+        with patch.object(
+            sharding,
+            "_drop_copy",
+            side_effect=RuntimeError("crashed"),
+        ):
+            with self.assertRaises(RuntimeError):
+                sharding.move_user(self.user, target)
+
+        user_shard = UserShard.objects.get(user=self.user)
+        self.assertEqual(
+            (user_shard.alias, user_shard.cleanup_alias),
+            (target, source),
+        )
+        self.assertTrue(Recipe.objects.using(source).exists())
+
+        call_command("move_user_shard")
+
+        user_shard.refresh_from_db()
+        self.assertEqual(user_shard.cleanup_alias, "")
+        self.assertFalse(Recipe.objects.using(source).exists())
+
+        sharding.move_user(self.user, source)
+
+        self.assertEqual(
+            list(Recipe.objects.using(source).values_list("id", flat=True)),
+            [recipe.id],
+        )
+
+    @skipIf(len(settings.DB_SHARDS) < 2, "needs at least two shards")
+    def test_partial_copy_cleaned_up_before_retry(self):
+        """test a move that died before switching can be run again"""
+        source = sharding.shard_for_user(self.user)
+        target = next(a for a in settings.DB_SHARDS if a != source)
+        recipe = self.create_pongal(source)
+        # what a move killed while copying leaves behind
+        Recipe.objects.using(target).bulk_create([recipe])
+        UserShard.objects.filter(user=self.user).update(
+            is_moving=True,
+            cleanup_alias=target,
+        )
+
+        sharding.move_user(self.user, target)
+
+        user_shard = UserShard.objects.get(user=self.user)
+        self.assertEqual(user_shard.alias, target)
+        self.assertFalse(user_shard.is_moving)
+        self.assertEqual(user_shard.cleanup_alias, "")
+        self.assertEqual(
+            Recipe.objects.using(target).get(user=self.user).id,
+            recipe.id,
+        )
+        self.assertFalse(Recipe.objects.using(source).exists())
+
+    def test_ids_unique_across_shards(self):
+        """test rows on different shards never share an id"""
+        ids = [
+            Recipe.objects.using(alias).create(
+                user=self.user,
+                title="Pongal",
+                time_minutes=5,
+                price=Decimal("1.00"),
+            ).id
+            for alias in settings.DB_SHARDS
+            for _ in range(2)
+        ]
+
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_account_deletion_on_user_shard(self):
+        """test an account deletion job clears the user's shard"""
+        alias = sharding.shard_for_user(self.user)
+        recipe = Recipe.objects.using(alias).create(
+            user=self.user,
+            title="Pongal",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        recipe.tags.add(Tag.objects.using(alias).create(
+            user=self.user,
+            name="Indian",
+        ))
+        job = deletion.request_account_deletion(self.user)
+
+        deletion.run_account_deletion(deletion.claim_job())
+
+        job.refresh_from_db()
+        self.assertEqual(job.recipes_deleted, 1)
+        self.assertFalse(Recipe.objects.using(alias).exists())
+        self.assertFalse(Tag.objects.using(alias).exists())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "needs PostgreSQL")
+class MoveLockTests(TestCase):
+    """Test writers and moves of a user keep apart"""
+
+    def test_writer_refused_during_move(self):
+        """test writing fails fast while another session moves the user"""
+        other = connections.create_connection("default")
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_lock(%s, %s)",
+                [sharding.MOVE_LOCK_CLASS, 1],
+            )
+
+        with self.assertRaises(sharding.UserMoving):
+            with sharding.writing(1):
+                pass
+        with sharding.writing(2):
+            pass
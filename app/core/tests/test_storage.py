@@ -0,0 +1,315 @@
+"""
+Tests for content addressed image storage and static files storage
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack, contextmanager
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+import brotli
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.models import ImageBlob, Recipe
+from core.sharding import shard_for_user
+from core.storage import (
+    CompressedManifestStaticFilesStorage,
+    ContentAddressedStorage,
+)
+
+
+class StorageTestMixin:
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = ContentAddressedStorage()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    @contextmanager
+    def capturing(self):
+        """collect the on_commit callbacks of every test database"""
+        callbacks = []
+        with ExitStack() as stack:
+            captured = [
+                stack.enter_context(self.captureOnCommitCallbacks(using=alias))
+                for alias in sorted(self.databases)
+            ]
+            yield callbacks
+        for pending in captured:
+            callbacks.extend(pending)
+
+    @contextmanager
+    def committing(self):
+        """run on_commit callbacks on exit, and those they register"""
+        with self.capturing() as callbacks:
+            yield
+        while callbacks:
+            pending = callbacks
+            with self.capturing() as callbacks:
+                for callback in pending:
+                    callback()
+
+
+class ContentAddressedStorageTests(StorageTestMixin, SimpleTestCase):
+    """Test storing files by content hash"""
+
+    def test_name_from_content_hash(self):
+        """test files are named by the sha256 of their content"""
+        digest = hashlib.sha256(b"image data").hexdigest()
+
+        name = self.storage.save(
+            "uploads/recipe/photo.JPG",
+            ContentFile(b"image data"),
+        )
+
+        self.assertEqual(
+            name,
+            f"uploads/recipe/{digest[:2]}/{digest[2:4]}/{digest}.jpg",
+        )
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b"image data")
+
+    def test_identical_content_stored_once(self):
+        """test saving the same content twice keeps a single file"""
+        first = self.storage.save("uploads/recipe/a.jpg", ContentFile(b"x"))
+        second = self.storage.save("uploads/recipe/b.jpg", ContentFile(b"x"))
+
+        self.assertEqual(first, second)
+        directory = os.path.dirname(self.storage.path(first))
+        self.assertEqual(os.listdir(directory), [os.path.basename(first)])
+
+
+class ImageRefCountTests(StorageTestMixin, TestCase):
+    """Test reference counting images shared by recipes"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+
+    def create_recipe(self, content):
+        recipe = Recipe(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        with self.committing():
+            recipe.image.save("image.jpg", ContentFile(content))
+        return recipe
+
+    def test_shared_image_deleted_with_last_recipe(self):
+        """test a shared file is kept until no recipe uses it"""
+        r1 = self.create_recipe(b"same")
+        r2 = self.create_recipe(b"same")
+        name = r1.image.name
+
+        self.assertEqual(r2.image.name, name)
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 2)
+
+        with self.committing():
+            r1.delete()
+        self.assertTrue(self.storage.exists(name))
+
+        with self.committing():
+            r2.delete()
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_replaced_image_released(self):
+        """test replacing an image releases the old file"""
+        recipe = self.create_recipe(b"old")
+        old_name = recipe.image.name
+
+        with self.committing():
+            recipe.image.save("image.jpg", ContentFile(b"new"))
+
+        self.assertFalse(self.storage.exists(old_name))
+        self.assertEqual(
+            ImageBlob.objects.get(name=recipe.image.name).ref_count,
+            1,
+        )
+
+    def test_file_kept_if_retained_before_delete(self):
+        """test a reference taken before the file goes keeps it"""
+        recipe = self.create_recipe(b"raced")
+        name = recipe.image.name
+
+        with self.capturing() as callbacks:
+            recipe.delete()
+        with self.capturing() as deletes:
+            for callback in callbacks:
+                callback()
+        with patch.object(
+            ImageBlob.objects,
+            "lock",
+            wraps=ImageBlob.objects.lock,
+        ) as lock:
+            ImageBlob.objects.retain(name)
+            for callback in deletes:
+                callback()
+
+        self.assertEqual(lock.call_count, 2)
+        lock.assert_called_with([name])
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+    def test_reference_kept_on_rollback(self):
+        """test a rolled back delete leaves the reference counted"""
+        recipe = self.create_recipe(b"kept")
+        name = recipe.image.name
+
+        with self.committing():
+            try:
+                with transaction.atomic(using=shard_for_user(self.user)):
+                    recipe.delete()
+                    raise RuntimeError()
+            except RuntimeError:
+                pass
+
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_image_counted_on_commit(self):
+        """test a saved image is counted once the save commits"""
+        recipe = Recipe(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+
+        with self.capturing() as callbacks:
+            recipe.image.save("image.jpg", ContentFile(b"new"))
+            name = recipe.image.name
+            self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+    def test_rolled_back_save_not_counted(self):
+        """test a rolled back save takes no reference to its image"""
+        recipe = Recipe(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+
+        with self.committing():
+            try:
+                with transaction.atomic(using=shard_for_user(self.user)):
+                    recipe.image.save("image.jpg", ContentFile(b"lost"))
+                    raise RuntimeError()
+            except RuntimeError:
+                pass
+
+        self.assertFalse(
+            ImageBlob.objects.filter(name=recipe.image.name).exists(),
+        )
+
+
+class CompressedManifestStaticFilesStorageTests(SimpleTestCase):
+    """Test collected static files are hashed and precompressed"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            STATIC_ROOT=cls.static_root,
+            STATICFILES_STORAGE=(
+                "core.storage.CompressedManifestStaticFilesStorage"
+            ),
+        )
+        cls.settings_override.enable()
+        cls.collect()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.static_root)
+        super().tearDownClass()
+
+    @staticmethod
+    def collect():
+        call_command("collectstatic", interactive=False, stdout=StringIO())
+
+    def stored_path(self, name):
+        return staticfiles_storage.path(staticfiles_storage.stored_name(name))
+
+    def test_hashed_names_compressed(self):
+        """test hashed files get gzip and brotli siblings of their content"""
+        path = self.stored_path("admin/css/base.css")
+        with open(path, "rb") as f:
+            content = f.read()
+
+        with open(path + ".gz", "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), content)
+        with open(path + ".br", "rb") as f:
+            self.assertEqual(brotli.decompress(f.read()), content)
+
+    def test_only_text_compressed(self):
+        """test formats that are compressed already get no siblings"""
+        for name in [
+            "rest_framework/img/glyphicons-halflings.png",
+            "rest_framework/fonts/glyphicons-halflings-regular.woff",
+        ]:
+            path = self.stored_path(name)
+            self.assertFalse(os.path.exists(path + ".gz"))
+            self.assertFalse(os.path.exists(path + ".br"))
+
+    def test_small_saving_recorded(self):
+        """test siblings not worth writing aren't compressed on every run"""
+        name = "admin/js/actions.js"
+        path = self.stored_path(name)
+        for suffix in [".gz", ".br"]:
+            os.remove(path + suffix)
+        calls = []
+
+        def compress(data):
+            calls.append(len(data))
+            return data
+
+        encodings = [(".gz", compress), (".br", compress)]
+        with patch.object(
+            CompressedManifestStaticFilesStorage,
+            "encodings",
+            encodings,
+        ):
+            self.collect()
+            self.assertEqual(len(calls), 2)
+            self.collect()
+
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(os.path.exists(path + ".gz"))
+        stored = staticfiles_storage.stored_name(name)
+        self.assertIn(stored + ".br", staticfiles_storage.load_skipped())
+
+    def test_compressed_once(self):
+        """test another collectstatic leaves existing siblings alone"""
+        path = self.stored_path("admin/js/core.js")
+        os.utime(path + ".br", (1, 1))
+
+        self.collect()
+
+        self.assertEqual(os.path.getmtime(path + ".br"), 1)
@@ -0,0 +1,174 @@
+"""
+Tests for token bucket throttling
+"""
+
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import throttling
+
+RECIPES_URL = reverse("recipe:recipe-list")
+TOKEN_URL = reverse("user:token")
+
+
+def rates(**overrides):
+    """return REST_FRAMEWORK settings with throttling turned on"""
+    return {
+        **settings.REST_FRAMEWORK,
+        "DEFAULT_THROTTLE_RATES": {
+            "read": "1200/min",
+            "write": "300/min",
+            "upload": "60/min",
+            "login": "20/min",
+            **overrides,
+        },
+    }
+
+
+@override_settings(REST_FRAMEWORK=rates())
+class TokenBucketTests(SimpleTestCase):
+    """Test taking tokens from a bucket in the cache"""
+
+    def setUp(self):
+        self.cache = caches["default"]
+        self.cache.clear()
+        self.bucket = throttling.TokenBucket(*throttling.parse_rate("3/m"))
+
+    def test_parse_rate(self):
+        """test rates give the capacity and tokens per second"""
+        self.assertEqual(throttling.parse_rate("120/min"), (120, 2))
+        self.assertEqual(throttling.parse_rate("10/s"), (10, 10))
+
+    def test_burst_then_refill(self):
+        """test a full bucket allows a burst, then refills over time"""
+        for _ in range(3):
+            self.assertEqual(self.bucket.take(self.cache, "k", 100), 0)
+
+        self.assertAlmostEqual(self.bucket.take(self.cache, "k", 100), 20)
+        self.assertAlmostEqual(self.bucket.take(self.cache, "k", 110), 10)
+        self.assertEqual(self.bucket.take(self.cache, "k", 120), 0)
+        self.assertGreater(self.bucket.take(self.cache, "k", 120), 0)
+
+    def test_refill_capped_at_capacity(self):
+        """test an idle bucket holds no more than its capacity"""
+        self.bucket.take(self.cache, "k", 0)
+
+        for _ in range(3):
+            self.assertEqual(self.bucket.take(self.cache, "k", 1000), 0)
+        self.assertGreater(self.bucket.take(self.cache, "k", 1000), 0)
+
+    def test_claimed_version_not_overwritten(self):
+        """test a writer that lost the claim doesn't clobber the bucket"""
+        self.bucket.take(self.cache, "k", 100)
+        version, tokens, updated = self.cache.get("k")
+        # another client claimed this version and is about to write
+        self.cache.add(f"k:{version}", 1)
+
+        wait = self.bucket.take(self.cache, "k", 100)
+
+        self.assertGreater(wait, 0)
+        self.assertEqual(self.cache.get("k"), (version, tokens, updated))
+
+    def test_rejection_counters(self):
+        """test rejections are counted per scope and can be reset"""
+        throttling.count_rejection(self.cache, "write")
+        throttling.count_rejection(self.cache, "write")
+
+        counts = throttling.rejection_counts(self.cache)
+
+        self.assertEqual(counts["write"], 2)
+        self.assertEqual(counts["read"], 0)
+        throttling.reset_rejection_counts(self.cache)
+        self.assertEqual(throttling.rejection_counts(self.cache)["write"], 0)
+
+
+class ThrottleApiTests(TestCase):
+    """Test requests are limited per user and scope"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        caches["default"].clear()
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, client=None):
+        return (client or self.client).post(
+            RECIPES_URL,
+            {"title": "Soup", "time_minutes": 5, "price": "1.00"},
+        )
+
+    @override_settings(REST_FRAMEWORK=rates(write="2/min"))
+    def test_writes_limited_with_retry_after(self):
+        """test writes past the bucket are refused with Retry-After"""
+        for _ in range(2):
+            res = self.create_recipe()
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = self.create_recipe()
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res["Retry-After"], "30")
+        self.assertEqual(throttling.rejection_counts()["write"], 1)
+        # reads draw from a bucket of their own
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(REST_FRAMEWORK=rates(write="1/min"))
+    def test_users_have_separate_buckets(self):
+        """test one user running out leaves others alone"""
+        other = APIClient()
+        other.force_authenticate(
+            get_user_model().objects.create_user(
+                "other@example.com",
+                "testpass123",
+            )
+        )
+        self.create_recipe()
+
+        self.assertEqual(
+            self.create_recipe().status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS,
+        )
+        self.assertEqual(
+            self.create_recipe(other).status_code,
+            status.HTTP_201_CREATED,
+        )
+
+    @override_settings(REST_FRAMEWORK=rates(login="2/min"))
+    def test_login_limited_by_address(self):
+        """test token requests are limited per client address"""
+        client = APIClient()
+        payload = {"email": "user@example.com", "password": "wrong"}
+        for _ in range(2):
+            res = client.post(TOKEN_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        res = client.post(TOKEN_URL, payload, REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(REST_FRAMEWORK=rates())
+    def test_throttle_stats_command(self):
+        """test the command prints the rejected counters"""
+        throttling.count_rejection(caches["default"], "upload")
+        out = StringIO()
+
+        call_command("throttle_stats", "--reset", stdout=out)
+
+        self.assertIn("upload: 1 rejected", out.getvalue())
+        self.assertEqual(throttling.rejection_counts()["upload"], 0)
@@ -0,0 +1,109 @@
+"""
+Tests for warming up workers and profiling startup
+"""
+
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+from core import schema, warmup
+from core.management.commands import profile_startup
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |     encodings.aliases
+import time:       200 |        300 |   encodings
+import time:        50 |         50 |   zipimport
+import time:       400 |        750 | app.wsgi
+"""
+
+
+class WarmUpTests(SimpleTestCase):
+    """Test warming up the application before forking"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            SCHEMA_CACHE_DIR=self.cache_dir,
+        )
+        self.settings_override.enable()
+        schema.clear()
+
+    def tearDown(self):
+        schema.clear()
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir)
+
+    def test_warm_up(self):
+        """test serializers are built and the schema is loaded"""
+        self.assertGreater(warmup.warm_up_serializers(), 0)
+        self.assertGreater(warmup.warm_up_urls(), 0)
+
+        warmup.warm_up(freeze=False)
+
+        self.assertTrue(os.listdir(self.cache_dir))
+        self.assertEqual(len(schema._cache), len(schema.RENDERERS))
+
+    def test_connections_closed(self):
+        """test no database or cache connection is left to the workers"""
+        with patch.object(warmup, "connections") as connections, patch.object(
+            warmup,
+            "close_caches",
+        ) as close_caches:
+            warmup.warm_up(freeze=False)
+
+        connections.close_all.assert_called_once_with()
+        close_caches.assert_called_once_with()
+
+
+class ProfileStartupTests(SimpleTestCase):
+    """Test the profile_startup command"""
+
+    def test_parse_import_tree(self):
+        """test importtime output is nested by indentation"""
+        rows = profile_startup.parse_importtime(IMPORTTIME.splitlines())
+        tree = profile_startup.build_tree(rows)
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(
+            tree,
+            [
+                ("app.wsgi", 750, [
+                    ("encodings", 300, [("encodings.aliases", 100, [])]),
+                    ("zipimport", 50, []),
+                ]),
+            ],
+        )
+
+    def test_worker_memory(self):
+        """test the memory of the master and its workers is read"""
+        fd, pidfile = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        self.addCleanup(os.remove, pidfile)
+
+        out = StringIO()
+        cmd = profile_startup.Command(stdout=out)
+        cmd.profile_workers({"pidfile": pidfile})
+
+        self.assertIn("master", out.getvalue())
+        self.assertGreater(profile_startup.read_memory(os.getpid())["Rss"], 0)
+
+    def test_no_uwsgi(self):
+        """test worker memory is skipped when uWSGI isn't running"""
+        out = StringIO()
+
+        call_command(
+            "profile_startup",
+            "--module", "app.settings",
+            "--pidfile", "/nonexistent.pid",
+            stdout=out,
+        )
+
+        self.assertIn("Importing app.settings took", out.getvalue())
+        self.assertIn("uWSGI is not running", out.getvalue())
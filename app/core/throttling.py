@@ -0,0 +1,132 @@
+"""
+Token bucket throttling kept in the shared cache
+
+A bucket is stored as (version, tokens, updated) under one key. Cache
+backends offer no compare-and-set, so a writer first claims the version it
+read with cache.add, which succeeds for exactly one client; the others
+re-read and try again. That only needs add, get and set, which memcached
+and the local memory cache both provide atomically.
+"""
+
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# a claim left by a client that died before writing blocks a bucket this long
+CLAIM_TIMEOUT = 5
+# a bucket still contended after this many tries is being hammered by
+# concurrent requests of one client, which are then turned away
+MAX_ATTEMPTS = 5
+
+
+def parse_rate(rate):
+    """return (capacity, tokens per second) of a rate like '60/min'"""
+    count, period = rate.split("/")
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class TokenBucket:
+    """bucket of capacity tokens refilled continuously at rate per second"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        # a bucket untouched for this long is full again, so let it expire
+        self.timeout = math.ceil(capacity / rate) + CLAIM_TIMEOUT
+
+    def take(self, cache, key, now):
+        """take a token, returning 0 or the seconds until one is free"""
+        for _ in range(MAX_ATTEMPTS):
+            state = cache.get(key) or (0, self.capacity, now)
+            version, tokens, updated = state
+            tokens = min(
+                self.capacity,
+                tokens + max(now - updated, 0) * self.rate,
+            )
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            if cache.add(f"{key}:{version}", 1, CLAIM_TIMEOUT):
+                cache.set(key, (version + 1, tokens - 1, now), self.timeout)
+                return 0
+        return 1 / self.rate
+
+
+def _rejected_key(scope):
+    return f"throttle:rejected:{scope}"
+
+
+def count_rejection(cache, scope):
+    """add one to the rejected requests counter of scope"""
+    key = _rejected_key(scope)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted since the add, the next rejection starts it again
+            pass
+
+
+def rejection_counts(cache=None):
+    """return {scope: requests rejected} for every throttled scope"""
+    cache = cache or caches[settings.THROTTLE_CACHE]
+    scopes = list(api_settings.DEFAULT_THROTTLE_RATES)
+    counts = cache.get_many([_rejected_key(scope) for scope in scopes])
+    return {scope: counts.get(_rejected_key(scope), 0) for scope in scopes}
+
+
+def reset_rejection_counts(cache=None):
+    """zero the rejected requests counters"""
+    cache = cache or caches[settings.THROTTLE_CACHE]
+    cache.delete_many(
+        [_rejected_key(scope) for scope in api_settings.DEFAULT_THROTTLE_RATES]
+    )
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """limit each user, or anonymous address, with a bucket per scope
+
+    A view's throttle_scope picks the bucket, otherwise safe methods are
+    "read" and the rest "write". Scopes without a rate aren't limited.
+    """
+
+    def get_scope(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if scope:
+            return scope
+        return "read" if request.method in SAFE_METHODS else "write"
+
+    def get_cache_key(self, request, scope):
+        if request.user and request.user.is_authenticated:
+            ident = f"user:{request.user.pk}"
+        else:
+            ident = f"addr:{self.get_ident(request)}"
+        return f"throttle:{scope}:{ident}"
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+
+        cache = caches[settings.THROTTLE_CACHE]
+        bucket = TokenBucket(*parse_rate(rate))
+        self.wait_seconds = bucket.take(
+            cache,
+            self.get_cache_key(request, scope),
+            time.time(),
+        )
+        if self.wait_seconds:
+            count_rejection(cache, scope)
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
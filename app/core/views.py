@@ -2,11 +2,115 @@
 Core views
 """
 
-from rest_framework.decorators import api_view
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.views import View
+from drf_spectacular.utils import extend_schema
+from rest_framework.decorators import api_view, throttle_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core import batch, microcache, schema, sse
+from core.authentication import CachedTokenAuthentication
 
 
 @api_view(["GET"])
+@throttle_classes([])
 def health_check(req):
     """return successful response"""
     return Response({"healthy": True})
+
+
+class SchemaView(View):
+    """serve the precomputed OpenAPI schema
+
+    YAML is returned unless JSON is asked for with ?format=json or an
+    Accept header naming JSON.
+    """
+
+    content_types = {
+        "yaml": "application/vnd.oai.openapi",
+        "json": "application/vnd.oai.openapi+json",
+    }
+
+    def get_format(self, request):
+        fmt = request.GET.get("format")
+        if fmt in self.content_types:
+            return fmt
+        if "json" in request.headers.get("Accept", ""):
+            return "json"
+        return "yaml"
+
+    def get(self, request):
+        fmt = self.get_format(request)
+        cached = schema.get(fmt)
+        gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+        # each encoding is a separate representation with its own tag
+        etag = f'{cached.etag[:-1]}-gzip"' if gzipped else cached.etag
+
+        if etag in request.headers.get("If-None-Match", ""):
+            res = HttpResponseNotModified()
+        else:
+            res = HttpResponse(
+                cached.gzipped if gzipped else cached.body,
+                content_type=self.content_types[fmt],
+            )
+            if gzipped:
+                res["Content-Encoding"] = "gzip"
+        res["ETag"] = etag
+        res["Cache-Control"] = "public, max-age=0, must-revalidate"
+        patch_vary_headers(res, ["Accept", "Accept-Encoding"])
+        return res
+
+
+class BatchView(APIView):
+    """run a list of recipe and user API operations in one request
+
+    Operations run in order as the authenticated user. With atomic they
+    share a transaction, rolled back as a whole if any of them fails.
+    """
+
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=batch.BatchRequestSerializer,
+        responses=batch.BatchResponseSerializer,
+    )
+    def post(self, request):
+        serializer = batch.BatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data["operations"]
+        committed, results = batch.run(
+            request,
+            operations,
+            serializer.validated_data["atomic"],
+        )
+        response = Response({"committed": committed, "results": results})
+        if committed and any(
+            op["method"] != "GET" and result["status"] < 400
+            for op, result in zip(operations, results)
+        ):
+            microcache.mark_purge(response, request.user.pk)
+        return response
+
+
+class EventsTicketView(APIView):
+    """exchange the token for a ticket opening one events stream
+
+    The ticket is passed as ?ticket= by clients that can't send headers,
+    like EventSource, and is good for a single stream opened soon after.
+    """
+
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(request=None, responses=sse.StreamTicketSerializer)
+    def post(self, request):
+        ticket = sse.issue_ticket(request.user.pk, request.auth.key)
+        serializer = sse.StreamTicketSerializer(
+            {"ticket": ticket, "expires_in": settings.EVENTS_TICKET_TTL},
+        )
+        return Response(serializer.data)
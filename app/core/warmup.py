@@ -0,0 +1,76 @@
+"""
+Warm the application up in the uWSGI master before workers fork
+"""
+
+import gc
+
+from django.core.cache import close_caches
+from django.db import connections
+from django.urls import URLResolver, get_resolver
+from rest_framework import serializers
+
+from core import schema
+
+
+def _walk_patterns(patterns):
+    """yield every URL pattern below patterns"""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _walk_patterns(pattern.url_patterns)
+        else:
+            yield pattern
+
+
+def _subclasses(cls):
+    """yield all subclasses of cls"""
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
+
+
+def warm_up_urls():
+    """build the URL resolver and reverse lookup tables"""
+    resolver = get_resolver()
+    # resolving and reversing each build their tables on first use
+    resolver.reverse_dict
+    return sum(1 for _ in _walk_patterns(resolver.url_patterns))
+
+
+def warm_up_serializers():
+    """build the fields of every serializer the apps define"""
+    count = 0
+    for cls in _subclasses(serializers.Serializer):
+        if cls.__module__.startswith(("rest_framework", "drf_spectacular")):
+            continue
+        cls().fields
+        count += 1
+    return count
+
+
+def warm_up_images():
+    """load the Pillow format plugins"""
+    from PIL import Image
+
+    Image.init()
+
+
+def warm_up(freeze=True):
+    """do the work each worker would otherwise repeat on its first requests
+
+    Everything loaded here is shared copy-on-write with forked workers.
+    Freezing the garbage collector moves it all to a permanent generation,
+    so collections in the workers don't touch and copy those pages.
+    """
+    warm_up_urls()
+    warm_up_serializers()
+    warm_up_images()
+    for fmt in schema.RENDERERS:
+        schema.get(fmt)
+
+    # a connection opened here would be shared by every worker, cache
+    # clients included
+    connections.close_all()
+    close_caches()
+    if freeze:
+        gc.collect()
+        gc.freeze()
@@ -0,0 +1,136 @@
+"""
+Set-based bulk changes to a user's tags and ingredients
+
+Each operation runs a fixed number of statements in one transaction on
+the user's shard, bypassing the per-object delete collector, and sends
+attrs_changed once so the recipe indexes can catch up in a single batch.
+"""
+
+from django.db import transaction
+from django.db.models import Case, CharField, Min, Value, When
+from rest_framework import exceptions
+
+from core.models import Ingredient, IngredientPosting, Recipe
+from recipe.signals import attrs_changed
+
+
+def _through(model):
+    """return the recipe through model of an attr model and its column"""
+    field = "tags" if model._meta.model_name == "tag" else "ingredients"
+    return getattr(Recipe, field).through, f"{model._meta.model_name}_id"
+
+
+def _check_owned(model, user, ids, using):
+    """refuse the request unless user owns every attr in ids"""
+    owned = set(
+        model.objects.using(using)
+        .select_for_update()
+        .filter(user=user, id__in=ids)
+        .values_list("id", flat=True)
+    )
+    unknown = sorted(set(ids) - owned)
+    if unknown:
+        raise exceptions.ValidationError(
+            f"{model._meta.verbose_name_plural.capitalize()} not found: "
+            f"{unknown}"
+        )
+
+
+def _recipe_ids(through, column, ids, using):
+    return set(
+        through.objects.using(using)
+        .filter(**{f"{column}__in": ids})
+        .values_list("recipe_id", flat=True)
+    )
+
+
+def _delete_attrs(model, ids, using):
+    """delete attrs and everything hanging off them without the collector"""
+    through, column = _through(model)
+    through.objects.using(using).filter(
+        **{f"{column}__in": ids}
+    )._raw_delete(using)
+    if model is Ingredient:
+        IngredientPosting.objects.using(using).filter(
+            ingredient_id__in=ids,
+        )._raw_delete(using)
+    model.objects.using(using).filter(id__in=ids)._raw_delete(using)
+
+
+def merge(model, user, sources, target, using):
+    """fold the source attrs into target and delete them
+
+    Recipes using a source are moved over to target. A recipe already
+    using target, or several of the sources, ends up with one link.
+    """
+    through, column = _through(model)
+    with transaction.atomic(using=using):
+        _check_owned(model, user, set(sources) | {target}, using)
+        recipe_ids = _recipe_ids(through, column, sources, using)
+
+        # repoint one link per recipe that doesn't have target yet, so the
+        # update can't collide with the (recipe, attr) unique constraint
+        links = through.objects.using(using)
+        first_links = (
+            links.filter(**{f"{column}__in": sources})
+            .exclude(
+                recipe_id__in=links.filter(**{column: target}).values(
+                    "recipe_id",
+                ),
+            )
+            .values("recipe_id")
+            .annotate(first=Min("id"))
+            .values("first")
+        )
+        links.filter(id__in=first_links).update(**{column: target})
+        _delete_attrs(model, sources, using)
+
+        attrs_changed.send(
+            sender=model,
+            action="merge",
+            user=user,
+            ids=set(sources) | {target},
+            removed=set(sources),
+            recipe_ids=recipe_ids,
+            using=using,
+        )
+
+
+def rename(model, user, names, using):
+    """give attrs new names, names mapping attr ids to names"""
+    through, column = _through(model)
+    with transaction.atomic(using=using):
+        _check_owned(model, user, names, using)
+        model.objects.using(using).filter(id__in=names).update(
+            name=Case(
+                *[When(id=pk, then=Value(name)) for pk, name in names.items()],
+                output_field=CharField(),
+            ),
+        )
+        attrs_changed.send(
+            sender=model,
+            action="rename",
+            user=user,
+            ids=set(names),
+            removed=set(),
+            recipe_ids=_recipe_ids(through, column, names, using),
+            using=using,
+        )
+
+
+def delete(model, user, ids, using):
+    """delete attrs, removing them from every recipe using them"""
+    through, column = _through(model)
+    with transaction.atomic(using=using):
+        _check_owned(model, user, ids, using)
+        recipe_ids = _recipe_ids(through, column, ids, using)
+        _delete_attrs(model, ids, using)
+        attrs_changed.send(
+            sender=model,
+            action="delete",
+            user=user,
+            ids=set(ids),
+            removed=set(ids),
+            recipe_ids=recipe_ids,
+            using=using,
+        )
@@ -0,0 +1,211 @@
+"""
+Pantry matching through an inverted ingredient index
+
+Every ingredient keeps a posting of the recipes using it, as sorted packed
+arrays of recipe ids and of those recipes' ingredient counts. Matching a
+pantry only reads the postings of the ingredients in it: counting how often
+each recipe id occurs across them gives the ingredients a recipe has
+covered, and its total gives how many are missing.
+
+Postings are stored in segments, each holding the recipes of one span of
+ids, so the size of what an edit rewrites is bounded.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+from django.db import transaction
+
+from core.models import Ingredient, IngredientPosting, Recipe
+
+
+ID_DTYPE = "<i8"
+TOTAL_DTYPE = "<i4"
+# count with a dense array when ids span at most this many times the
+# number of postings entries, otherwise sort them
+DENSE_SPAN_FACTOR = 8
+# a segment holds the recipes whose ids share all but the low SEGMENT_BITS
+SEGMENT_BITS = 18
+
+
+def unpack(posting):
+    """return the recipe ids and totals arrays of a posting"""
+    return (
+        np.frombuffer(bytes(posting.recipe_ids), dtype=ID_DTYPE),
+        np.frombuffer(bytes(posting.totals), dtype=TOTAL_DTYPE),
+    )
+
+
+def segment_of(recipe_id):
+    """return the posting segment holding recipe_id"""
+    return recipe_id >> SEGMENT_BITS
+
+
+def _postings(keys, using):
+    """return postings of (ingredient, segment) keys, locked
+
+    Keys without a posting get a new, unsaved one.
+    """
+    ingredient_ids = {ingredient_id for ingredient_id, segment in keys}
+    postings = {
+        (posting.ingredient_id, posting.segment): posting
+        for posting in IngredientPosting.objects.using(using)
+        .select_for_update()
+        .filter(
+            ingredient_id__in=ingredient_ids,
+            segment__in={segment for ingredient_id, segment in keys},
+        )
+    }
+    missing = set(keys) - set(postings)
+    if missing:
+        owners = dict(
+            Ingredient.objects.using(using)
+            .filter(id__in={ingredient_id for ingredient_id, _ in missing})
+            .values_list("id", "user_id")
+        )
+        for ingredient_id, segment in missing:
+            if ingredient_id in owners:
+                postings[ingredient_id, segment] = IngredientPosting(
+                    ingredient_id=ingredient_id,
+                    segment=segment,
+                    user_id=owners[ingredient_id],
+                )
+    return {key: postings[key] for key in keys if key in postings}
+
+
+def reindex_recipes(recipe_ids, removed_ids, using):
+    """re-index recipes after their ingredients changed
+
+    removed_ids are ingredients some of the recipes no longer use; the
+    current ingredients are read back from the database. Only the segments
+    holding the recipes are locked and rewritten, and segments left empty
+    are deleted. Runs a fixed number of statements however many recipes
+    and postings are touched.
+    """
+    links = list(
+        Recipe.ingredients.through.objects.using(using)
+        .filter(recipe_id__in=recipe_ids)
+        .values_list("ingredient_id", "recipe_id")
+    )
+    totals = defaultdict(int)
+    using_ingredient = defaultdict(list)
+    for ingredient_id, recipe_id in links:
+        totals[recipe_id] += 1
+        using_ingredient[ingredient_id, segment_of(recipe_id)].append(
+            recipe_id,
+        )
+    changed = np.array(sorted(recipe_ids), dtype=ID_DTYPE)
+    segments = {segment_of(recipe_id) for recipe_id in recipe_ids}
+    keys = set(using_ingredient) | {
+        (ingredient_id, segment)
+        for ingredient_id in removed_ids
+        for segment in segments
+    }
+
+    with transaction.atomic(using=using):
+        postings = _postings(keys, using)
+        created, updated, emptied = [], [], []
+        for key, posting in postings.items():
+            posting_ids, posting_totals = unpack(posting)
+            keep = ~np.isin(posting_ids, changed)
+            added = np.array(
+                sorted(using_ingredient.get(key, ())),
+                dtype=ID_DTYPE,
+            )
+            posting_ids = np.concatenate([posting_ids[keep], added])
+            if not len(posting_ids):
+                if not posting._state.adding:
+                    emptied.append(posting.pk)
+                continue
+            posting_totals = np.concatenate([
+                posting_totals[keep],
+                np.array([totals[i] for i in added], dtype=TOTAL_DTYPE),
+            ])
+            order = np.argsort(posting_ids, kind="stable")
+            posting.recipe_ids = posting_ids[order].astype(ID_DTYPE).tobytes()
+            posting.totals = posting_totals[order].astype(
+                TOTAL_DTYPE,
+            ).tobytes()
+            if posting._state.adding:
+                created.append(posting)
+            else:
+                updated.append(posting)
+        IngredientPosting.objects.using(using).bulk_create(created)
+        IngredientPosting.objects.using(using).bulk_update(
+            updated,
+            ["recipe_ids", "totals"],
+        )
+        IngredientPosting.objects.using(using).filter(pk__in=emptied).delete()
+
+
+def update_recipe(recipe_id, removed_ids, using):
+    """re-index a recipe after its ingredients changed"""
+    reindex_recipes([recipe_id], removed_ids, using)
+
+
+def remove_recipe(recipe_id, ingredient_ids, using):
+    """drop a deleted recipe from the postings of its ingredients"""
+    reindex_recipes([recipe_id], ingredient_ids, using)
+
+
+def score(postings, max_missing=None):
+    """rank recipes by the ingredients a pantry covers
+
+    postings is a list of (recipe_ids, totals) array pairs, one per pantry
+    ingredient. Returns arrays of recipe ids, matched and missing counts,
+    fewest missing first, then highest coverage, then newest.
+    """
+    if not postings:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    all_ids = np.concatenate([ids for ids, totals in postings])
+    all_totals = np.concatenate([totals for ids, totals in postings])
+    if not len(all_ids):
+        return all_ids, all_ids, all_ids
+    low = all_ids.min()
+    span = int(all_ids.max() - low) + 1
+    if span <= DENSE_SPAN_FACTOR * len(all_ids):
+        # ids are dense enough to count them with an array indexed by id
+        counts = np.bincount(all_ids - low, minlength=span)
+        recipe_ids = np.flatnonzero(counts)
+        matched = counts[recipe_ids]
+        by_id = np.zeros(span, dtype=all_totals.dtype)
+        by_id[all_ids - low] = all_totals
+        missing = by_id[recipe_ids] - matched
+        recipe_ids = recipe_ids + low
+    else:
+        recipe_ids, first, matched = np.unique(
+            all_ids,
+            return_index=True,
+            return_counts=True,
+        )
+        missing = all_totals[first] - matched
+    if max_missing is not None:
+        keep = missing <= max_missing
+        recipe_ids, matched, missing = (
+            recipe_ids[keep],
+            matched[keep],
+            missing[keep],
+        )
+    coverage = matched / (matched + missing)
+    # lexsort orders by the last key first
+    order = np.lexsort((-recipe_ids, -coverage, missing))
+    return recipe_ids[order], matched[order], missing[order]
+
+
+def match(user, ingredient_ids, max_missing, using):
+    """return ranked (recipe_id, matched, missing) for a user's pantry
+
+    A recipe is in one segment of each ingredient it uses, so segments
+    are scored like whole postings.
+    """
+    postings = [
+        unpack(posting)
+        for posting in IngredientPosting.objects.using(using).filter(
+            user=user,
+            ingredient_id__in=ingredient_ids,
+        )
+    ]
+    recipe_ids, matched, missing = score(postings, max_missing)
+    return list(zip(recipe_ids.tolist(), matched.tolist(), missing.tolist()))
@@ -2,9 +2,12 @@
 Serializers for the Recipe APIs
 """
 
+from django.conf import settings
 from rest_framework import serializers
 
-from core.models import Recipe, Tag, Ingredient
+from core import sharding
+from core.models import ImageUpload, Ingredient, Recipe, Tag
+from recipe import thumbnails, uploads
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -29,11 +32,24 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ["id"]
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """leave out fields not in the view's sparse fieldset"""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        kept = self.context.get("sparse_fields")
+        if kept is not None:
+            for name in set(fields) - set(kept):
+                del fields[name]
+        return fields
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Recipes"""
 
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
+    price = serializers.DecimalField(max_digits=12, decimal_places=2)
 
     class Meta:
         model = Recipe
@@ -48,32 +64,49 @@ class RecipeSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["id"]
 
+    def _get_shard(self):
+        """return the shard holding the authed user's data"""
+        return sharding.shard_for_user(self.context["request"].user)
+
+    def _get_or_create_attrs(self, model, items, related):
+        """add the attrs named in items to related, creating missing ones
+
+        Existing attrs are found with one query on the (user, name) index
+        and added together, so the recipe indexes are updated once.
+        """
+        names = list(dict.fromkeys(item["name"] for item in items))
+        if not names:
+            return
+        auth_user = self.context["request"].user
+        attrs = model.objects.using(self._get_shard())
+        found = {}
+        for attr in attrs.filter(user=auth_user, name__in=names).order_by(
+            "id",
+        ):
+            found.setdefault(attr.name, attr)
+        related.add(
+            *[
+                found.get(name) or attrs.create(user=auth_user, name=name)
+                for name in names
+            ]
+        )
+
     def _get_or_create_tags(self, tags, recipe):
         """handle getting or creating tags as needed"""
-        auth_user = self.context["request"].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag,
-            )
-            recipe.tags.add(tag_obj)
+        self._get_or_create_attrs(Tag, tags, recipe.tags)
 
     def _get_or_create_ingredients(self, ingredients, recipe):
         """handle getting or creating ingredients as needed"""
-        auth_user = self.context["request"].user
-        for ingredient in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingredient,
-            )
-            recipe.ingredients.add(ingredient_obj)
+        self._get_or_create_attrs(Ingredient, ingredients, recipe.ingredients)
 
     def create(self, validated_data):
         """create a recipe"""
         tags = validated_data.pop("tags", [])
         ingredients = validated_data.pop("ingredients", [])
 
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe.objects.db_manager(self._get_shard()).create(
+            **validated_data,
+        )
         self._get_or_create_tags(tags, recipe)
         self._get_or_create_ingredients(ingredients, recipe)
         return recipe
@@ -114,3 +147,218 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         fields = ["id", "image"]
         read_only_fields = ["id"]
         extra_kwargs = {"image": {"required": "True"}}
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """serializer for resumable image uploads"""
+
+    class Meta:
+        model = ImageUpload
+        fields = ["id", "filename", "size", "offset"]
+        read_only_fields = ["id", "offset"]
+
+    def validate_size(self, value):
+        """refuse uploads larger than the configured maximum"""
+        if value > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Uploads are limited to {settings.UPLOAD_MAX_SIZE} bytes"
+            )
+        return value
+
+    def validate(self, attrs):
+        """refuse new uploads while the user has too many open"""
+        user = self.context["request"].user
+        shard = sharding.shard_for_user(user)
+        if (
+            uploads.open_uploads(shard).filter(user=user).count()
+            >= settings.UPLOAD_MAX_OPEN
+        ):
+            raise serializers.ValidationError(
+                f"At most {settings.UPLOAD_MAX_OPEN} uploads can be open "
+                "at once, finish or cancel one first"
+            )
+        return attrs
+
+    def create(self, validated_data):
+        """create the upload on the authed user's shard"""
+        shard = sharding.shard_for_user(self.context["request"].user)
+        return ImageUpload.objects.db_manager(shard).create(**validated_data)
+
+
+class RecipeThumbnailSerializer(serializers.Serializer):
+    """serializer for thumbnail query params"""
+
+    w = serializers.ChoiceField(
+        choices=settings.THUMBNAIL_WIDTHS,
+        default=256,
+    )
+    fmt = serializers.ChoiceField(
+        choices=list(thumbnails.FORMATS),
+        default="jpeg",
+    )
+
+
+class SimilarRecipeSerializer(RecipeSerializer):
+    """serializer for recipes ranked by similarity"""
+
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ["similarity"]
+
+
+class SimilarRecipesQuerySerializer(serializers.Serializer):
+    """serializer for similar recipes query params"""
+
+    k = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class PantryRecipeSerializer(RecipeSerializer):
+    """serializer for recipes ranked by pantry coverage"""
+
+    matched = serializers.IntegerField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + [
+            "matched",
+            "missing",
+            "coverage",
+        ]
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    """serializer for recipe list range filters and ordering"""
+
+    ORDERING_FIELDS = {
+        "time": "time_minutes",
+        "price": "price",
+        "title": "title",
+        "id": "id",
+    }
+
+    min_time = serializers.IntegerField(min_value=0, required=False)
+    max_time = serializers.IntegerField(min_value=0, required=False)
+    min_price = serializers.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        required=False,
+    )
+    max_price = serializers.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        required=False,
+    )
+    ordering = serializers.ChoiceField(
+        choices=[
+            prefix + name for name in ORDERING_FIELDS for prefix in ("", "-")
+        ],
+        required=False,
+    )
+
+    def validate_ordering(self, value):
+        """return the model fields to order by, ties broken by id"""
+        name = value.lstrip("-")
+        prefix = value[:len(value) - len(name)]
+        fields = [prefix + self.ORDERING_FIELDS[name]]
+        if name != "id":
+            fields.append(prefix + "id")
+        return fields
+
+
+class PantryQuerySerializer(serializers.Serializer):
+    """serializer for pantry match query params"""
+
+    ingredients = serializers.RegexField(r"^\d+(,\d+)*$")
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+    def validate_ingredients(self, value):
+        """return the ingredient ids as integers"""
+        return [int(ingredient_id) for ingredient_id in value.split(",")]
+
+
+class ShoppingListRequestSerializer(serializers.Serializer):
+    """serializer for the recipes a shopping list is built from"""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=200,
+    )
+
+
+class ShoppingListItemSerializer(serializers.Serializer):
+    """serializer for an ingredient on a shopping list"""
+
+    id = serializers.IntegerField(source="ingredient_id")
+    name = serializers.CharField(source="ingredient__name")
+    count = serializers.IntegerField()
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    """serializer for a merged shopping list"""
+
+    recipes = serializers.ListField(child=serializers.IntegerField())
+    items = ShoppingListItemSerializer(many=True)
+
+
+class AttrMergeSerializer(serializers.Serializer):
+    """serializer for merging tags or ingredients into one"""
+
+    sources = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=1000,
+    )
+    target = serializers.IntegerField(min_value=1)
+
+    def validate(self, attrs):
+        """refuse merging an attr into itself"""
+        if attrs["target"] in attrs["sources"]:
+            raise serializers.ValidationError(
+                "The target can't also be a source"
+            )
+        return attrs
+
+
+class AttrRenameSerializer(serializers.Serializer):
+    """serializer for a new name of a tag or ingredient"""
+
+    id = serializers.IntegerField(min_value=1)
+    name = serializers.CharField(max_length=255)
+
+
+class AttrBulkRenameSerializer(serializers.Serializer):
+    """serializer for renaming many tags or ingredients"""
+
+    items = AttrRenameSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, value):
+        """refuse renaming the same attr twice"""
+        ids = [item["id"] for item in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Each id can appear only once")
+        if len(ids) > 1000:
+            raise serializers.ValidationError("At most 1000 items at once")
+        return value
+
+
+class RecipeBulkDeleteSerializer(serializers.Serializer):
+    """serializer for deleting many recipes"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=1000,
+    )
+
+
+class AttrBulkDeleteSerializer(serializers.Serializer):
+    """serializer for deleting many tags or ingredients"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=1000,
+    )
@@ -0,0 +1,260 @@
+"""
+Signal receivers keeping the recipe indexes up to date, and publishing
+change events of recipes, tags and ingredients
+"""
+
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import Signal, receiver
+
+from core import events
+from core.invalidation import bus
+from core.deletion import recipes_deleted
+from core.models import Ingredient, Recipe, Tag
+from recipe import pantry, similarity, uploads
+
+
+# Sent once per bulk merge, rename or delete of tags or ingredients, with
+# sender the attr model and the arguments action, user, ids, removed (attr
+# ids taken off recipes), recipe_ids (recipes using any of ids) and using.
+attrs_changed = Signal()
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_recipe_signature(
+    sender,
+    instance,
+    action,
+    reverse,
+    pk_set,
+    using,
+    **kwargs,
+):
+    """recompute similarity signatures of recipes whose sets changed"""
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            similarity.update_recipes([instance.pk], using)
+        return
+
+    # instance is a tag or ingredient and pk_set holds recipe ids
+    if action == "pre_clear":
+        instance._cleared_recipe_ids = list(
+            instance.recipe_set.using(using).values_list("id", flat=True)
+        )
+    elif action == "post_clear":
+        similarity.update_recipes(instance._cleared_recipe_ids, using)
+    elif action in ("post_add", "post_remove"):
+        similarity.update_recipes(list(pk_set), using)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_ingredient_postings(
+    sender,
+    instance,
+    action,
+    reverse,
+    pk_set,
+    using,
+    **kwargs,
+):
+    """move recipes in and out of the postings of their ingredients"""
+    if action == "pre_clear":
+        related = instance.recipe_set if reverse else instance.ingredients
+        instance._cleared_posting_ids = set(
+            related.using(using).values_list("id", flat=True)
+        )
+        return
+    if action == "post_clear":
+        pk_set = instance._cleared_posting_ids
+    elif action not in ("post_add", "post_remove"):
+        return
+    removed = action != "post_add"
+
+    if not reverse:
+        pantry.update_recipe(instance.pk, pk_set if removed else (), using)
+        return
+    for recipe_id in pk_set:
+        pantry.update_recipe(
+            recipe_id,
+            [instance.pk] if removed else (),
+            using,
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_recipe_ingredients(sender, instance, using, **kwargs):
+    """keep the ingredients of a recipe about to be deleted"""
+    instance._posting_ingredient_ids = list(
+        instance.ingredients.using(using).values_list("id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_postings(sender, instance, using, **kwargs):
+    """drop a deleted recipe from the ingredient postings"""
+    if instance._posting_ingredient_ids:
+        pantry.remove_recipe(
+            instance.pk,
+            instance._posting_ingredient_ids,
+            using,
+        )
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_ingredient_recipes(sender, instance, using, **kwargs):
+    """keep the recipes using an ingredient about to be deleted"""
+    instance._posting_recipe_ids = list(
+        instance.recipe_set.using(using).values_list("id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+def recount_ingredient_recipes(sender, instance, using, **kwargs):
+    """correct the ingredient totals of recipes that used it"""
+    for recipe_id in instance._posting_recipe_ids:
+        pantry.update_recipe(recipe_id, (), using)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def reindex_attr_recipes(sender, instance, using, **kwargs):
+    """recompute the signatures of recipes that used a deleted attr"""
+    if instance._event_recipe_ids:
+        similarity.update_recipes(instance._event_recipe_ids, using)
+
+
+@receiver(attrs_changed)
+def reindex_changed_recipes(
+    sender,
+    removed,
+    recipe_ids,
+    using,
+    **kwargs,
+):
+    """catch the recipe indexes up with a bulk attr change"""
+    if not removed or not recipe_ids:
+        return
+    similarity.update_recipes(list(recipe_ids), using)
+    if sender is Ingredient:
+        pantry.reindex_recipes(recipe_ids, removed, using)
+
+
+@receiver(recipes_deleted)
+def clean_up_deleted_recipes(
+    sender,
+    recipe_ids,
+    ingredient_ids,
+    upload_ids,
+    using,
+    **kwargs,
+):
+    """drop a batch of deleted recipes from postings and upload storage"""
+    if ingredient_ids:
+        pantry.reindex_recipes(recipe_ids, ingredient_ids, using)
+    if upload_ids:
+        transaction.on_commit(
+            lambda: uploads.remove_parts(upload_ids),
+            using=using,
+        )
+
+
+EVENT_TYPES = {Recipe: "recipe", Tag: "tag", Ingredient: "ingredient"}
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def publish_saved(sender, instance, created, using, **kwargs):
+    """tell the owner's streams about a created or changed object"""
+    events.publish(
+        instance.user_id,
+        EVENT_TYPES[sender],
+        "created" if created else "updated",
+        [instance.pk],
+        using,
+    )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_attr_recipes(sender, instance, using, **kwargs):
+    """keep the recipes losing an attr about to be deleted"""
+    instance._event_recipe_ids = list(
+        instance.recipe_set.using(using).values_list("id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def publish_deleted(sender, instance, using, **kwargs):
+    """tell the owner's streams about a deleted object"""
+    events.publish(
+        instance.user_id,
+        EVENT_TYPES[sender],
+        "deleted",
+        [instance.pk],
+        using,
+    )
+    recipe_ids = getattr(instance, "_event_recipe_ids", ())
+    events.publish(instance.user_id, "recipe", "updated", recipe_ids, using)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def publish_recipe_links(
+    sender,
+    instance,
+    action,
+    reverse,
+    pk_set,
+    using,
+    **kwargs,
+):
+    """tell the owner's streams about recipes with new tags or ingredients"""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == "post_clear":
+        recipe_ids = instance._cleared_recipe_ids
+    else:
+        recipe_ids = pk_set
+    events.publish(instance.user_id, "recipe", "updated", recipe_ids, using)
+
+
+@receiver(recipes_deleted)
+def publish_deleted_recipes(sender, user_id, recipe_ids, using, **kwargs):
+    """tell the owner's streams about a batch of deleted recipes"""
+    events.publish(user_id, "recipe", "deleted", recipe_ids, using)
+
+
+@receiver(attrs_changed)
+def publish_changed_attrs(
+    sender,
+    user,
+    ids,
+    removed,
+    recipe_ids,
+    using,
+    **kwargs,
+):
+    """tell the owner's streams about a bulk attr change"""
+    kind = EVENT_TYPES[sender]
+    events.publish(user.pk, kind, "deleted", removed, using)
+    events.publish(user.pk, kind, "updated", set(ids) - set(removed), using)
+    events.publish(user.pk, "recipe", "updated", recipe_ids, using)
+
+
+@receiver(attrs_changed)
+def invalidate_changed_attrs(sender, user, recipe_ids, using, **kwargs):
+    """evict process caches of attrs and recipes a bulk change touched"""
+    bus.publish(sender._meta.label_lower, user.pk, None, using)
+    if recipe_ids:
+        bus.publish(Recipe._meta.label_lower, user.pk, None, using)
@@ -0,0 +1,207 @@
+"""
+Similar recipes through MinHash signatures and LSH buckets
+
+Each recipe is reduced to the set of its ingredient and tag ids. A MinHash
+signature estimates the Jaccard similarity between two such sets, and
+splitting it into bands lets recipes that agree on a whole band be found
+through one indexed bucket lookup instead of a scan of the library. The
+candidates are then ranked by their exact Jaccard similarity.
+"""
+
+import hashlib
+
+import numpy as np
+
+from django.db import transaction
+from django.db.models import Q
+
+from core.models import Recipe, RecipeBucket, RecipeSignature
+
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+# candidates beyond this many are first narrowed down by their signatures
+MAX_VERIFIED = 200
+
+# h(x) = (a * x + b) mod p, with a fixed seed so signatures stay stable
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20230705)
+_A = _rng.randint(1, _PRIME, size=NUM_HASHES).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_HASHES).astype(np.uint64)
+_EMPTY = np.full(NUM_HASHES, _PRIME, dtype=np.uint32)
+
+
+def recipe_tokens(recipe_ids, using):
+    """return {recipe_id: array of ingredient and tag tokens}
+
+    Ingredient ids map to even and tag ids to odd tokens, so the two id
+    spaces can't collide.
+    """
+    tokens = {recipe_id: [] for recipe_id in recipe_ids}
+    for through, column, offset in [
+        (Recipe.ingredients.through, "ingredient_id", 0),
+        (Recipe.tags.through, "tag_id", 1),
+    ]:
+        rows = (
+            through.objects.using(using)
+            .filter(recipe_id__in=recipe_ids)
+            .values_list("recipe_id", column)
+        )
+        for recipe_id, value in rows:
+            tokens[recipe_id].append(value * 2 + offset)
+    return {
+        recipe_id: np.unique(np.array(values, dtype=np.uint64))
+        for recipe_id, values in tokens.items()
+    }
+
+
+def signature(tokens):
+    """return the MinHash signature of a token array"""
+    if not len(tokens):
+        return _EMPTY.copy()
+    hashes = (np.outer(_A, tokens % _PRIME) + _B[:, None]) % _PRIME
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def pack(minhashes):
+    """return a signature as bytes"""
+    return minhashes.astype("<u4").tobytes()
+
+
+def unpack(data):
+    """return a signature packed by pack"""
+    return np.frombuffer(bytes(data), dtype="<u4")
+
+
+def band_buckets(minhashes):
+    """return the (band, bucket) pairs of a signature"""
+    buckets = []
+    for band in range(BANDS):
+        rows = minhashes[band * ROWS:(band + 1) * ROWS].astype("<u4")
+        digest = hashlib.blake2b(rows.tobytes(), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, "big", signed=True)))
+    return buckets
+
+
+def update_recipes(recipe_ids, using):
+    """recompute the signatures and buckets of recipes"""
+    recipes = dict(
+        Recipe.objects.using(using)
+        .filter(id__in=recipe_ids)
+        .values_list("id", "user_id")
+    )
+    if not recipes:
+        return
+    tokens = recipe_tokens(list(recipes), using)
+
+    signatures = []
+    buckets = []
+    for recipe_id, user_id in recipes.items():
+        minhashes = signature(tokens[recipe_id])
+        signatures.append(
+            RecipeSignature(
+                recipe_id=recipe_id,
+                user_id=user_id,
+                minhashes=pack(minhashes),
+            )
+        )
+        if len(tokens[recipe_id]):
+            buckets.extend(
+                RecipeBucket(
+                    recipe_id=recipe_id,
+                    user_id=user_id,
+                    band=band,
+                    bucket=bucket,
+                )
+                for band, bucket in band_buckets(minhashes)
+            )
+
+    with transaction.atomic(using=using):
+        RecipeSignature.objects.using(using).filter(
+            recipe_id__in=recipes,
+        ).delete()
+        RecipeBucket.objects.using(using).filter(
+            recipe_id__in=recipes,
+        ).delete()
+        RecipeSignature.objects.using(using).bulk_create(signatures)
+        RecipeBucket.objects.using(using).bulk_create(buckets)
+
+
+def jaccard(target, candidates):
+    """return the exact Jaccard similarity of target to each candidate"""
+    if not candidates:
+        return np.zeros(0)
+    sizes = np.array([len(tokens) for tokens in candidates])
+    flat = np.concatenate(candidates)
+    owner = np.repeat(np.arange(len(candidates)), sizes)
+    shared = np.bincount(
+        owner[np.isin(flat, target)],
+        minlength=len(candidates),
+    )
+    union = sizes + len(target) - shared
+    return np.divide(
+        shared,
+        union,
+        out=np.zeros(len(candidates)),
+        where=union > 0,
+    )
+
+
+def _closest_signatures(recipe_id, candidate_ids, using):
+    """return the candidates whose signatures agree most with recipe's"""
+    rows = dict(
+        RecipeSignature.objects.using(using)
+        .filter(recipe_id__in=[recipe_id] + candidate_ids)
+        .values_list("recipe_id", "minhashes")
+    )
+    target = unpack(rows.pop(recipe_id))
+    candidate_ids = [i for i in candidate_ids if i in rows]
+    matrix = np.stack([unpack(rows[i]) for i in candidate_ids])
+    estimates = (matrix == target).mean(axis=1)
+    keep = np.sort(np.argsort(-estimates, kind="stable")[:MAX_VERIFIED])
+    return [candidate_ids[i] for i in keep]
+
+
+def similar_recipes(recipe, k, using):
+    """return up to k (recipe_id, similarity) pairs most like recipe"""
+    if not RecipeSignature.objects.using(using).filter(
+        recipe_id=recipe.id,
+    ).exists():
+        update_recipes([recipe.id], using)
+
+    pairs = (
+        RecipeBucket.objects.using(using)
+        .filter(recipe_id=recipe.id)
+        .values_list("band", "bucket")
+    )
+    same_bucket = Q()
+    for band, bucket in pairs:
+        same_bucket |= Q(band=band, bucket=bucket)
+    if not same_bucket:
+        return []
+    # newest first, which also breaks ties in the ranking
+    candidate_ids = sorted(
+        RecipeBucket.objects.using(using)
+        .filter(same_bucket, user_id=recipe.user_id)
+        .exclude(recipe_id=recipe.id)
+        .values_list("recipe_id", flat=True)
+        .distinct(),
+        reverse=True,
+    )
+    if not candidate_ids:
+        return []
+    if len(candidate_ids) > MAX_VERIFIED:
+        candidate_ids = _closest_signatures(recipe.id, candidate_ids, using)
+
+    tokens = recipe_tokens([recipe.id] + candidate_ids, using)
+    scores = jaccard(
+        tokens[recipe.id],
+        [tokens[recipe_id] for recipe_id in candidate_ids],
+    )
+    ranked = np.argsort(-scores, kind="stable")[:k]
+    return [
+        (candidate_ids[i], float(scores[i]))
+        for i in ranked
+        if scores[i] > 0
+    ]
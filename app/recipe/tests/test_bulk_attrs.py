@@ -0,0 +1,218 @@
+"""
+Tests for bulk changes to tags and ingredients
+"""
+from decimal import Decimal
+from unittest.mock import Mock
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, IngredientPosting, Recipe, Tag
+from core.sharding import shard_for_user
+from recipe import pantry
+from recipe.signals import attrs_changed
+
+MERGE_TAGS_URL = reverse("recipe:tag-merge")
+RENAME_TAGS_URL = reverse("recipe:tag-rename")
+DELETE_TAGS_URL = reverse("recipe:tag-bulk-delete")
+MERGE_INGREDIENTS_URL = reverse("recipe:ingredient-merge")
+DELETE_INGREDIENTS_URL = reverse("recipe:ingredient-bulk-delete")
+
+
+class BulkAttrTests(TestCase):
+    """Test merging, renaming and deleting many attrs at once"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+
+    def create_recipe(self, tags=(), ingredients=()):
+        recipe = Recipe.objects.using(self.shard).create(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        recipe.tags.add(*tags)
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def create_tags(self, *names):
+        return [
+            Tag.objects.using(self.shard).create(user=self.user, name=n)
+            for n in names
+        ]
+
+    def merge_queries(self, count):
+        """return the statements run merging count tags"""
+        target, *sources = self.create_tags(*["Tag"] * (count + 1))
+        for source in sources:
+            self.create_recipe(tags=[source])
+        with CaptureQueriesContext(connections[self.shard]) as ctx:
+            res = self.client.post(
+                MERGE_TAGS_URL,
+                {"sources": [s.id for s in sources], "target": target.id},
+                format="json",
+            )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries)
+
+    def test_merge_tags(self):
+        """test recipes move to the target and sources are deleted"""
+        vegan, plant, veg = self.create_tags("Vegan", "Plant based", "Veg")
+        both = self.create_recipe(tags=[vegan, plant])
+        sources_only = self.create_recipe(tags=[plant, veg])
+        self.create_recipe(tags=[vegan])
+
+        res = self.client.post(
+            MERGE_TAGS_URL,
+            {"sources": [plant.id, veg.id], "target": vegan.id},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {"id": vegan.id, "name": "Vegan"})
+        self.assertFalse(
+            Tag.objects.using(self.shard).filter(id__in=[plant.id, veg.id]),
+        )
+        self.assertEqual(list(both.tags.all()), [vegan])
+        self.assertEqual(list(sources_only.tags.all()), [vegan])
+        self.assertEqual(vegan.recipe_set.count(), 3)
+
+    def test_merge_constant_queries(self):
+        """test merging more tags doesn't run more statements"""
+        self.assertEqual(self.merge_queries(2), self.merge_queries(10))
+
+    def test_merge_ingredients_updates_pantry(self):
+        """test ingredient postings follow a merge"""
+        tomato, tomatoes, basil = [
+            Ingredient.objects.using(self.shard).create(
+                user=self.user,
+                name=name,
+            )
+            for name in ["Tomato", "tomatoes", "Basil"]
+        ]
+        recipe = self.create_recipe(ingredients=[tomato, tomatoes, basil])
+
+        self.client.post(
+            MERGE_INGREDIENTS_URL,
+            {"sources": [tomatoes.id], "target": tomato.id},
+            format="json",
+        )
+
+        postings = IngredientPosting.objects.using(self.shard)
+        self.assertFalse(postings.filter(ingredient=tomatoes).exists())
+        recipe_ids, totals = pantry.unpack(postings.get(ingredient=basil))
+        self.assertEqual(recipe_ids.tolist(), [recipe.id])
+        self.assertEqual(totals.tolist(), [2])
+
+    def test_merge_other_users_tag_refused(self):
+        """test tags of other users can't be merged"""
+        other = get_user_model().objects.create_user(
+            "other@example.com",
+            "testpass123",
+        )
+        foreign = Tag.objects.using(shard_for_user(other)).create(
+            user=other,
+            name="Vegan",
+        )
+        own, = self.create_tags("Vegan")
+
+        res = self.client.post(
+            MERGE_TAGS_URL,
+            {"sources": [foreign.id], "target": own.id},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        foreign_tags = Tag.objects.using(foreign._state.db)
+        self.assertTrue(foreign_tags.filter(id=foreign.id).exists())
+
+    def test_merge_into_source_refused(self):
+        """test the target can't be one of the sources"""
+        tag, = self.create_tags("Vegan")
+
+        res = self.client.post(
+            MERGE_TAGS_URL,
+            {"sources": [tag.id], "target": tag.id},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rename_tags(self):
+        """test many tags are renamed with one request"""
+        first, second = self.create_tags("tomato", "basil")
+
+        res = self.client.post(
+            RENAME_TAGS_URL,
+            {
+                "items": [
+                    {"id": first.id, "name": "Tomato"},
+                    {"id": second.id, "name": "Basil"},
+                ],
+            },
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.name, second.name), ("Tomato", "Basil"))
+
+    def test_bulk_delete_fires_signal_once(self):
+        """test deleting tags sends a single change notification"""
+        tags = self.create_tags("A", "B", "C")
+        recipe = self.create_recipe(tags=tags)
+        handler = Mock()
+        attrs_changed.connect(handler)
+        self.addCleanup(attrs_changed.disconnect, handler)
+
+        res = self.client.post(
+            DELETE_TAGS_URL,
+            {"ids": [tag.id for tag in tags]},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Tag.objects.using(self.shard).exists())
+        self.assertFalse(recipe.tags.exists())
+        handler.assert_called_once()
+        self.assertEqual(handler.call_args.kwargs["action"], "delete")
+        self.assertEqual(handler.call_args.kwargs["recipe_ids"], {recipe.id})
+
+    def test_bulk_delete_ingredients(self):
+        """test deleting ingredients clears them from recipes and postings"""
+        salt = Ingredient.objects.using(self.shard).create(
+            user=self.user,
+            name="Salt",
+        )
+        pepper = Ingredient.objects.using(self.shard).create(
+            user=self.user,
+            name="Pepper",
+        )
+        recipe = self.create_recipe(ingredients=[salt, pepper])
+
+        self.client.post(
+            DELETE_INGREDIENTS_URL,
+            {"ids": [salt.id]},
+            format="json",
+        )
+
+        self.assertEqual(list(recipe.ingredients.all()), [pepper])
+        recipe_ids, totals = pantry.unpack(
+            IngredientPosting.objects.using(self.shard).get(ingredient=pepper),
+        )
+        self.assertEqual(totals.tolist(), [1])
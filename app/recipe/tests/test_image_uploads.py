@@ -0,0 +1,197 @@
+"""
+Tests for resumable recipe image uploads
+"""
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import ImageUpload, Recipe
+from core.sharding import shard_for_user
+
+
+def uploads_url(recipe_id):
+    """create and return the URL starting an upload"""
+    return reverse("recipe:recipe-image-upload-list", args=[recipe_id])
+
+
+def upload_url(recipe_id, upload_id):
+    """create and return the URL of an upload"""
+    return reverse(
+        "recipe:recipe-image-upload-detail",
+        args=[recipe_id, upload_id],
+    )
+
+
+def finalize_url(recipe_id, upload_id):
+    """create and return the URL finalizing an upload"""
+    return reverse(
+        "recipe:recipe-image-upload-finalize",
+        args=[recipe_id, upload_id],
+    )
+
+
+class ResumableUploadTests(TestCase):
+    """Test uploading recipe images in byte ranges"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.upload_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            UPLOAD_TEMP_ROOT=self.upload_root,
+        )
+        self.settings_override.enable()
+
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+        self.recipe = Recipe.objects.using(self.shard).create(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        buf = io.BytesIO()
+        Image.new("RGB", (10, 10)).save(buf, format="PNG")
+        self.content = buf.getvalue()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        shutil.rmtree(self.upload_root)
+
+    def start_upload(self, size=None):
+        res = self.client.post(
+            uploads_url(self.recipe.id),
+            {"size": size or len(self.content), "filename": "photo.png"},
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data["id"]
+
+    def put_chunk(self, upload_id, start, end):
+        return self.client.generic(
+            "PUT",
+            upload_url(self.recipe.id, upload_id),
+            self.content[start:end + 1],
+            content_type="application/offset+octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(self.content)}",
+        )
+
+    def test_upload_in_chunks(self):
+        """test chunks are appended and finalize attaches the image"""
+        upload_id = self.start_upload()
+        middle = len(self.content) // 2
+
+        res = self.put_chunk(upload_id, 0, middle - 1)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["offset"], middle)
+
+        res = self.client.get(upload_url(self.recipe.id, upload_id))
+        self.assertEqual(res.data["offset"], middle)
+
+        self.put_chunk(upload_id, middle, len(self.content) - 1)
+        res = self.client.post(finalize_url(self.recipe.id, upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith(".png"))
+        with self.recipe.image.open("rb") as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(ImageUpload.objects.using(self.shard).exists())
+
+    def test_chunk_at_wrong_offset_conflict(self):
+        """test a chunk not starting at the offset is refused"""
+        upload_id = self.start_upload()
+
+        res = self.put_chunk(upload_id, 5, 9)
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data["offset"], 0)
+
+    def test_finalize_incomplete_conflict(self):
+        """test finalizing before all bytes arrived is refused"""
+        upload_id = self.start_upload()
+        self.put_chunk(upload_id, 0, 9)
+
+        res = self.client.post(finalize_url(self.recipe.id, upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data["offset"], 10)
+
+    @override_settings(UPLOAD_MAX_SIZE=100)
+    def test_upload_too_large(self):
+        """test uploads over the size limit are refused"""
+        res = self.client.post(uploads_url(self.recipe.id), {"size": 101})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_other_users_recipe(self):
+        """test uploads can't be started on another user's recipe"""
+        other = get_user_model().objects.create_user(
+            "other@example.com",
+            "testpass123",
+        )
+        recipe = Recipe.objects.using(shard_for_user(other)).create(
+            user=other,
+            title="Other recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+
+        res = self.client.post(uploads_url(recipe.id), {"size": 10})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cancel_upload(self):
+        """test deleting an upload drops it and its bytes"""
+        upload_id = self.start_upload()
+        self.put_chunk(upload_id, 0, 9)
+
+        res = self.client.delete(upload_url(self.recipe.id, upload_id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(ImageUpload.objects.using(self.shard).exists())
+        self.assertEqual(os.listdir(self.upload_root), [])
+
+    @override_settings(UPLOAD_MAX_OPEN=2)
+    def test_open_uploads_limited(self):
+        """test a user can't start more uploads than the limit"""
+        self.start_upload()
+        upload_id = self.start_upload()
+
+        res = self.client.post(uploads_url(self.recipe.id), {"size": 10})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.delete(upload_url(self.recipe.id, upload_id))
+        self.start_upload()
+
+    @override_settings(UPLOAD_MAX_OPEN=1)
+    def test_expired_uploads_not_counted(self):
+        """test expired uploads neither count nor accept chunks"""
+        upload_id = self.start_upload()
+        ImageUpload.objects.using(self.shard).update(
+            created_at=timezone.now() - timedelta(days=2),
+        )
+
+        res = self.put_chunk(upload_id, 0, 9)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.start_upload()
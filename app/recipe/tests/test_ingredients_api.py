@@ -45,6 +45,8 @@ class PublicIngredientApiTest(TestCase):
 class PrivateIngredientApiTests(TestCase):
     """Test authed api reqs"""
 
+    databases = "__all__"
+
     def setUp(self):
         self.client = APIClient()
         self.user = create_user()
@@ -57,7 +59,8 @@ class PrivateIngredientApiTests(TestCase):
 
         res = self.client.get(INGREDIENTS_URL)
 
-        ingredients = Ingredient.objects.all().order_by("-name")
+        ingredients = Ingredient.objects.filter(user=self.user)
+        ingredients = ingredients.order_by("-name")
         serializer = IngredientSerializer(ingredients, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
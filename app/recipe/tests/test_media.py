@@ -0,0 +1,105 @@
+"""
+Tests for serving recipe images to their owners
+"""
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.sharding import shard_for_user
+
+
+def media_url(name):
+    """create and return the URL of a media file"""
+    return reverse("media", args=[name])
+
+
+class RecipeMediaTests(TestCase):
+    """Test the authenticated media view"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+        self.recipe = Recipe.objects.using(self.shard).create(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        self.recipe.image.save("image.jpg", ContentFile(b"image bytes"))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_image_url_points_to_view(self):
+        """test image URLs go through the authenticated view"""
+        self.assertEqual(
+            self.recipe.image.url,
+            media_url(self.recipe.image.name),
+        )
+
+    def test_owner_gets_image(self):
+        """test the recipe owner can fetch the image"""
+        res = self.client.get(self.recipe.image.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(res.streaming_content), b"image bytes")
+
+    def test_owner_not_modified(self):
+        """test conditional requests are answered with a 304"""
+        res = self.client.get(
+            self.recipe.image.url,
+            HTTP_IF_MODIFIED_SINCE=http_date(),
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(X_ACCEL_REDIRECT=True)
+    def test_owner_x_accel_redirect(self):
+        """test nginx is asked to send the file"""
+        res = self.client.get(self.recipe.image.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "image/jpeg")
+        self.assertEqual(
+            res["X-Accel-Redirect"],
+            f"/internal/media/{self.recipe.image.name}",
+        )
+
+    def test_other_user_not_found(self):
+        """test other users can't fetch the image"""
+        other = get_user_model().objects.create_user(
+            "other@example.com",
+            "testpass123",
+        )
+        self.client.force_authenticate(other)
+
+        res = self.client.get(self.recipe.image.url)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_auth_required(self):
+        """test anonymous requests are refused"""
+        res = APIClient().get(self.recipe.image.url)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,228 @@
+"""
+Tests for matching recipes against a pantry
+"""
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, IngredientPosting, Recipe
+from core.sharding import shard_for_user
+from recipe import pantry
+
+PANTRY_URL = reverse("recipe:recipe-pantry")
+
+
+def posting_recipes(ingredient):
+    """return {recipe_id: total} held in an ingredient's posting"""
+    held = {}
+    for posting in IngredientPosting.objects.using(
+        ingredient._state.db,
+    ).filter(ingredient=ingredient):
+        recipe_ids, totals = pantry.unpack(posting)
+        held.update(zip(recipe_ids.tolist(), totals.tolist()))
+    return held
+
+
+class PantryIndexTests(TestCase):
+    """Test keeping ingredient postings up to date"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+        self.eggs, self.flour, self.milk, self.salt = [
+            Ingredient.objects.using(self.shard).create(
+                user=self.user,
+                name=name,
+            )
+            for name in ["Eggs", "Flour", "Milk", "Salt"]
+        ]
+
+    def create_recipe(self, *ingredients, **fields):
+        recipe = Recipe.objects.using(self.shard).create(
+            **fields,
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def test_postings_follow_changes(self):
+        """test adding and removing ingredients updates the postings"""
+        recipe = self.create_recipe(self.eggs, self.flour)
+        self.assertEqual(posting_recipes(self.eggs), {recipe.id: 2})
+
+        recipe.ingredients.add(self.milk)
+        self.assertEqual(posting_recipes(self.eggs), {recipe.id: 3})
+
+        recipe.ingredients.remove(self.eggs)
+        self.assertEqual(posting_recipes(self.eggs), {})
+        self.assertEqual(posting_recipes(self.milk), {recipe.id: 2})
+
+        self.salt.recipe_set.add(recipe)
+        self.assertEqual(posting_recipes(self.flour), {recipe.id: 3})
+
+    def test_postings_after_deletes(self):
+        """test deleted recipes and ingredients leave the postings"""
+        recipe = self.create_recipe(self.eggs, self.flour)
+        other = self.create_recipe(self.eggs)
+
+        self.flour.delete()
+        self.assertEqual(
+            posting_recipes(self.eggs),
+            {recipe.id: 1, other.id: 1},
+        )
+
+        recipe.delete()
+        self.assertEqual(posting_recipes(self.eggs), {other.id: 1})
+
+    def test_edit_rewrites_own_segment(self):
+        """test an edit only touches the segments holding the recipe"""
+        recipe = self.create_recipe(self.eggs, self.flour)
+        far = self.create_recipe(
+            self.eggs,
+            id=recipe.id + (1 << pantry.SEGMENT_BITS),
+        )
+        postings = IngredientPosting.objects.using(self.shard)
+        self.assertEqual(postings.filter(ingredient=self.eggs).count(), 2)
+
+        with patch.object(
+            pantry,
+            "_postings",
+            wraps=pantry._postings,
+        ) as locked:
+            far.ingredients.set([self.milk])
+
+        self.assertEqual(
+            {key for call in locked.call_args_list for key in call.args[0]},
+            {
+                (self.eggs.id, pantry.segment_of(far.id)),
+                (self.milk.id, pantry.segment_of(far.id)),
+            },
+        )
+        self.assertEqual(posting_recipes(self.eggs), {recipe.id: 2})
+        self.assertEqual(postings.filter(ingredient=self.eggs).count(), 1)
+        self.assertEqual(posting_recipes(self.milk), {far.id: 1})
+
+    def test_pantry_ranked_by_missing(self):
+        """test recipes missing fewest ingredients come first"""
+        full = self.create_recipe(self.eggs, self.flour)
+        one_short = self.create_recipe(self.eggs, self.flour, self.milk)
+        far = self.create_recipe(self.eggs, self.milk, self.salt)
+        self.create_recipe(self.salt)
+
+        res = self.client.get(
+            PANTRY_URL,
+            {"ingredients": f"{self.eggs.id},{self.flour.id}"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["count"], 3)
+        self.assertEqual(
+            [
+                (item["id"], item["matched"], item["missing"])
+                for item in res.data["results"]
+            ],
+            [(full.id, 2, 0), (one_short.id, 2, 1), (far.id, 1, 2)],
+        )
+        self.assertEqual(res.data["results"][1]["coverage"], 0.6667)
+
+    def test_pantry_max_missing_and_pages(self):
+        """test max_missing filters and results are paginated"""
+        recipes = [self.create_recipe(self.eggs) for _ in range(3)]
+        self.create_recipe(self.eggs, self.milk)
+
+        res = self.client.get(
+            PANTRY_URL,
+            {"ingredients": self.eggs.id, "max_missing": 0, "page_size": 2},
+        )
+
+        self.assertEqual(res.data["count"], 3)
+        self.assertEqual(
+            [item["id"] for item in res.data["results"]],
+            [recipes[2].id, recipes[1].id],
+        )
+        self.assertIsNotNone(res.data["next"])
+
+    def test_pantry_ignores_other_users(self):
+        """test other users' ingredients don't match anything"""
+        other = get_user_model().objects.create_user(
+            "other@example.com",
+            "testpass123",
+        )
+        shard = shard_for_user(other)
+        ingredient = Ingredient.objects.using(shard).create(
+            user=other,
+            name="Eggs",
+        )
+        recipe = Recipe.objects.using(shard).create(
+            user=other,
+            title="Other recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        recipe.ingredients.add(ingredient)
+
+        res = self.client.get(PANTRY_URL, {"ingredients": ingredient.id})
+
+        self.assertEqual(res.data["count"], 0)
+
+    def test_pantry_requires_ingredients(self):
+        """test the pantry must be given"""
+        res = self.client.get(PANTRY_URL, {"ingredients": "eggs"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PantryScoreTests(SimpleTestCase):
+    """Test scoring recipes against postings"""
+
+    postings = [
+        (np.array([1, 5, 9]), np.array([1, 2, 3])),
+        (np.array([5, 9]), np.array([2, 3])),
+    ]
+
+    def test_score_dense_and_sparse(self):
+        """test both counting strategies rank alike"""
+        dense = pantry.score(self.postings, max_missing=1)
+        with patch.object(pantry, "DENSE_SPAN_FACTOR", 0):
+            sparse = pantry.score(self.postings, max_missing=1)
+
+        for result in (dense, sparse):
+            self.assertEqual(
+                [array.tolist() for array in result],
+                [[5, 1, 9], [2, 1, 2], [0, 0, 1]],
+            )
+
+    def test_benchmark_command(self):
+        """test the benchmark runs on a small library"""
+        out = StringIO()
+
+        call_command(
+            "benchmark_pantry",
+            "--recipes", "200",
+            "--ingredients", "50",
+            "--repeat", "2",
+            "--naive",
+            stdout=out,
+        )
+
+        self.assertIn("score: p50", out.getvalue())
+        self.assertIn("naive:", out.getvalue())
@@ -8,19 +8,24 @@ from PIL import Image
 
 from decimal import Decimal
 from django.contrib.auth import get_user_model
+from django.db import connections
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Recipe, Tag, Ingredient
+from core.sharding import next_id, shard_for_user
 
 from recipe.serializers import (
+    RecipeFilterSerializer,
     RecipeSerializer,
     RecipeDetailSerializer,
 )
 
 RECIPES_URL = reverse("recipe:recipe-list")
+BULK_DELETE_URL = reverse("recipe:recipe-bulk-delete")
 
 
 def image_upload_url(recipe_id):
@@ -70,12 +75,15 @@ class PublicRecipeAPITests(TestCase):
 class PrivateRecipeAPITests(TestCase):
     """Test authed api reqs"""
 
+    databases = "__all__"
+
     def setUp(self):
         self.client = APIClient()
         self.user = create_user(
             email="user@example.com",
             password="testpass123",
         )
+        self.shard = shard_for_user(self.user)
         self.client.force_authenticate(self.user)
 
     def test_retrieve_recipes(self):
@@ -86,7 +94,7 @@ class PrivateRecipeAPITests(TestCase):
 
         res = self.client.get(RECIPES_URL)
 
-        recipes = Recipe.objects.all().order_by("-id")
+        recipes = Recipe.objects.filter(user=self.user).order_by("-id")
 
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -131,7 +139,7 @@ class PrivateRecipeAPITests(TestCase):
         res = self.client.post(RECIPES_URL, payload)
 
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
-        recipe = Recipe.objects.get(id=res.data["id"])
+        recipe = Recipe.objects.get(user=self.user, id=res.data["id"])
         for k, v in payload.items():
             self.assertEqual(getattr(recipe, k), v)
         self.assertEqual(recipe.user, self.user)
@@ -226,6 +234,39 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
         self.assertTrue(Recipe.objects.filter(id=recipe.id).exists)
 
+    def test_bulk_delete_recipes(self):
+        """test deleting many recipes in one request"""
+        recipes = [create_recipe(user=self.user) for _ in range(3)]
+
+        res = self.client.post(
+            BULK_DELETE_URL,
+            {"ids": [recipes[0].id, recipes[1].id]},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        recipes_left = Recipe.objects.filter(user=self.user)
+        self.assertEqual(
+            list(recipes_left.values_list("id", flat=True)),
+            [recipes[2].id],
+        )
+
+    def test_bulk_delete_other_users_recipe_error(self):
+        """test bulk delete refuses recipes of other users"""
+        recipe = create_recipe(user=self.user)
+        other_user = create_user(email="other@example.com", password="pass123")
+        other = create_recipe(user=other_user)
+
+        res = self.client.post(
+            BULK_DELETE_URL,
+            {"ids": [recipe.id, other.id]},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Recipe.objects.filter(user=self.user).exists())
+        self.assertTrue(Recipe.objects.filter(user=other_user).exists())
+
     def test_create_recipe_with_new_tags(self):
         """test creating a recipe with new tags"""
         payload = {
@@ -281,6 +322,27 @@ class PrivateRecipeAPITests(TestCase):
             ).exists()
             self.assertTrue(exists)
 
+    def test_existing_tags_looked_up_at_once(self):
+        """test queries don't grow with the number of existing tags"""
+
+        def create_with_tags(count):
+            names = [f"Tag {count}-{i}" for i in range(count)]
+            for name in names:
+                Tag.objects.create(user=self.user, name=name)
+            payload = {
+                "title": "Pongal",
+                "time_minutes": 60,
+                "price": Decimal("4.50"),
+                "tags": [{"name": name} for name in names + names[:1]],
+            }
+            with CaptureQueriesContext(connections[self.shard]) as ctx:
+                res = self.client.post(RECIPES_URL, payload, format="json")
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(res.data["tags"]), count)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(create_with_tags(2), create_with_tags(6))
+
     def test_create_tag_on_update(self):
         """test create tag when updating a recipe"""
 
@@ -463,6 +525,140 @@ class PrivateRecipeAPITests(TestCase):
         self.assertIn(s2.data, res.data)
         self.assertNotIn(s3.data, res.data)
 
+    def test_filter_by_time_and_price_range(self):
+        """test filtering recipes by cooking time and price bounds"""
+        quick_cheap = create_recipe(
+            user=self.user,
+            time_minutes=10,
+            price=Decimal("4.99"),
+        )
+        create_recipe(user=self.user, time_minutes=45, price=Decimal("4.99"))
+        create_recipe(user=self.user, time_minutes=10, price=Decimal("12.00"))
+
+        res = self.client.get(
+            RECIPES_URL,
+            {"max_time": 30, "max_price": "10", "min_price": "4.99"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["id"] for r in res.data], [quick_cheap.id])
+
+    def test_ordering(self):
+        """test ordering recipes by a whitelisted field, ties by id"""
+        r1 = create_recipe(user=self.user, price=Decimal("3.00"))
+        r2 = create_recipe(user=self.user, price=Decimal("1.50"))
+        r3 = create_recipe(user=self.user, price=Decimal("3.00"))
+
+        res = self.client.get(RECIPES_URL, {"ordering": "price"})
+        self.assertEqual([r["id"] for r in res.data], [r2.id, r1.id, r3.id])
+
+        res = self.client.get(RECIPES_URL, {"ordering": "-price"})
+        self.assertEqual([r["id"] for r in res.data], [r3.id, r1.id, r2.id])
+
+    def test_orderings_indexed(self):
+        """test every ordering is backed by an index of the user's rows"""
+        indexed = [index.fields for index in Recipe._meta.indexes]
+        for name in RecipeFilterSerializer.ORDERING_FIELDS:
+            fields = RecipeFilterSerializer().validate_ordering(name)
+            self.assertIn(["user", *fields], indexed)
+
+    def test_invalid_ordering_and_range_error(self):
+        """test unknown orderings and malformed bounds are refused"""
+        for params in [
+            {"ordering": "description"},
+            {"max_time": "soon"},
+            {"min_price": "cheap"},
+        ]:
+            res = self.client.get(RECIPES_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pagination(self):
+        """test paging through a filtered, sorted list by cursor"""
+        recipes = [
+            create_recipe(user=self.user, time_minutes=minutes)
+            for minutes in [5, 20, 5, 15, 60]
+        ]
+        expected = [recipes[i].id for i in [0, 2, 3, 1]]
+
+        ids = []
+        res = self.client.get(
+            RECIPES_URL,
+            {"ordering": "time", "max_time": 30, "page_size": 3},
+        )
+        ids += [r["id"] for r in res.data["results"]]
+        self.assertEqual(len(ids), 3)
+        res = self.client.get(res.data["next"])
+        ids += [r["id"] for r in res.data["results"]]
+
+        self.assertEqual(ids, expected)
+        self.assertIsNone(res.data["next"])
+
+    def test_cursor_pagination_many_ties(self):
+        """test cursors page through more ties than an offset can skip"""
+        Recipe.objects.using(self.shard).bulk_create(
+            [
+                Recipe(
+                    id=next_id(),
+                    user=self.user,
+                    title="Sample recipe",
+                    time_minutes=30,
+                    price=Decimal("5.25"),
+                )
+                for _ in range(1300)
+            ]
+        )
+        create_recipe(user=self.user, time_minutes=10)
+        create_recipe(user=self.user, time_minutes=45)
+        expected = list(
+            Recipe.objects.filter(user=self.user)
+            .order_by("time_minutes", "id")
+            .values_list("id", flat=True)
+        )
+
+        ids = []
+        pages = []
+        url, params = RECIPES_URL, {"ordering": "time", "page_size": 100}
+        while url and len(pages) <= 20:
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            pages.append(res.data)
+            ids += [r["id"] for r in res.data["results"]]
+            url, params = res.data["next"], None
+
+        self.assertEqual(len(pages), 14)
+        self.assertEqual(ids, expected)
+        res = self.client.get(pages[-1]["previous"])
+        self.assertEqual(res.data["results"], pages[-2]["results"])
+
+    def test_distinct_only_with_joins(self):
+        """test recipes are de-duplicated only when filtered through joins"""
+        recipe = create_recipe(user=self.user)
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ["Vegan", "Quick"]
+        ]
+        recipe.tags.add(*tags)
+
+        with CaptureQueriesContext(connections[self.shard]) as ctx:
+            res = self.client.get(RECIPES_URL, {"ordering": "time"})
+        self.assertEqual(len(res.data), 1)
+        self.assertNotIn("DISTINCT", ctx.captured_queries[0]["sql"])
+
+        res = self.client.get(
+            RECIPES_URL,
+            {"tags": ",".join(str(tag.id) for tag in tags)},
+        )
+        self.assertEqual([r["id"] for r in res.data], [recipe.id])
+
+    def test_invalid_cursor_error(self):
+        """test a cursor that doesn't fit the ordering is refused"""
+        res = self.client.get(
+            RECIPES_URL,
+            {"ordering": "time", "cursor": "cD0lNUIlMjJ4JTIyJTVE"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_filter_by_ingredients(self):
         """Test filtering recipe by ingredients"""
         r1 = create_recipe(user=self.user, title="Thai Veg Curry")
@@ -488,10 +684,75 @@ class PrivateRecipeAPITests(TestCase):
         self.assertIn(s2.data, res.data)
         self.assertNotIn(s3.data, res.data)
 
+    def test_multi_get_by_ids(self):
+        """Test fetching the details of several recipes at once"""
+        r1 = create_recipe(user=self.user)
+        r2 = create_recipe(user=self.user)
+        create_recipe(user=self.user)
+        other = create_user(email="other@example.com", password="test123")
+        r4 = create_recipe(user=other)
+
+        res = self.client.get(
+            RECIPES_URL,
+            {"ids": f"{r1.id},{r2.id},{r4.id}"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        serializer = RecipeDetailSerializer([r2, r1], many=True)
+        self.assertEqual(res.data, serializer.data)
+
+    def test_multi_get_bad_ids(self):
+        """Test non numeric ids are refused"""
+        res = self.client.get(RECIPES_URL, {"ids": "1,two"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sparse_fields(self):
+        """Test only the requested fields are loaded and returned"""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name="Vegan"))
+
+        with self.assertNumQueries(1, using=self.shard) as ctx:
+            res = self.client.get(
+                detail_url(recipe.id),
+                {"fields": "title,price"},
+            )
+
+        self.assertEqual(
+            res.data,
+            {"id": recipe.id, "title": recipe.title, "price": "5.25"},
+        )
+        self.assertNotIn("description", ctx.captured_queries[0]["sql"])
+
+    def test_sparse_exclude(self):
+        """Test excluded fields and their relations are skipped"""
+        recipe = create_recipe(user=self.user)
+        recipe.ingredients.add(
+            Ingredient.objects.create(user=self.user, name="Salt"),
+        )
+
+        with self.assertNumQueries(2, using=self.shard):
+            res = self.client.get(
+                RECIPES_URL,
+                {"ids": recipe.id, "exclude": "description,tags"},
+            )
+
+        self.assertNotIn("description", res.data[0])
+        self.assertNotIn("tags", res.data[0])
+        self.assertEqual(res.data[0]["ingredients"][0]["name"], "Salt")
+
+    def test_sparse_unknown_field(self):
+        """Test asking for a field that doesn't exist is refused"""
+        res = self.client.get(RECIPES_URL, {"fields": "title,secret"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class ImageUploadTests(TestCase):
     """tests for image upload api"""
 
+    databases = "__all__"
+
     def setUp(self):
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
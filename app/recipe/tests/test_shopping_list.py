@@ -0,0 +1,113 @@
+"""
+Tests for the shopping list API
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe
+from core.sharding import shard_for_user
+
+SHOPPING_LIST_URL = reverse("recipe:shopping-list")
+
+
+class ShoppingListTests(TestCase):
+    """Test merging the ingredients of several recipes"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+        self.eggs, self.flour, self.milk = [
+            Ingredient.objects.using(self.shard).create(
+                user=self.user,
+                name=name,
+            )
+            for name in ["Eggs", "Flour", "Milk"]
+        ]
+
+    def create_recipe(self, *ingredients, user=None):
+        user = user or self.user
+        recipe = Recipe.objects.using(shard_for_user(user)).create(
+            user=user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def test_ingredients_merged(self):
+        """test shared ingredients are listed once and counted"""
+        pancakes = self.create_recipe(self.eggs, self.flour, self.milk)
+        omelette = self.create_recipe(self.eggs, self.milk)
+
+        with self.assertNumQueries(2, using=self.shard):
+            res = self.client.post(
+                SHOPPING_LIST_URL,
+                {"recipes": [pancakes.id, omelette.id]},
+                format="json",
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["recipes"], [pancakes.id, omelette.id])
+        self.assertEqual(
+            [dict(item) for item in res.data["items"]],
+            [
+                {"id": self.eggs.id, "name": "Eggs", "count": 2},
+                {"id": self.flour.id, "name": "Flour", "count": 1},
+                {"id": self.milk.id, "name": "Milk", "count": 2},
+            ],
+        )
+
+    def test_repeated_recipe_counted_again(self):
+        """test a recipe planned twice counts its ingredients twice"""
+        pancakes = self.create_recipe(self.eggs, self.flour)
+        omelette = self.create_recipe(self.eggs)
+
+        res = self.client.post(
+            SHOPPING_LIST_URL,
+            {"recipes": [pancakes.id, pancakes.id, omelette.id]},
+            format="json",
+        )
+
+        counts = {item["name"]: item["count"] for item in res.data["items"]}
+        self.assertEqual(counts, {"Eggs": 3, "Flour": 2})
+
+    def test_other_users_recipe_refused(self):
+        """test the list can't include another user's recipes"""
+        other = get_user_model().objects.create_user(
+            "other@example.com",
+            "testpass123",
+        )
+        recipe = self.create_recipe(self.eggs)
+        foreign = self.create_recipe(user=other)
+
+        res = self.client.post(
+            SHOPPING_LIST_URL,
+            {"recipes": [recipe.id, foreign.id]},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(foreign.id), str(res.data["recipes"]))
+
+    def test_recipes_required(self):
+        """test an empty list is refused"""
+        res = self.client.post(
+            SHOPPING_LIST_URL,
+            {"recipes": []},
+            format="json",
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
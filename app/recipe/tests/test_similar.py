@@ -0,0 +1,174 @@
+"""
+Tests for the similar recipes API
+"""
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import (
+    Ingredient,
+    Recipe,
+    RecipeSignature,
+    Tag,
+    UserShard,
+)
+from core.sharding import shard_for_user
+from recipe import similarity
+
+
+def similar_url(recipe_id):
+    """create and return the similar recipes URL"""
+    return reverse("recipe:recipe-similar", args=[recipe_id])
+
+
+class SimilarRecipesTests(TestCase):
+    """Test finding recipes like another"""
+
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+        self.ingredients = [
+            Ingredient.objects.using(self.shard).create(
+                user=self.user,
+                name=f"Ingredient {i}",
+            )
+            for i in range(8)
+        ]
+        self.tag = Tag.objects.using(self.shard).create(
+            user=self.user,
+            name="Dinner",
+        )
+
+    def create_recipe(self, ingredients, user=None, **params):
+        user = user or self.user
+        recipe = Recipe.objects.using(shard_for_user(user)).create(
+            user=user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+            **params,
+        )
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def minhashes(self, recipe):
+        signatures = RecipeSignature.objects.using(self.shard)
+        return signatures.get(recipe=recipe).minhashes
+
+    def test_signature_updated_on_change(self):
+        """test signatures follow changes to ingredients and tags"""
+        recipe = self.create_recipe(self.ingredients[:3])
+        before = self.minhashes(recipe)
+
+        recipe.tags.add(self.tag)
+        after = self.minhashes(recipe)
+
+        self.assertNotEqual(bytes(before), bytes(after))
+        self.assertEqual(
+            len(similarity.unpack(after)),
+            similarity.NUM_HASHES,
+        )
+
+    def test_similar_ranked_by_jaccard(self):
+        """test the closest recipes come first with exact similarity"""
+        recipe = self.create_recipe(self.ingredients[:4])
+        same = self.create_recipe(self.ingredients[:4])
+        close = self.create_recipe(self.ingredients[:3])
+        self.create_recipe(self.ingredients[5:])
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data[0]["id"], same.id)
+        self.assertEqual(res.data[0]["similarity"], 1.0)
+        ids = [item["id"] for item in res.data]
+        self.assertIn(close.id, ids)
+        self.assertNotIn(recipe.id, ids)
+
+    def test_similar_limited_to_k(self):
+        """test at most k recipes are returned"""
+        recipe = self.create_recipe(self.ingredients[:4])
+        for _ in range(3):
+            self.create_recipe(self.ingredients[:4])
+
+        res = self.client.get(similar_url(recipe.id), {"k": 2})
+
+        self.assertEqual(len(res.data), 2)
+
+    def test_similar_excludes_other_users(self):
+        """test other users' recipes are never suggested"""
+        other = get_user_model().objects.create_user(
+            "other@example.com",
+            "testpass123",
+        )
+        UserShard.objects.create(user=other, alias=self.shard)
+        recipe = self.create_recipe(self.ingredients[:4])
+        self.create_recipe(self.ingredients[:4], user=other)
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.data, [])
+
+    def test_reverse_clear_updates_recipes(self):
+        """test clearing an ingredient's recipes updates their buckets"""
+        recipe = self.create_recipe(self.ingredients[:1])
+        other = self.create_recipe(self.ingredients[:1])
+
+        self.ingredients[0].recipe_set.clear()
+
+        self.assertEqual(
+            similarity.similar_recipes(recipe, 10, self.shard),
+            [],
+        )
+        self.assertFalse(other.buckets.exists())
+
+    def test_deleted_attr_updates_recipes(self):
+        """test deleting a recipe's only tag or ingredient updates it"""
+        recipe = self.create_recipe(self.ingredients[:1])
+        recipe.tags.add(self.tag)
+        before = self.minhashes(recipe)
+
+        self.tag.delete()
+        self.assertNotEqual(
+            bytes(self.minhashes(recipe)),
+            bytes(before),
+        )
+
+        self.ingredients[0].delete()
+        self.assertFalse(recipe.buckets.exists())
+
+    def test_candidates_narrowed_by_signature(self):
+        """test large candidate sets are cut down before verification"""
+        recipe = self.create_recipe(self.ingredients[:4])
+        same = self.create_recipe(self.ingredients[:4])
+        for _ in range(3):
+            self.create_recipe(self.ingredients[:3])
+
+        with patch.object(similarity, "MAX_VERIFIED", 1):
+            ranked = similarity.similar_recipes(recipe, 10, self.shard)
+
+        self.assertEqual(ranked, [(same.id, 1.0)])
+
+    def test_rebuild_command(self):
+        """test the index can be rebuilt for existing recipes"""
+        recipe = self.create_recipe(self.ingredients[:2])
+        RecipeSignature.objects.using(self.shard).delete()
+
+        call_command("rebuild_recipe_signatures", stdout=StringIO())
+
+        signatures = RecipeSignature.objects.using(self.shard)
+        self.assertTrue(signatures.filter(recipe=recipe).exists())
@@ -43,6 +43,8 @@ class PublicTagsApiTest(TestCase):
 class PrivateTagsApiTest(TestCase):
     """test authed api reqs"""
 
+    databases = "__all__"
+
     def setUp(self):
         self.client = APIClient()
         self.user = create_user()
@@ -56,7 +58,7 @@ class PrivateTagsApiTest(TestCase):
 
         res = self.client.get(TAGS_URL)
 
-        tags = Tag.objects.all().order_by("-name")
+        tags = Tag.objects.filter(user=self.user).order_by("-name")
         serializer = TagSerializer(tags, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
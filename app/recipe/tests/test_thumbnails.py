@@ -0,0 +1,169 @@
+"""
+Tests for recipe image thumbnails
+"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.sharding import shard_for_user
+from recipe import thumbnails
+
+
+def thumbnail_url(recipe_id):
+    """create and return a recipe thumbnail URL"""
+    return reverse("recipe:recipe-image", args=[recipe_id])
+
+
+def jpeg_bytes(size=(400, 200)):
+    """return a sample JPEG image"""
+    buf = io.BytesIO()
+    Image.new("RGB", size, "red").save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+class ThumbnailTestCase(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.thumbnail_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            THUMBNAIL_ROOT=self.thumbnail_root,
+        )
+        self.settings_override.enable()
+
+        self.user = get_user_model().objects.create_user(
+            "user@example.com",
+            "testpass123",
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shard = shard_for_user(self.user)
+        self.recipe = Recipe.objects.using(self.shard).create(
+            user=self.user,
+            title="Sample recipe",
+            time_minutes=5,
+            price=Decimal("1.00"),
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        shutil.rmtree(self.thumbnail_root)
+
+    def attach_image(self, content=None):
+        content = ContentFile(content or jpeg_bytes())
+        self.recipe.image.save("image.jpg", content)
+
+
+class ThumbnailApiTests(ThumbnailTestCase):
+    """Test the recipe thumbnail endpoint"""
+
+    def test_thumbnail_resized(self):
+        """test the image is resized to the requested width and format"""
+        self.attach_image()
+
+        res = self.client.get(
+            thumbnail_url(self.recipe.id),
+            {"w": 64, "fmt": "webp"},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res["Content-Type"], "image/webp")
+        img = Image.open(io.BytesIO(b"".join(res.streaming_content)))
+        self.assertEqual(img.format, "WEBP")
+        self.assertEqual(img.size, (64, 32))
+
+    @override_settings(X_ACCEL_REDIRECT=True)
+    def test_thumbnail_x_accel_redirect(self):
+        """test nginx is asked to send the cached rendition"""
+        self.attach_image()
+
+        res = self.client.get(thumbnail_url(self.recipe.id), {"w": 128})
+
+        name = thumbnails.cache_name(self.recipe.image.name, 128, "jpeg")
+        self.assertEqual(
+            res["X-Accel-Redirect"],
+            f"/internal/thumbnails/{name}",
+        )
+        self.assertTrue(
+            os.path.exists(os.path.join(self.thumbnail_root, name)),
+        )
+
+    def test_thumbnail_not_modified(self):
+        """test a matching ETag skips the rendition"""
+        self.attach_image()
+        url = thumbnail_url(self.recipe.id)
+        etag = self.client.get(url)["ETag"]
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_thumbnail_invalid_width(self):
+        """test widths outside the allowed set are refused"""
+        self.attach_image()
+
+        res = self.client.get(thumbnail_url(self.recipe.id), {"w": 300})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_thumbnail_without_image(self):
+        """test a recipe without image gives a 404"""
+        res = self.client.get(thumbnail_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ThumbnailCacheTests(ThumbnailTestCase):
+    """Test the thumbnail disk cache"""
+
+    def test_concurrent_misses_render_once(self):
+        """test concurrent requests for one rendition render it once"""
+        self.attach_image()
+        render = thumbnails.render
+
+        with patch("recipe.thumbnails.render", wraps=render) as mock_render:
+            threads = [
+                threading.Thread(
+                    target=thumbnails.get_thumbnail,
+                    args=(self.recipe.image, 64, "png"),
+                )
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(mock_render.call_count, 1)
+
+    def test_evict_least_recently_used(self):
+        """test eviction removes the oldest renditions first"""
+        self.attach_image()
+        old = thumbnails.get_thumbnail(self.recipe.image, 64, "png")
+        new = thumbnails.get_thumbnail(self.recipe.image, 128, "png")
+        old_path = os.path.join(self.thumbnail_root, old)
+        new_path = os.path.join(self.thumbnail_root, new)
+        os.utime(old_path, (1, 1))
+
+        # evicting frees down to 90% of the budget
+        thumbnails.evict(int(os.path.getsize(new_path) / 0.9) + 1)
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(new_path))
@@ -0,0 +1,131 @@
+"""
+Lazily rendered recipe image thumbnails kept in a bounded disk cache
+"""
+
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from PIL import Image
+
+FORMATS = {
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "png": ("PNG", ".png", "image/png"),
+}
+
+# scanning the cache is O(files), so evict at most this often per process
+EVICT_INTERVAL = 30
+
+_last_eviction = None
+
+
+def cache_key(image_name, width, fmt):
+    """return the key naming a rendition of image_name"""
+    raw = f"{image_name}|{width}|{fmt}".encode()
+    return hashlib.sha256(raw).hexdigest()
+
+
+def cache_name(image_name, width, fmt):
+    """return the rendition's path relative to THUMBNAIL_ROOT"""
+    key = cache_key(image_name, width, fmt)
+    return os.path.join(key[:2], f"{key}{FORMATS[fmt][1]}")
+
+
+def render(source, dest, width, fmt):
+    """resize the image in source to width and write it to dest"""
+    pil_format = FORMATS[fmt][0]
+    with Image.open(source) as img:
+        height = max(1, round(img.height * width / img.width))
+        if img.format == "JPEG":
+            # let the decoder downscale by powers of two while reading
+            img.draft("RGB", (width, height))
+        img.thumbnail((width, height), Image.LANCZOS)
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest))
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                img.save(tmp, format=pil_format)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def get_thumbnail(image, width, fmt):
+    """return the cache name of a rendition, rendering it on a miss
+
+    Concurrent misses for one rendition wait on a file lock so only the
+    first one renders it.
+    """
+    name = cache_name(image.name, width, fmt)
+    path = os.path.join(settings.THUMBNAIL_ROOT, name)
+    if os.path.exists(path):
+        os.utime(path)
+        return name
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_path = f"{path}.lock"
+    with open(lock_path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(path):
+                with image.open("rb") as source:
+                    render(source, path, width, fmt)
+        finally:
+            # late arrivals find the rendition before reaching the lock
+            if os.path.exists(lock_path):
+                os.remove(lock_path)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    maybe_evict()
+    return name
+
+
+def evict(max_bytes):
+    """delete least recently used renditions until under max_bytes"""
+    entries = []
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(settings.THUMBNAIL_ROOT):
+        for filename in filenames:
+            if filename.endswith(".lock"):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+
+    # free a little extra so the next few misses don't evict again
+    target = max_bytes * 0.9
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def maybe_evict():
+    """evict if the last eviction in this process was a while ago"""
+    global _last_eviction
+    now = time.monotonic()
+    if _last_eviction is not None and now - _last_eviction < EVICT_INTERVAL:
+        return
+    _last_eviction = now
+    evict(settings.THUMBNAIL_MAX_BYTES)
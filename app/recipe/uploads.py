@@ -0,0 +1,112 @@
+"""
+Helpers for resumable recipe image uploads
+"""
+
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import ImageUpload
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def parse_content_range(header):
+    """return (start, end, total) from a Content-Range header"""
+    match = CONTENT_RANGE_RE.match(header.strip())
+    if not match:
+        raise ValueError("Expected a header like 'bytes 0-1023/4096'")
+    start, end, total = (int(group) for group in match.groups())
+    if end < start or end >= total:
+        raise ValueError("Range is outside the upload")
+    return start, end, total
+
+
+def expired_before():
+    """return the time uploads started before are expired"""
+    return timezone.now() - timedelta(seconds=settings.UPLOAD_MAX_AGE)
+
+
+def open_uploads(using):
+    """return the uploads on using that haven't expired"""
+    return ImageUpload.objects.using(using).filter(
+        created_at__gte=expired_before(),
+    )
+
+
+def _part_path(upload_id):
+    return os.path.join(settings.UPLOAD_TEMP_ROOT, f"{upload_id}.part")
+
+
+def part_path(upload):
+    """return the path bytes of upload are assembled in"""
+    return _part_path(upload.id)
+
+
+def create_part_file(upload):
+    """create the empty file for a new upload"""
+    os.makedirs(settings.UPLOAD_TEMP_ROOT, exist_ok=True)
+    open(part_path(upload), "wb").close()
+
+
+def write_chunk(upload, start, stream, length):
+    """write length bytes from stream at start, dropping anything after
+
+    Bytes past start are left over from an interrupted chunk whose offset
+    was never recorded, so they are truncated away before writing.
+    """
+    with open(part_path(upload), "r+b") as part:
+        part.seek(start)
+        part.truncate()
+        remaining = length
+        while remaining:
+            chunk = stream.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError("Request body is shorter than its length")
+            part.write(chunk)
+            remaining -= len(chunk)
+
+
+def remove_parts(upload_ids):
+    """delete the assembled bytes of uploads"""
+    for upload_id in upload_ids:
+        try:
+            os.remove(_part_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_parts(live_ids, before):
+    """delete part files not of live_ids and last written before before
+
+    Returns the bytes freed.
+    """
+    freed = 0
+    try:
+        entries = list(os.scandir(settings.UPLOAD_TEMP_ROOT))
+    except FileNotFoundError:
+        return freed
+    for entry in entries:
+        upload_id, ext = os.path.splitext(entry.name)
+        if ext != ".part" or upload_id in live_ids:
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime >= before.timestamp():
+            continue
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+        freed += stat.st_size
+    return freed
+
+
+def discard(upload):
+    """delete the upload and its assembled bytes"""
+    remove_parts([upload.id])
+    upload.delete()
@@ -16,4 +16,9 @@ app_name = "recipe"
 
 urlpatterns = [
     path("", include(router.urls)),
+    path(
+        "shopping-list/",
+        views.ShoppingListView.as_view(),
+        name="shopping-list",
+    ),
 ]
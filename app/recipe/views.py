@@ -1,6 +1,33 @@
 """
 Views for the recipe APIs
 """
+import json
+import mimetypes
+import os
+from collections import Counter
+from contextlib import ExitStack
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Count,
+    IntegerField,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+)
+from django.views.static import serve
 
 from drf_spectacular.utils import (
     extend_schema_view,
@@ -10,22 +37,274 @@ from drf_spectacular.utils import (
 )
 
 from rest_framework import (
+    exceptions,
     viewsets,
     mixins,
     status,
 )
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 
+from core import coalescing, deletion, microcache, sharding
+from core.authentication import CachedTokenAuthentication
 from core.models import (
     Recipe,
     Tag,
     Ingredient,
+    ImageUpload,
+)
+from recipe import (
+    bulk,
+    pantry,
+    serializers,
+    similarity,
+    thumbnails,
+    uploads,
 )
-from recipe import serializers
+
+UPLOAD_ID_PATTERN = r"(?P<upload_id>[0-9a-f]{8}-[0-9a-f-]{27})"
+UPLOAD_ID_PARAMETER = OpenApiParameter(
+    "upload_id",
+    OpenApiTypes.UUID,
+    OpenApiParameter.PATH,
+)
+
+
+class PantryPagination(PageNumberPagination):
+    """page through pantry matches"""
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class RecipeCursorPagination(CursorPagination):
+    """page through recipes in the order the list was asked for
+
+    The time, price and title orderings are each backed by a (user, field,
+    id) index and the id ordering by (user, id), so each page is an index
+    range scan however deep into the list it starts.
+
+    Cursors hold the values of every ordering field of the row a page
+    starts after, so they point at one row however many recipes share the
+    first field. DRF's own cursors keep only the first field and an offset
+    into its ties, which is capped.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        return view.get_ordering()
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for name in ordering:
+            name = name.lstrip("-")
+            if isinstance(instance, dict):
+                values.append(instance[name])
+            else:
+                values.append(getattr(instance, name))
+        return json.dumps([str(value) for value in values])
+
+    def _after(self, position, reverse):
+        """return a filter for the rows past position in the page order
+
+        (f1, f2) > (v1, v2) is spelled f1 >= v1 AND (f1 > v1 OR f2 > v2),
+        so the bound on the leading field starts the index range scan.
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise exceptions.NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise exceptions.NotFound(self.invalid_cursor_message)
+
+        bounds = []
+        for order, value in zip(self.ordering, values):
+            name = order.lstrip("-")
+            # Test for: (cursor reversed) XOR (field descending)
+            lookup = "lt" if reverse != order.startswith("-") else "gt"
+            bounds.append((name, lookup, value))
+
+        name, lookup, value = bounds[-1]
+        after = Q(**{f"{name}__{lookup}": value})
+        for name, lookup, value in reversed(bounds[:-1]):
+            after = Q(**{f"{name}__{lookup}": value}) | (
+                Q(**{name: value}) & after
+            )
+        if len(bounds) > 1:
+            name, lookup, value = bounds[0]
+            after &= Q(**{f"{name}__{lookup}e": value})
+        return after
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(
+                *[
+                    name[1:] if name.startswith("-") else "-" + name
+                    for name in self.ordering
+                ]
+            )
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(
+                    self._after(current_position, reverse),
+                )
+            except (TypeError, ValueError, ValidationError):
+                raise exceptions.NotFound(self.invalid_cursor_message)
+
+        # positions are unique, so offsets are only left in cursors made
+        # before they were
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1],
+                self.ordering,
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class ShardUnavailable(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Your recipes are being moved, try again shortly."
+    default_code = "shard_unavailable"
+
+
+class ShardedViewSetMixin:
+    """route queries to the shard holding the authed user's data"""
+
+    # views whose POSTs only read, like the shopping list, set this
+    read_only = False
+
+    def is_write(self, request):
+        return not self.read_only and request.method not in SAFE_METHODS
+
+    def dispatch(self, request, *args, **kwargs):
+        with ExitStack() as self.locks:
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user_shard = sharding.get_user_shard(request.user)
+        if self.is_write(request):
+            try:
+                self.locks.enter_context(sharding.writing(request.user.pk))
+            except sharding.UserMoving:
+                raise ShardUnavailable()
+            # a move may have begun since the map entry was loaded
+            user_shard.refresh_from_db()
+            if user_shard.is_moving:
+                raise ShardUnavailable()
+        self.shard = user_shard.alias
+
+
+class CoalescedReadMixin:
+    """share the work of identical reads of a user in flight
+
+    Requests coalesce when they are by the same user for the same URL and
+    query params, and no write of that user finished in between.
+    """
+
+    def get_coalesce_key(self, request):
+        user_id = request.user.pk
+        return coalescing.make_key(
+            user_id,
+            coalescing.generation(f"user:{user_id}"),
+            # links in the data are built from the scheme and host
+            request.build_absolute_uri(request.path),
+            sorted(request.query_params.lists()),
+        )
+
+    def coalesce(self, handler, request, *args, **kwargs):
+        """return the response of handler, shared with identical requests"""
+        if getattr(request._request, "batch_transaction", False):
+            # reads inside a batch's transaction may see uncommitted writes
+            return handler(request, *args, **kwargs)
+
+        def compute():
+            response = handler(request, *args, **kwargs)
+            return response.status_code, response.data
+
+        status_code, data = coalescing.run(
+            self.get_coalesce_key(request),
+            compute,
+        )
+        return Response(data, status=status_code)
+
+    def list(self, request, *args, **kwargs):
+        return self.coalesce(super().list, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and request.user.is_authenticated
+        ):
+            coalescing.bump(f"user:{request.user.pk}")
+            microcache.mark_purge(response, request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+SPARSE_FIELDS_PARAMETERS = [
+    OpenApiParameter(
+        "fields",
+        OpenApiTypes.STR,
+        description="Comma separated list of the only fields to return",
+    ),
+    OpenApiParameter(
+        "exclude",
+        OpenApiTypes.STR,
+        description="Comma separated list of fields to leave out",
+    ),
+]
 
 
 @extend_schema_view(
@@ -41,55 +320,271 @@ from recipe import serializers
                 OpenApiTypes.STR,
                 description="Comma separated list of ingredient IDs to filter",
             ),
+            OpenApiParameter(
+                "ids",
+                OpenApiTypes.STR,
+                description=(
+                    "Comma separated list of recipe IDs to return with "
+                    "their details, at most 100"
+                ),
+            ),
+            OpenApiParameter(
+                "min_time",
+                OpenApiTypes.INT,
+                description="Only return recipes taking at least N minutes",
+            ),
+            OpenApiParameter(
+                "max_time",
+                OpenApiTypes.INT,
+                description="Only return recipes taking at most N minutes",
+            ),
+            OpenApiParameter(
+                "min_price",
+                OpenApiTypes.DECIMAL,
+                description="Only return recipes costing at least this",
+            ),
+            OpenApiParameter(
+                "max_price",
+                OpenApiTypes.DECIMAL,
+                description="Only return recipes costing at most this",
+            ),
+            OpenApiParameter(
+                "ordering",
+                OpenApiTypes.STR,
+                description=(
+                    "One of time, price, title or id, prefixed with - to "
+                    "reverse the order; newest first by default"
+                ),
+            ),
+            OpenApiParameter(
+                "page_size",
+                OpenApiTypes.INT,
+                description=(
+                    "Return a page of at most N recipes with next and "
+                    "previous cursor links instead of a plain list"
+                ),
+            ),
+            OpenApiParameter(
+                "cursor",
+                OpenApiTypes.STR,
+                description="Position of a page, taken from a page link",
+            ),
         ]
-    )
+        + SPARSE_FIELDS_PARAMETERS
+    ),
+    retrieve=extend_schema(parameters=SPARSE_FIELDS_PARAMETERS),
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    CoalescedReadMixin,
+    ShardedViewSetMixin,
+    viewsets.ModelViewSet,
+):
     """View for manage recipe APIs"""
 
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
+    # set per action, reads and writes are limited by method otherwise
+    throttle_scope = None
+
+    max_ids = 100
+    relations = ("tags", "ingredients")
+    range_filters = {
+        "min_time": "time_minutes__gte",
+        "max_time": "time_minutes__lte",
+        "min_price": "price__gte",
+        "max_price": "price__lte",
+    }
+
     def _params_to_ints(self, qs):
         """convert a list of strings to integer"""
-        return [int(str_id) for str_id in qs.split(",")]
+        try:
+            return [int(str_id) for str_id in qs.split(",")]
+        except ValueError:
+            raise exceptions.ValidationError("Expected comma separated IDs")
+
+    def _params_to_names(self, param):
+        """return the comma separated names in a query param"""
+        value = self.request.query_params.get(param, "")
+        return [name for name in value.split(",") if name]
+
+    def get_sparse_fields(self):
+        """return the fields kept by ?fields= and ?exclude=, or None"""
+        if hasattr(self, "_sparse_fields"):
+            return self._sparse_fields
+
+        self._sparse_fields = None
+        params = self.request.query_params
+        if self.action not in ("list", "retrieve") or not (
+            "fields" in params or "exclude" in params
+        ):
+            return None
+
+        available = self.get_serializer_class().Meta.fields
+        fields = self._params_to_names("fields")
+        exclude = self._params_to_names("exclude")
+        unknown = set(fields + exclude) - set(available)
+        if unknown:
+            raise exceptions.ValidationError(
+                f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+        self._sparse_fields = [
+            name
+            for name in available
+            if name == "id"
+            or ((not fields or name in fields) and name not in exclude)
+        ]
+        return self._sparse_fields
+
+    def get_filters(self):
+        """return the validated range filters and ordering of a list"""
+        if not hasattr(self, "_filters"):
+            params = serializers.RecipeFilterSerializer(
+                data=self.request.query_params,
+            )
+            params.is_valid(raise_exception=True)
+            self._filters = params.validated_data
+        return self._filters
+
+    def get_ordering(self):
+        """return the fields recipes are ordered by"""
+        if self.action == "list":
+            return self.get_filters().get("ordering", ["-id"])
+        return ["-id"]
 
     def get_queryset(self):
         """retrieve recipes for authed user"""
         tags = self.request.query_params.get("tags")
         ingredients = self.request.query_params.get("ingredients")
+        ids = self.request.query_params.get("ids")
 
-        queryset = self.queryset
+        queryset = self.queryset.using(self.shard)
         if tags:
             tag_ids = self._params_to_ints(tags)
             queryset = queryset.filter(tags__id__in=tag_ids)
         if ingredients:
             ing_ids = self._params_to_ints(ingredients)
             queryset = queryset.filter(ingredients__id__in=ing_ids)
+        if self.action == "list":
+            filters = self.get_filters()
+            for param, lookup in self.range_filters.items():
+                if param in filters:
+                    queryset = queryset.filter(**{lookup: filters[param]})
+        if ids and self.action == "list":
+            recipe_ids = self._params_to_ints(ids)
+            if len(recipe_ids) > self.max_ids:
+                raise exceptions.ValidationError(
+                    f"At most {self.max_ids} IDs can be fetched at once"
+                )
+            queryset = queryset.filter(id__in=recipe_ids)
 
-        return (
-            queryset.filter(
-                user=self.request.user,
+        ordering = self.get_ordering()
+        if self.action in ("list", "retrieve"):
+            # fields left out of the response are not loaded at all, except
+            # the ones a cursor is built from
+            fields = self.get_sparse_fields()
+            if fields is not None:
+                queryset = queryset.only(
+                    *[name for name in fields if name not in self.relations],
+                    *[name.lstrip("-") for name in ordering],
+                )
+            queryset = queryset.prefetch_related(
+                *[
+                    name
+                    for name in self.relations
+                    if fields is None or name in fields
+                ]
             )
-            .order_by("-id")
-            .distinct()
-        )
+
+        queryset = queryset.filter(user=self.request.user).order_by(*ordering)
+        if tags or ingredients:
+            # only the joins can repeat a recipe, and DISTINCT would keep
+            # the list from being read off the ordering's index
+            queryset = queryset.distinct()
+        return queryset
+
+    @property
+    def paginator(self):
+        """page through the list by cursor only when asked to"""
+        if not hasattr(self, "_paginator"):
+            params = self.request.query_params
+            if (
+                self.pagination_class is None
+                and self.action == "list"
+                and ("cursor" in params or "page_size" in params)
+            ):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+    def get_serializer_context(self):
+        """pass the sparse fieldset on to the serializer"""
+        context = super().get_serializer_context()
+        context["sparse_fields"] = self.get_sparse_fields()
+        return context
 
     def get_serializer_class(self):
         """return the serializer class for request"""
-        if self.action == "list":
+        if self.action == "list" and "ids" in self.request.query_params:
+            return self.serializer_class
+        elif self.action == "list":
             return serializers.RecipeSerializer
-        elif self.action == "upload_image":
+        elif self.action in ("upload_image", "finalize_image_upload"):
             return serializers.RecipeImageSerializer
+        elif self.action in ("create_image_upload", "image_upload"):
+            return serializers.ImageUploadSerializer
+        elif self.action == "similar":
+            return serializers.SimilarRecipeSerializer
+        elif self.action == "pantry":
+            return serializers.PantryRecipeSerializer
         return self.serializer_class
 
+    def retrieve(self, request, *args, **kwargs):
+        return self.coalesce(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method in SAFE_METHODS and request.user.is_authenticated:
+            microcache.mark_cacheable(response, request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
     def perform_create(self, serializer):
         """create recipe"""
         serializer.save(user=self.request.user)
 
-    @action(methods=["POST"], detail=True, url_path="upload-image")
+    def perform_destroy(self, instance):
+        """delete recipe without going through the collector"""
+        deletion.delete_recipes(instance.user_id, [instance.id], self.shard)
+
+    @extend_schema(
+        request=serializers.RecipeBulkDeleteSerializer,
+        responses={204: None},
+    )
+    @action(methods=["POST"], detail=False, url_path="bulk-delete")
+    def bulk_delete(self, request):
+        """delete many recipes at once"""
+        params = serializers.RecipeBulkDeleteSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        ids = set(params.validated_data["ids"])
+        owned = set(
+            Recipe.objects.using(self.shard)
+            .filter(user=request.user, id__in=ids)
+            .values_list("id", flat=True)
+        )
+        unknown = sorted(ids - owned)
+        if unknown:
+            raise exceptions.ValidationError(f"Recipes not found: {unknown}")
+        deletion.delete_recipes(request.user.pk, sorted(owned), self.shard)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        methods=["POST"],
+        detail=True,
+        url_path="upload-image",
+        throttle_scope="upload",
+    )
     def upload_image(self, request, pk=None):
         """Upload image to recipe"""
         recipe = self.get_object()
@@ -100,6 +595,281 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def _get_image_upload(self, recipe, upload_id):
+        """return the recipe's open upload session or raise a 404"""
+        try:
+            return uploads.open_uploads(self.shard).get(
+                pk=upload_id,
+                recipe=recipe,
+            )
+        except ImageUpload.DoesNotExist:
+            raise Http404("No such upload")
+
+    @action(
+        methods=["POST"],
+        detail=True,
+        url_path="image-uploads",
+        url_name="image-upload-list",
+        throttle_scope="upload",
+    )
+    def create_image_upload(self, request, pk=None):
+        """start a resumable image upload for the recipe"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(user=request.user, recipe=recipe)
+        uploads.create_part_file(upload)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(parameters=[UPLOAD_ID_PARAMETER])
+    @extend_schema(
+        methods=["PUT"],
+        request={"application/offset+octet-stream": OpenApiTypes.BINARY},
+        parameters=[
+            OpenApiParameter(
+                "Content-Range",
+                OpenApiTypes.STR,
+                OpenApiParameter.HEADER,
+                required=True,
+                description="Byte range of the chunk, e.g. bytes 0-1023/4096",
+            ),
+        ],
+    )
+    @action(
+        methods=["GET", "PUT", "DELETE"],
+        detail=True,
+        url_path=f"image-uploads/{UPLOAD_ID_PATTERN}",
+        url_name="image-upload-detail",
+        throttle_scope="upload",
+    )
+    def image_upload(self, request, pk=None, upload_id=None):
+        """get the offset of an upload, append a chunk to it or cancel it"""
+        recipe = self.get_object()
+        upload = self._get_image_upload(recipe, upload_id)
+        if request.method == "GET":
+            return Response(self.get_serializer(upload).data)
+        if request.method == "DELETE":
+            uploads.discard(upload)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        try:
+            start, end, total = uploads.parse_content_range(
+                request.headers.get("Content-Range", ""),
+            )
+        except ValueError as exc:
+            return Response(
+                {"detail": str(exc)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        length = end - start + 1
+        if total != upload.size or length != int(
+            request.META.get("CONTENT_LENGTH") or 0
+        ):
+            return Response(
+                {"detail": "Content-Range does not match the upload"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response(
+                {"detail": "Chunk is too large"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        with transaction.atomic(using=self.shard):
+            upload = (
+                ImageUpload.objects.using(self.shard)
+                .select_for_update()
+                .get(pk=upload.pk)
+            )
+            if start != upload.offset:
+                return Response(
+                    self.get_serializer(upload).data,
+                    status=status.HTTP_409_CONFLICT,
+                )
+            try:
+                uploads.write_chunk(upload, start, request.stream, length)
+            except ValueError as exc:
+                return Response(
+                    {"detail": str(exc)},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            upload.offset = start + length
+            upload.save(update_fields=["offset"])
+
+        return Response(self.get_serializer(upload).data)
+
+    @extend_schema(parameters=[UPLOAD_ID_PARAMETER])
+    @action(
+        methods=["POST"],
+        detail=True,
+        url_path=f"image-uploads/{UPLOAD_ID_PATTERN}/finalize",
+        url_name="image-upload-finalize",
+        throttle_scope="upload",
+    )
+    def finalize_image_upload(self, request, pk=None, upload_id=None):
+        """attach a completely received upload as the recipe image"""
+        recipe = self.get_object()
+        upload = self._get_image_upload(recipe, upload_id)
+        if upload.offset != upload.size:
+            return Response(
+                serializers.ImageUploadSerializer(upload).data,
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        with open(uploads.part_path(upload), "rb") as part:
+            image = File(part, name=upload.filename or "image")
+            serializer = self.get_serializer(recipe, data={"image": image})
+            if not serializer.is_valid():
+                return Response(
+                    serializer.errors,
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if not os.path.splitext(image.name)[1]:
+                image.name = f"{image.name}.{image.image.format.lower()}"
+            serializer.save()
+
+        uploads.discard(upload)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "w",
+                OpenApiTypes.INT,
+                enum=settings.THUMBNAIL_WIDTHS,
+                description="Width of the thumbnail in pixels",
+            ),
+            OpenApiParameter(
+                "fmt",
+                OpenApiTypes.STR,
+                enum=list(thumbnails.FORMATS),
+                description="Image format of the thumbnail",
+            ),
+        ],
+        responses={(200, "image/*"): OpenApiTypes.BINARY},
+    )
+    @action(methods=["GET"], detail=True, url_path="image")
+    def image(self, request, pk=None):
+        """return a resized rendition of the recipe image"""
+        recipe = self.get_object()
+        params = serializers.RecipeThumbnailSerializer(
+            data=request.query_params,
+        )
+        params.is_valid(raise_exception=True)
+        if not recipe.image:
+            raise Http404("Recipe has no image")
+
+        width = params.validated_data["w"]
+        fmt = params.validated_data["fmt"]
+        etag = f'"{thumbnails.cache_key(recipe.image.name, width, fmt)}"'
+        if etag in request.headers.get("If-None-Match", ""):
+            return HttpResponseNotModified()
+
+        name = thumbnails.get_thumbnail(recipe.image, width, fmt)
+        content_type = thumbnails.FORMATS[fmt][2]
+        if settings.X_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            response["X-Accel-Redirect"] = f"/internal/thumbnails/{name}"
+        else:
+            response = FileResponse(
+                open(os.path.join(settings.THUMBNAIL_ROOT, name), "rb"),
+                content_type=content_type,
+            )
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, max-age=86400"
+        return response
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "k",
+                OpenApiTypes.INT,
+                description="Number of recipes to return, at most 50",
+            ),
+        ],
+        responses=serializers.SimilarRecipeSerializer(many=True),
+    )
+    @action(methods=["GET"], detail=True)
+    def similar(self, request, pk=None):
+        """return the recipes sharing the most ingredients and tags"""
+        recipe = self.get_object()
+        params = serializers.SimilarRecipesQuerySerializer(
+            data=request.query_params,
+        )
+        params.is_valid(raise_exception=True)
+
+        ranked = similarity.similar_recipes(
+            recipe,
+            params.validated_data["k"],
+            self.shard,
+        )
+        recipes = (
+            self.queryset.using(self.shard)
+            .filter(id__in=[recipe_id for recipe_id, score in ranked])
+            .prefetch_related("tags", "ingredients")
+            .in_bulk()
+        )
+        results = []
+        for recipe_id, score in ranked:
+            if recipe_id in recipes:
+                recipes[recipe_id].similarity = round(score, 4)
+                results.append(recipes[recipe_id])
+        serializer = self.get_serializer(results, many=True)
+        return Response(serializer.data)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "ingredients",
+                OpenApiTypes.STR,
+                required=True,
+                description="Comma separated list of ingredient IDs at hand",
+            ),
+            OpenApiParameter(
+                "max_missing",
+                OpenApiTypes.INT,
+                description="Only return recipes missing at most N",
+            ),
+        ],
+        responses=serializers.PantryRecipeSerializer(many=True),
+    )
+    @action(
+        methods=["GET"],
+        detail=False,
+        pagination_class=PantryPagination,
+    )
+    def pantry(self, request):
+        """return recipes ranked by how much of them the pantry covers"""
+        params = serializers.PantryQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        ranked = pantry.match(
+            request.user,
+            params.validated_data["ingredients"],
+            params.validated_data.get("max_missing"),
+            self.shard,
+        )
+        page = self.paginate_queryset(ranked)
+        recipes = (
+            self.queryset.using(self.shard)
+            .filter(
+                user=request.user,
+                id__in=[recipe_id for recipe_id, matched, missing in page],
+            )
+            .prefetch_related("tags", "ingredients")
+            .in_bulk()
+        )
+        results = []
+        for recipe_id, matched, missing in page:
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.matched = matched
+                recipe.missing = missing
+                recipe.coverage = round(matched / (matched + missing), 4)
+                results.append(recipe)
+        serializer = self.get_serializer(results, many=True)
+        return self.get_paginated_response(serializer.data)
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -114,6 +884,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
 )
 class BaseRecipeAttrViewSet(
+    CoalescedReadMixin,
+    ShardedViewSetMixin,
     mixins.UpdateModelMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
@@ -121,7 +893,7 @@ class BaseRecipeAttrViewSet(
 ):
     """base viewset for recipe attrs"""
 
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -130,7 +902,7 @@ class BaseRecipeAttrViewSet(
             int(self.request.query_params.get("assigned_only", 0)),
         )
 
-        queryset = self.queryset
+        queryset = self.queryset.using(self.shard)
 
         if assigned_only:
             queryset = queryset.filter(recipe__isnull=False)
@@ -142,6 +914,55 @@ class BaseRecipeAttrViewSet(
             .distinct()
         )
 
+    @extend_schema(request=serializers.AttrMergeSerializer)
+    @action(methods=["POST"], detail=False)
+    def merge(self, request):
+        """move recipes over to the target and delete the sources"""
+        params = serializers.AttrMergeSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        bulk.merge(
+            self.queryset.model,
+            request.user,
+            params.validated_data["sources"],
+            params.validated_data["target"],
+            self.shard,
+        )
+        target = self.get_queryset().get(id=params.validated_data["target"])
+        return Response(self.get_serializer(target).data)
+
+    @extend_schema(
+        request=serializers.AttrBulkRenameSerializer,
+        responses={204: None},
+    )
+    @action(methods=["POST"], detail=False)
+    def rename(self, request):
+        """rename many items at once"""
+        params = serializers.AttrBulkRenameSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        names = {
+            item["id"]: item["name"]
+            for item in params.validated_data["items"]
+        }
+        bulk.rename(self.queryset.model, request.user, names, self.shard)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @extend_schema(
+        request=serializers.AttrBulkDeleteSerializer,
+        responses={204: None},
+    )
+    @action(methods=["POST"], detail=False, url_path="bulk-delete")
+    def bulk_delete(self, request):
+        """delete many items at once"""
+        params = serializers.AttrBulkDeleteSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        bulk.delete(
+            self.queryset.model,
+            request.user,
+            params.validated_data["ids"],
+            self.shard,
+        )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """View for managing tags api"""
@@ -155,3 +976,84 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
 
     serializer_class = serializers.IngredientSerializer
     queryset = Ingredient.objects.all()
+
+
+class ShoppingListView(ShardedViewSetMixin, APIView):
+    """merge the ingredients of several recipes into one list"""
+
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    read_only = True
+
+    @extend_schema(
+        request=serializers.ShoppingListRequestSerializer,
+        responses=serializers.ShoppingListSerializer,
+    )
+    def post(self, request):
+        """return each ingredient of the recipes once, with its count
+
+        A recipe listed more than once counts that many times.
+        """
+        params = serializers.ShoppingListRequestSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        requested = Counter(params.validated_data["recipes"])
+
+        owned = set(
+            Recipe.objects.using(self.shard)
+            .filter(user=request.user, id__in=requested)
+            .values_list("id", flat=True)
+        )
+        unknown = sorted(set(requested) - owned)
+        if unknown:
+            raise exceptions.ValidationError(
+                {"recipes": [f"Recipes not found: {unknown}"]}
+            )
+
+        repeats = [
+            When(recipe_id=recipe_id, then=Value(times))
+            for recipe_id, times in requested.items()
+            if times > 1
+        ]
+        count = (
+            Sum(Case(*repeats, default=Value(1), output_field=IntegerField()))
+            if repeats
+            else Count("id")
+        )
+        items = (
+            Recipe.ingredients.through.objects.using(self.shard)
+            .filter(recipe_id__in=owned)
+            .values("ingredient_id", "ingredient__name")
+            .annotate(count=count)
+            .order_by("ingredient__name", "ingredient_id")
+        )
+        serializer = serializers.ShoppingListSerializer(
+            {"recipes": sorted(owned), "items": items},
+        )
+        return Response(serializer.data)
+
+
+class RecipeMediaView(ShardedViewSetMixin, APIView):
+    """serve a recipe image to the user owning the recipe"""
+
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses={(200, "image/*"): OpenApiTypes.BINARY})
+    def get(self, request, path):
+        """return the image, handing the bytes to nginx when possible"""
+        owned = (
+            Recipe.objects.using(self.shard)
+            .filter(user=request.user, image=path)
+            .exists()
+        )
+        if not owned:
+            raise Http404("No such image")
+
+        if settings.X_ACCEL_REDIRECT:
+            content_type = mimetypes.guess_type(path)[0]
+            response = HttpResponse(
+                content_type=content_type or "application/octet-stream",
+            )
+            response["X-Accel-Redirect"] = f"/internal/media/{quote(path)}"
+            return response
+        return serve(request, path, document_root=settings.MEDIA_ROOT)
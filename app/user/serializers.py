@@ -9,6 +9,8 @@ from django.contrib.auth import (
 from django.utils.translation import gettext as _
 from rest_framework import serializers
 
+from core.models import AccountDeletion
+
 
 class UserSerializer(serializers.ModelSerializer):
     """serialize for the user object"""
@@ -59,3 +61,19 @@ class AuthTokenSerializer(serializers.Serializer):
 
         attrs["user"] = user
         return attrs
+
+
+class AccountDeletionSerializer(serializers.ModelSerializer):
+    """serializer for the progress of an account deletion"""
+
+    class Meta:
+        model = AccountDeletion
+        fields = [
+            "id",
+            "status",
+            "recipes_total",
+            "recipes_deleted",
+            "created_at",
+            "finished_at",
+        ]
+        read_only_fields = fields
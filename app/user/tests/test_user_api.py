@@ -12,6 +12,11 @@ TOKEN_URL = reverse("user:token")
 ME_URL = reverse("user:me")
 
 
+def deletion_url(job_id):
+    """return the progress url of an account deletion"""
+    return reverse("user:deletion", args=[job_id])
+
+
 def create_user(**params):
     """Create and return a new user"""
     return get_user_model().objects.create_user(**params)
@@ -166,3 +171,16 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload["name"])
         self.assertTrue(self.user.check_password(payload["password"]))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_delete_account_queues_job(self):
+        """test deleting the account locks it and reports progress"""
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+        progress = APIClient().get(deletion_url(res.data["id"]))
+        self.assertEqual(progress.status_code, status.HTTP_200_OK)
+        self.assertEqual(progress.data["status"], "pending")
+        self.assertEqual(progress.data["recipes_deleted"], 0)
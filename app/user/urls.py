@@ -9,4 +9,9 @@ urlpatterns = [
     path("create/", views.CreateUserView.as_view(), name="create"),
     path("token/", views.CreateTokenView.as_view(), name="token"),
     path("me/", views.ManageUserView.as_view(), name="me"),
+    path(
+        "deletions/<uuid:pk>/",
+        views.AccountDeletionView.as_view(),
+        name="deletion",
+    ),
 ]
@@ -2,10 +2,17 @@
 Views for the user API
 """
 
-from rest_framework import generics, authentication, permissions
+from drf_spectacular.utils import extend_schema
+from rest_framework import generics, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
+
+from core import deletion, microcache
+from core.authentication import CachedTokenAuthentication
+from core.models import AccountDeletion
 from user.serializers import (
+    AccountDeletionSerializer,
     UserSerializer,
     AuthTokenSerializer,
 )
@@ -15,23 +22,53 @@ class CreateUserView(generics.CreateAPIView):
     """Create a new user in the system"""
 
     serializer_class = UserSerializer
+    throttle_scope = "login"
 
 
 class CreateTokenView(ObtainAuthToken):
     """create a new auth token for user"""
 
     serializer_class = AuthTokenSerializer
+    throttle_scope = "login"
 
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """manage the authenticated user"""
 
     serializer_class = UserSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
         """retrieve and return the authed user"""
         return self.request.user
+
+    @extend_schema(responses={202: AccountDeletionSerializer})
+    def delete(self, request, *args, **kwargs):
+        """lock the account and queue the deletion of all its data"""
+        job = deletion.request_account_deletion(request.user)
+        return Response(
+            AccountDeletionSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (
+            request.method not in permissions.SAFE_METHODS
+            and request.user.is_authenticated
+        ):
+            microcache.mark_purge(response, request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class AccountDeletionView(generics.RetrieveAPIView):
+    """report the progress of an account deletion"""
+
+    serializer_class = AccountDeletionSerializer
+    queryset = AccountDeletion.objects.all()
+    # the unguessable job id is all a deleted user still has
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
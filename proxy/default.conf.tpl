@@ -1,13 +1,100 @@
+# micro-cache of recipe reads, used while the app tags responses as
+# cacheable (MICROCACHE_TTL); see microcache.js for keys and purging
+js_import microcache from /etc/nginx/microcache.js;
+js_set $microcache_key microcache.key;
+js_shared_dict_zone zone=microcache_users:1m timeout=1h evict;
+js_shared_dict_zone zone=microcache_generations:1m type=number timeout=1h evict;
+
+uwsgi_cache_path /tmp/microcache levels=1:2 keys_zone=microcache:10m
+                 max_size=256m inactive=1m use_temp_path=off;
+
+# only responses the app tagged with their user are stored
+map $upstream_http_x_cache_tag $microcache_skip {
+    ""      1;
+    default 0;
+}
+
 server {
     listen ${LISTEN_PORT};
 
-    location /static {
-        alias /vol/static;
+    # media is private, the app authorizes each request and hands the file
+    # over here; nginx answers Range and conditional requests itself
+    location /internal/media/ {
+        internal;
+        alias /vol/static/media/;
+    }
+
+    location ~ "^/internal/(media/uploads/recipe/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+)$" {
+        internal;
+        alias /vol/static/$1;
+        add_header Cache-Control "private, max-age=31536000, immutable";
+    }
+
+    location /internal/thumbnails/ {
+        internal;
+        alias /vol/static/thumbnails/;
+        add_header Cache-Control "private, max-age=86400";
+    }
+
+    # cache and purge instructions are for this proxy only
+    uwsgi_hide_header X-Cache-Tag;
+    uwsgi_hide_header X-Cache-Purge;
+
+    # collectstatic writes .gz siblings next to the hashed files, which
+    # never change content and so are cached for good
+    location /static/static/ {
+        root        /vol/static;
+        gzip_static on;
+        gzip_vary   on;
+
+        location ~ "\.[0-9a-f]{12}\.\w+$" {
+            add_header Cache-Control "public, max-age=31536000, immutable";
+        }
+    }
+
+    # resumable upload chunks are read fully by nginx before uWSGI sees
+    # them, so slow clients never hold a worker
+    location ~ ^/api/recipe/recipes/\d+/image-uploads/ {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        uwsgi_request_buffering on;
+        client_body_buffer_size 1M;
+        client_max_body_size    8M;
+        js_header_filter        microcache.record;
+    }
+
+    # change streams stay open, each event is passed on as it comes; their
+    # URLs carry single-use tickets, which are kept out of the logs anyway
+    location = /api/recipe/events/ {
+        access_log              off;
+        proxy_pass              http://${EVENTS_HOST}:${EVENTS_PORT};
+        proxy_http_version      1.1;
+        proxy_set_header        Connection "";
+        proxy_buffering         off;
+        proxy_read_timeout      1h;
+    }
+
+    # identical reads are answered from the micro-cache; one request per
+    # key goes to the app while the others wait or get the stale copy
+    location /api/recipe/recipes/ {
+        uwsgi_pass                   ${APP_HOST}:${APP_PORT};
+        include                      /etc/nginx/uwsgi_params;
+        client_max_body_size         10M;
+        uwsgi_cache                  microcache;
+        uwsgi_cache_key              $microcache_key;
+        uwsgi_no_cache               $microcache_skip;
+        uwsgi_cache_lock             on;
+        uwsgi_cache_lock_timeout     5s;
+        uwsgi_cache_use_stale        updating error timeout http_500 http_503;
+        uwsgi_cache_background_update on;
+        js_header_filter             microcache.record;
+        add_header                   X-Cache-Status $upstream_cache_status;
     }
 
     location / {
         uwsgi_pass              ${APP_HOST}:${APP_PORT};
         include                 /etc/nginx/uwsgi_params;
         client_max_body_size    10M;
+        js_header_filter        microcache.record;
     }
-}
\ No newline at end of file
+}
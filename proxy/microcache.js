@@ -0,0 +1,46 @@
+// Keys of the recipe micro-cache and purging by user.
+//
+// Responses are cached under a hash of the auth token, so tokens never
+// reach the cache files, and the generation of the token's user. The app
+// tags cacheable responses with their user, which teaches this nginx the
+// user behind each token, and names the user to purge on writes, which
+// moves the user on to a new generation and leaves their cached
+// responses unreachable, whichever token wrote.
+
+import crypto from "crypto";
+
+const users = ngx.shared.microcache_users;
+const generations = ngx.shared.microcache_generations;
+
+function tokenHash(r) {
+    const auth = r.headersIn.Authorization || "";
+    return crypto.createHash("sha256").update(auth).digest("hex");
+}
+
+function key(r) {
+    const token = tokenHash(r);
+    const user = users.get(token);
+    // users not seen yet, or never purged, are in generation 0
+    const generation = (user && generations.get(user)) || 0;
+    return [
+        token,
+        generation,
+        r.variables.request_uri,
+        r.headersIn.Accept || "",
+    ].join("|");
+}
+
+function record(r) {
+    const tag = r.variables.upstream_http_x_cache_tag;
+    const purge = r.variables.upstream_http_x_cache_purge;
+    if (tag || purge) {
+        users.set(tokenHash(r), tag || purge);
+    }
+    if (purge) {
+        // starting from the clock, a generation dropped from the zone is
+        // never handed out again
+        generations.incr(purge, 1, Date.now());
+    }
+}
+
+export default { key, record };
@@ -2,5 +2,7 @@
 
 set -e
 
-envsubst < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
-nginx -g 'daemon off;'
\ No newline at end of file
+# only our variables, nginx's own $variables are left for nginx
+envsubst '${LISTEN_PORT} ${APP_HOST} ${APP_PORT} ${EVENTS_HOST} ${EVENTS_PORT}' \
+    < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
+nginx -g 'daemon off;'
@@ -0,0 +1,8 @@
+#!/bin/sh
+
+set -e
+
+python manage.py wait_for_db
+
+exec python manage.py process_account_deletions \
+    --batch-size "${ACCOUNT_DELETION_BATCH_SIZE:-500}"
@@ -0,0 +1,10 @@
+#!/bin/sh
+
+set -e
+
+python manage.py wait_for_db
+
+# one event loop holds every change stream, sharing a single LISTEN
+# connection to PostgreSQL
+exec uvicorn app.asgi:application --host 0.0.0.0 --port 9001 \
+    --no-access-log --timeout-keep-alive 5
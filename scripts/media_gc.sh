@@ -0,0 +1,12 @@
+#!/bin/sh
+
+set -e
+
+python manage.py wait_for_db
+
+while true; do
+    python manage.py collect_orphaned_images --delete \
+        --max-rate "${MEDIA_GC_MAX_RATE:-200}" \
+        --limit "${MEDIA_GC_LIMIT:-100000}"
+    sleep "${MEDIA_GC_INTERVAL:-86400}"
+done
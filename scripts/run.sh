@@ -2,8 +2,11 @@
 
 set -e
 
-python manage.py wait_for_db
-python manage.py collectstatic --noinput
-python manage.py migrate
+# waits for every shard, then collects static files and migrates only
+# when something changed, printing how long each phase took
+python manage.py startup
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
\ No newline at end of file
+# app.wsgi is imported and warmed up once in the master, then the workers
+# are forked from it and share those pages copy-on-write
+uwsgi --socket :9000 --workers 4 --master --enable-threads --need-app \
+    --pidfile /tmp/uwsgi.pid --module app.wsgi